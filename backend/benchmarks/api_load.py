@@ -0,0 +1,390 @@
+"""Load test of the API hot paths against an in-memory PostgREST.
+
+Scenarios, mixed by ``--mix`` weights:
+  checkout   a customer's checkout page polling GET /api/pay/{invoice_id}
+  webhook    a burst of ``--burst`` concurrent payment notifications
+             (POST /api/payments/webhook), one in ten of them a duplicate
+  dashboard  a merchant opening the dashboard: GET /api/dashboard/metrics
+             and the first invoice page, revalidated with If-None-Match
+  paging     a merchant paging through GET /api/invoices (``--pages``)
+  qr         POST /api/qr-generator
+  login      passkey login: POST /api/login/begin, then /api/login/complete
+
+The app runs in-process on ``httpx.ASGITransport`` and its Supabase client
+is routed to ``benchmarks/fake_postgrest.py``, which answers every query
+after ``--db-latency-ms``. The scenario sequence and dataset come from
+``--seed``, so two runs issue the same requests in the same order. Reports
+requests/sec and p50/p90/p99/max latency per route. Application logging
+(print) is silenced while measuring; its cost still counts.
+
+Regression gate: save a baseline, make the change, compare on the same
+machine. The run exits with status 1 if any route's p50 or p99 grew, or
+its throughput fell, by more than ``--tolerance``. ``--repeat`` takes the
+median of several runs, which keeps the gate from tripping on noise:
+    python benchmarks/api_load.py --repeat 3 --save /tmp/baseline.json
+    python benchmarks/api_load.py --repeat 3 --baseline /tmp/baseline.json
+
+``--url`` drives a running server instead (start it against
+``fake_postgrest.py`` with the same --seed/--merchants/--invoices and the
+same JWT_SECRET as ``--jwt-secret``).
+
+Run from the backend directory:
+    python benchmarks/api_load.py --iterations 3000 --users 32 --db-latency-ms 2
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import jwt
+
+from benchmarks.fake_postgrest import API_KEY, FakePostgREST, install, seed_dataset
+
+SCENARIOS = ("checkout", "webhook", "dashboard", "paging", "qr", "login")
+DEFAULT_MIX = "checkout=40,webhook=5,dashboard=20,paging=15,qr=10,login=10"
+ORIGIN = "http://localhost:3000"
+# Below this many milliseconds a latency change is noise, whatever the percentage
+NOISE_FLOOR_MS = 1.0
+# p99 of fewer samples is little more than the maximum; don't gate on it
+MIN_P99_SAMPLES = 200
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] * 1000
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.enabled = True
+
+    async def request(self, client: httpx.AsyncClient, route: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            if self.enabled:
+                self.statuses[route][type(e).__name__] += 1
+            return None
+        if self.enabled:
+            self.latencies[route].append(time.perf_counter() - started)
+            self.statuses[route][response.status_code] += 1
+        return response
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, manifest: dict, args, rng: random.Random):
+        self.client = client
+        self.args = args
+        self.rng = rng
+        self.merchants = manifest["merchants"]
+        self.credentials = manifest["credentials"]
+        # Checkout pages poll from the front of the issued invoices, webhooks pay from the back
+        self.issued = list(manifest["issued"])
+        self.paid = []
+        self.etags = {}
+        self.recorder = Recorder()
+        expires = datetime.now(timezone.utc) + timedelta(hours=1)
+        self.tokens = {email: jwt.encode({"email": email, "exp": expires}, args.jwt_secret, algorithm="HS256")
+                       for email in self.merchants}
+
+    def auth(self, email: str, route: str = None) -> dict:
+        headers = {"Authorization": f"Bearer {self.tokens[email]}"}
+        if route and (email, route) in self.etags:
+            headers["If-None-Match"] = self.etags[(email, route)]
+        return headers
+
+    def remember_etag(self, email: str, route: str, response) -> None:
+        if response is not None and response.headers.get("etag"):
+            self.etags[(email, route)] = response.headers["etag"]
+
+    async def checkout(self) -> None:
+        if not self.issued:
+            return
+        invoice_id, _ = self.issued[self.rng.randrange(min(len(self.issued), 200))]
+        await self.recorder.request(self.client, "GET /api/pay/{invoice_id}", "GET", f"/api/pay/{invoice_id}")
+
+    async def webhook(self) -> None:
+        notifications = []
+        for _ in range(self.args.burst):
+            if self.paid and self.rng.random() < 0.1:
+                notifications.append(self.rng.choice(self.paid))
+            elif self.issued:
+                invoice_id, units = self.issued.pop()
+                tx_hash = "0x%064x" % self.rng.getrandbits(256)
+                notification = {"invoice_id": invoice_id, "tx_hash": tx_hash, "amount": units / 1e6,
+                                "amount_units": units, "token": "USDC"}
+                self.paid.append(notification)
+                notifications.append(notification)
+        await asyncio.gather(*(
+            self.recorder.request(self.client, "POST /api/payments/webhook", "POST", "/api/payments/webhook",
+                                  json=notification)
+            for notification in notifications
+        ))
+
+    async def dashboard(self) -> None:
+        email = self.rng.choice(self.merchants)
+        for route, url in (("GET /api/dashboard/metrics", "/api/dashboard/metrics"),
+                           ("GET /api/invoices", "/api/invoices?limit=20")):
+            response = await self.recorder.request(self.client, route, "GET", url, headers=self.auth(email, route))
+            self.remember_etag(email, route, response)
+
+    async def paging(self) -> None:
+        email = self.rng.choice(self.merchants)
+        for page in range(self.args.pages):
+            response = await self.recorder.request(
+                self.client, "GET /api/invoices", "GET", f"/api/invoices?limit=50&offset={page * 50}",
+                headers=self.auth(email)
+            )
+            if response is None or response.status_code != 200 or len(response.json()) < 49:
+                break
+
+    async def qr(self) -> None:
+        await self.recorder.request(self.client, "POST /api/qr-generator", "POST", "/api/qr-generator", json={
+            "to_address": "0x4BD84bAc39cFd77C14D08d51b65f584664Ac1FF5",
+            "amount": self.rng.randrange(1, 10 ** 9),
+        })
+
+    async def login(self) -> None:
+        email = self.rng.choice(self.merchants)
+        begin = await self.recorder.request(self.client, "POST /api/login/begin", "POST", "/api/login/begin",
+                                            json={"email": email})
+        if begin is None or begin.status_code != 200:
+            return
+        client_data = json.dumps({"type": "webauthn.get", "challenge": begin.json()["challenge"],
+                                  "origin": ORIGIN, "crossOrigin": False}).encode()
+        assertion = {
+            "rawId": base64.b64encode(self.credentials[email]).decode(),
+            "response": {
+                "clientDataJSON": base64.b64encode(client_data).decode(),
+                "authenticatorData": base64.b64encode(bytes(37)).decode(),
+                "signature": base64.b64encode(bytes(70)).decode(),
+            },
+        }
+        await self.recorder.request(self.client, "POST /api/login/complete", "POST", "/api/login/complete",
+                                    json={"email": email, "assertion": assertion})
+
+    async def run(self, plan: list) -> float:
+        """Run every scenario in ``plan`` across ``--users`` concurrent users; returns elapsed seconds"""
+        steps = iter(plan)
+
+        async def user():
+            for name in steps:
+                await getattr(self, name)()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(self.args.users)))
+        return time.perf_counter() - started
+
+
+def summarize(recorder: Recorder, seconds: float) -> dict:
+    routes = {}
+    for route in sorted(recorder.statuses):
+        latencies = recorder.latencies[route]
+        statuses = recorder.statuses[route]
+        routes[route] = {
+            "requests": sum(statuses.values()),
+            "rps": round(len(latencies) / seconds, 1),
+            "p50_ms": round(percentile(latencies, 0.5), 2) if latencies else None,
+            "p90_ms": round(percentile(latencies, 0.9), 2) if latencies else None,
+            "p99_ms": round(percentile(latencies, 0.99), 2) if latencies else None,
+            "max_ms": round(max(latencies) * 1000, 2) if latencies else None,
+            "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+            "errors": sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= 500),
+        }
+    every = [latency for latencies in recorder.latencies.values() for latency in latencies]
+    total = {
+        "requests": len(every),
+        "rps": round(len(every) / seconds, 1),
+        "p50_ms": round(percentile(every, 0.5), 2) if every else None,
+        "p99_ms": round(percentile(every, 0.99), 2) if every else None,
+        "errors": sum(route["errors"] for route in routes.values()),
+    }
+    return {"seconds": round(seconds, 3), "routes": routes, "total": total}
+
+
+def print_report(summary: dict) -> None:
+    print(f"  {'route':<30} {'reqs':>6} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses")
+    for route, stats in summary["routes"].items():
+        statuses = " ".join(f"{status}:{count}" for status, count in stats["statuses"].items())
+        cells = [stats[key] if stats[key] is not None else float("nan") for key in ("p50_ms", "p90_ms", "p99_ms", "max_ms")]
+        print(f"  {route:<30} {stats['requests']:>6} {stats['rps']:>8.1f} "
+              + " ".join(f"{cell:>8.2f}" for cell in cells) + f"  {statuses}")
+    total = summary["total"]
+    print(f"  {'all routes':<30} {total['requests']:>6} {total['rps']:>8.1f} {total['p50_ms'] or 0:>8.2f} "
+          f"{'':>8} {total['p99_ms'] or 0:>8.2f}  in {summary['seconds']}s, {total['errors']} errors")
+
+
+def compare(summary: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of ``summary`` against ``baseline`` beyond ``tolerance`` (a fraction)"""
+    problems = []
+    for route, before in baseline["routes"].items():
+        after = summary["routes"].get(route)
+        if after is None:
+            problems.append(f"{route}: no requests this run")
+            continue
+        for key in ("p50_ms", "p99_ms"):
+            if before[key] is None or after[key] is None:
+                continue
+            if key == "p99_ms" and min(before["requests"], after["requests"]) < MIN_P99_SAMPLES:
+                continue
+            if after[key] > before[key] * (1 + tolerance) and after[key] - before[key] > NOISE_FLOOR_MS:
+                problems.append(f"{route}: {key} {before[key]} -> {after[key]}")
+        if after["rps"] < before["rps"] * (1 - tolerance):
+            problems.append(f"{route}: req/s {before['rps']} -> {after['rps']}")
+        if after["errors"] > before["errors"]:
+            problems.append(f"{route}: errors {before['errors']} -> {after['errors']}")
+    return problems
+
+
+def configure_environment(args) -> None:
+    # Must happen before main is imported: settings are read at import time
+    os.environ.update(
+        DATABASE_BACKEND="supabase",
+        DATABASE_URL="http://fake-postgrest.local",
+        DATABASE_APIKEY=API_KEY,
+        JWT_SECRET=args.jwt_secret,
+        JWT_ALGORITHM="HS256",
+        JWT_KEYS_DIR="",
+        SRI_MODE="mock",
+        SRI_CERT_PATH="",
+        EVENTS_POLL_INTERVAL="0",
+        JOB_WORKERS="0",
+        EINVOICE_POLL_INTERVAL="0",
+        INVOICE_ARCHIVE_INTERVAL="0",
+        # Every simulated client shares one address: keep the limiter's cost in the figures, not its 429s
+        RATE_LIMIT_SCALE="1000000",
+        TRACE_EXPORTER="none",
+    )
+
+
+def median_summary(runs: list) -> dict:
+    """Per-route median of every figure across repeated runs"""
+    def median(values):
+        values = [value for value in values if value is not None]
+        return statistics.median(values) if values else None
+
+    merged = {"seconds": median([run["seconds"] for run in runs]), "routes": {}, "total": {}}
+    for route in sorted({route for run in runs for route in run["routes"]}):
+        stats = [run["routes"][route] for run in runs if route in run["routes"]]
+        merged["routes"][route] = {key: median([entry[key] for entry in stats])
+                                   for key in ("requests", "rps", "p50_ms", "p90_ms", "p99_ms", "max_ms", "errors")}
+        statuses = Counter()
+        for entry in stats:
+            statuses.update(entry["statuses"])
+        merged["routes"][route]["statuses"] = dict(sorted(statuses.items()))
+    for key in runs[0]["total"]:
+        merged["total"][key] = median([run["total"][key] for run in runs])
+    return merged
+
+
+async def run_once(args, main_app) -> tuple:
+    """One seeded run on a fresh dataset; returns (summary, fake database)"""
+    rng = random.Random(args.seed)
+    db = FakePostgREST(args.db_latency_ms, args.db_jitter_ms, args.seed)
+    manifest = seed_dataset(db, args.merchants, args.invoices, args.seed)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=30,
+                                   limits=httpx.Limits(max_connections=args.users))
+    else:
+        install(db)
+        transport = httpx.ASGITransport(app=main_app, raise_app_exceptions=False)
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench", headers={"Origin": ORIGIN})
+
+    weights = parse_mix(args.mix)
+    plan = rng.choices(list(weights), list(weights.values()), k=args.warmup + args.iterations)
+    test = LoadTest(client, manifest, args, rng)
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        # Warm up lazy imports (qrcode, fido2) and caches without recording
+        test.recorder.enabled = False
+        await test.run(plan[:args.warmup])
+        test.recorder.enabled = True
+        seconds = await test.run(plan[args.warmup:])
+    await client.aclose()
+    return summarize(test.recorder, seconds), db
+
+
+async def main_async(args) -> dict:
+    main_app = None
+    if not args.url:
+        configure_environment(args)
+        import main
+        main_app = main.app
+
+    runs = []
+    for _ in range(args.repeat):
+        summary, db = await run_once(args, main_app)
+        runs.append(summary)
+
+    print(f"{args.iterations} scenarios ({args.mix}), {args.users} users, "
+          f"{len(db.tables['invoices'])} invoices, db latency {args.db_latency_ms} ms, seed {args.seed}"
+          + (f", median of {args.repeat} runs" if args.repeat > 1 else ""))
+    summary = median_summary(runs) if len(runs) > 1 else runs[0]
+    summary["config"] = {key: value for key, value in vars(args).items() if key not in ("save", "baseline")}
+    if not args.url:
+        summary["db_requests"] = dict(db.requests.most_common())
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000, help="scenarios to run")
+    parser.add_argument("--warmup", type=int, default=50, help="scenarios run before measuring")
+    parser.add_argument("--users", type=int, default=16, help="concurrent virtual users")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario weights")
+    parser.add_argument("--burst", type=int, default=20, help="notifications per webhook burst")
+    parser.add_argument("--pages", type=int, default=3, help="invoice pages per paging scenario")
+    parser.add_argument("--db-latency-ms", type=float, default=2)
+    parser.add_argument("--db-jitter-ms", type=float, default=0)
+    parser.add_argument("--merchants", type=int, default=20)
+    parser.add_argument("--invoices", type=int, default=500, help="invoices per merchant")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="runs to take the median of")
+    parser.add_argument("--jwt-secret", default="bench-secret")
+    parser.add_argument("--url", help="base URL of a running server instead of the in-process app")
+    parser.add_argument("--save", help="write the results as JSON")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed regression, as a fraction")
+    args = parser.parse_args()
+
+    summary = asyncio.run(main_async(args))
+    print_report(summary)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(summary, json.load(f), args.tolerance)
+        if problems:
+            print(f"Regressions beyond {args.tolerance:.0%}:")
+            for problem in problems:
+                print(f"  {problem}")
+            raise SystemExit(1)
+        print(f"No regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Throughput of the e-invoice document stage in documents/sec.
+
+Stages, each over the same ``--documents`` synthetic paid invoices:
+  * xml            access key + streamed factura XML, no signature
+  * sign-reload    XML signed after parsing the PKCS#12 file for every
+                   document (what signing without a cached signer costs)
+  * sign           XML signed with the cached signer, one process
+  * pool-N         ``generate_batch`` split across N spawned processes,
+                   as the pipeline does with EINVOICE_SIGN_WORKERS=N
+
+Uses ``--cert``/``--password`` if given, otherwise a throwaway
+self-signed 2048-bit RSA certificate.
+
+Run from the backend directory:
+    python benchmarks/einvoice_documents.py --documents 2000 --workers 1 2 4
+"""
+import argparse
+import datetime
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import BestAvailableEncryption, pkcs12
+from cryptography.x509.oid import NameOID
+
+from utils.einvoice_documents import generate_batch, init_worker
+from utils.sri_xml import build_invoice_xml, invoice_access_key
+from utils.xades import XadesSigner, load_signer
+
+ENVIRONMENT = 1
+
+
+def make_pairs(count: int, items_per_invoice: int) -> list:
+    merchant = {"email": "merchant@example.com", "name": "Bench Store", "tax_number": "1790012345001",
+                "address": "Av. Amazonas N34-451, Quito"}
+    return [
+        ({
+            "id": f"00000000-0000-4000-8000-{index:012d}",
+            "invoice_id": f"INV-20250830-{index:08X}",
+            "merchant_email": merchant["email"],
+            "customer_email": f"customer{index}@example.com",
+            "items": [{"name": f"Item {n}", "qty": n + 1, "unit_price": 9.99} for n in range(items_per_invoice)],
+            "subtotal": 9.99,
+            "tax_amount": 1.5,
+            "tax_rate": 0.15,
+            "total": 11.49,
+            "paid_at": "2025-08-30T15:00:00+00:00",
+            "tx_hash": "0x" + "ab" * 32,
+            "einvoice_sequential": index + 1,
+        }, merchant)
+        for index in range(count)
+    ]
+
+
+def make_certificate(directory: str) -> tuple:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Bench Store"),
+                      x509.NameAttribute(NameOID.COUNTRY_NAME, "EC")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    path = os.path.join(directory, "bench.p12")
+    with open(path, "wb") as f:
+        f.write(pkcs12.serialize_key_and_certificates(b"bench", key, certificate, None,
+                                                      BestAvailableEncryption(b"bench")))
+    return path, "bench"
+
+
+def xml_only(pairs: list) -> None:
+    for invoice, merchant in pairs:
+        build_invoice_xml(invoice, merchant, invoice_access_key(invoice, merchant, ENVIRONMENT), ENVIRONMENT)
+
+
+def sign_reload(pairs: list, cert_path: str, password: str) -> None:
+    for invoice, merchant in pairs:
+        xml = build_invoice_xml(invoice, merchant, invoice_access_key(invoice, merchant, ENVIRONMENT), ENVIRONMENT)
+        with open(cert_path, "rb") as f:
+            private_key, certificate, _ = pkcs12.load_key_and_certificates(f.read(), password.encode())
+        XadesSigner(private_key, certificate).sign(xml)
+
+
+def run_pool(pairs: list, workers: int, cert_path: str, password: str) -> float:
+    """Seconds to generate ``pairs`` on a warm pool of ``workers`` processes"""
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_worker, initargs=(cert_path, password)) as pool:
+        # Start every process and load the certificate before timing
+        list(pool.map(generate_batch, [pairs[:1]] * workers, [ENVIRONMENT] * workers))
+        size = -(-len(pairs) // workers)
+        chunks = [pairs[start:start + size] for start in range(0, len(pairs), size)]
+        started = time.perf_counter()
+        results = list(pool.map(generate_batch, chunks, [ENVIRONMENT] * len(chunks)))
+        elapsed = time.perf_counter() - started
+    errors = [document["error"] for chunk in results for document in chunk if "error" in document]
+    if errors:
+        raise SystemExit(f"{len(errors)} documents failed: {errors[0]}")
+    return elapsed
+
+
+def report(name: str, count: int, seconds: float) -> None:
+    print(f"  {name:<12} {count / seconds:9.0f} docs/sec  {seconds * 1000 / count:7.3f} ms/doc")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--items", type=int, default=3, help="line items per invoice")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--cert", help="PKCS#12 signing certificate")
+    parser.add_argument("--password", default="")
+    args = parser.parse_args()
+
+    pairs = make_pairs(args.documents, args.items)
+    with tempfile.TemporaryDirectory() as directory:
+        cert_path, password = (args.cert, args.password) if args.cert else make_certificate(directory)
+        print(f"{args.documents} documents, {args.items} items each, {os.cpu_count()} CPUs")
+
+        started = time.perf_counter()
+        xml_only(pairs)
+        report("xml", len(pairs), time.perf_counter() - started)
+
+        # Parsing per document is slow; a slice is enough to measure it
+        sample = pairs[:max(len(pairs) // 20, 20)]
+        started = time.perf_counter()
+        sign_reload(sample, cert_path, password)
+        report("sign-reload", len(sample), time.perf_counter() - started)
+
+        init_worker(cert_path, password)
+        load_signer(cert_path, password)
+        started = time.perf_counter()
+        generate_batch(pairs, ENVIRONMENT)
+        report("sign", len(pairs), time.perf_counter() - started)
+
+        for workers in args.workers:
+            report(f"pool-{workers}", len(pairs), run_pool(pairs, workers, cert_path, password))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Load test of the two-phase SRI workflow against the stub provider.
+
+Submits ``--documents`` e-invoices in batches of ``--batch-size`` with
+``--concurrency`` requests in flight, then polls authorization for
+``--auth-batch-size`` access keys per request until every document is
+authorized. Reports documents/sec per phase and request latency
+percentiles. The stub runs in-process unless ``--url`` points at a running
+``benchmarks/mock_sri.py``.
+
+Run from the backend directory:
+    python benchmarks/einvoice_pipeline.py --documents 5000 --latency-ms 20 --auth-delay-ms 500
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from benchmarks import mock_sri
+from utils.einvoice_pipeline import AUTHORIZED, RECEIVED, LiveSRIProvider
+from utils.sri_client import CircuitBreaker, SRIClient
+
+
+def make_documents(count: int) -> list:
+    return [
+        {
+            "invoice_id": f"INV-20250830-{index:08d}",
+            "merchant": {"name": "Bench Store", "email": "merchant@example.com", "tax_number": "1790012345001"},
+            "customer": {"email": f"customer{index}@example.com"},
+            "items": [{"name": "Item", "qty": 1, "unit_price": 9.99}],
+            "subtotal": 9.99,
+            "tax_amount": 1.2,
+            "total": 11.19,
+            "payment_method": "CRYPTO",
+            "payment_reference": "0x" + "ab" * 32,
+        }
+        for index in range(count)
+    ]
+
+
+async def timed(latencies: list, coro):
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_phase(batches: list, call, concurrency: int, latencies: list) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(batch):
+        async with semaphore:
+            return await timed(latencies, call(batch))
+
+    results = await asyncio.gather(*(one(batch) for batch in batches))
+    return [item for result in results for item in result]
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] * 1000
+
+
+def report(name: str, count: int, seconds: float, latencies: list) -> None:
+    print(f"  {name:<14} {count / seconds:9.0f} docs/sec  {len(latencies):5d} requests  "
+          f"p50 {percentile(latencies, 0.5):6.1f} ms  p95 {percentile(latencies, 0.95):6.1f} ms  "
+          f"mean {statistics.mean(latencies) * 1000:6.1f} ms")
+
+
+async def main_async(args) -> None:
+    if args.url:
+        base_url, transport = args.url, None
+    else:
+        mock_sri.state.update(latency_ms=args.latency_ms, auth_delay_ms=args.auth_delay_ms)
+        base_url, transport = "http://mock-sri", httpx.ASGITransport(app=mock_sri.app)
+    client = SRIClient(base_url, "bench", max_connections=args.concurrency, transport=transport,
+                       breaker=CircuitBreaker(failure_threshold=1000))
+    provider = LiveSRIProvider(base_url, client)
+
+    documents = make_documents(args.documents)
+    submit_latencies, auth_latencies = [], []
+
+    started = time.perf_counter()
+    batches = [documents[i:i + args.batch_size] for i in range(0, len(documents), args.batch_size)]
+    received = await run_phase(batches, provider.submit, args.concurrency, submit_latencies)
+    submit_seconds = time.perf_counter() - started
+    keys = [result["access_key"] for result in received if result["estado"] == RECEIVED]
+
+    auth_started = time.perf_counter()
+    pending = keys
+    rounds = 0
+    while pending:
+        rounds += 1
+        batches = [pending[i:i + args.auth_batch_size] for i in range(0, len(pending), args.auth_batch_size)]
+        results = await run_phase(batches, provider.authorize, args.concurrency, auth_latencies)
+        pending = [result["access_key"] for result in results if result["estado"] != AUTHORIZED]
+        if pending:
+            await asyncio.sleep(args.poll_interval)
+    total_seconds = time.perf_counter() - started
+    await client.aclose()
+
+    print(f"{args.documents} documents, submit batch {args.batch_size}, auth batch {args.auth_batch_size}, "
+          f"concurrency {args.concurrency}, {rounds} authorization rounds")
+    report("submission", len(keys), submit_seconds, submit_latencies)
+    report("authorization", len(keys), time.perf_counter() - auth_started, auth_latencies)
+    print(f"  {'end to end':<14} {len(keys) / total_seconds:9.0f} docs/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--auth-batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="seconds between authorization rounds")
+    parser.add_argument("--latency-ms", type=int, default=20, help="in-process stub latency")
+    parser.add_argument("--auth-delay-ms", type=int, default=200, help="in-process stub authorization delay")
+    parser.add_argument("--url", help="base URL of a running mock_sri.py instead of the in-process stub")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
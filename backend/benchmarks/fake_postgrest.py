@@ -0,0 +1,393 @@
+"""In-memory stand-in for Supabase's PostgREST API, for load tests.
+
+Implements the subset of PostgREST the backend uses: column selection,
+the eq/neq/gt/gte/lt/lte/in/is/like/ilike filters, ``order``, ``limit``,
+``offset`` and ``Range`` paging, ``Prefer: count=exact`` (reported in
+``Content-Range``), insert/upsert/update/delete with returned rows, and the
+``mark_invoice_paid`` RPC. Every request waits ``latency_ms`` (plus up to
+``jitter_ms``) first, like a round trip to the database would.
+
+Use it in-process through ``FakeTransport`` (see ``install``), or serve it
+over HTTP so a real uvicorn deployment can be pointed at it:
+    python benchmarks/fake_postgrest.py --port 54321 --latency-ms 5
+    DATABASE_URL=http://127.0.0.1:54321 uvicorn main:app --workers 4
+The dataset is generated from ``--seed``, so ``api_load.py --url`` run with
+the same dataset options knows which invoices and merchants exist.
+"""
+import argparse
+import asyncio
+import base64
+import fnmatch
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+# A syntactically valid anon key; supabase-py rejects keys that don't look like JWTs
+API_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.bench"
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+# Columns with a hash index for eq filters, so lookups don't scan the table
+INDEXED_COLUMNS = ("id", "invoice_id", "merchant_email", "email")
+# Read-only views over several tables (migrations/006)
+VIEWS = {"invoices_all": ("invoices", "invoices_archive")}
+TOKEN_ADDRESS = "0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913"
+
+
+class PostgRESTError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _coerce(raw: str, current):
+    if isinstance(current, bool):
+        return raw == "true"
+    if isinstance(current, (int, float)):
+        return float(raw)
+    return raw
+
+
+def _unquote(value: str) -> str:
+    return value[1:-1] if len(value) >= 2 and value[0] == value[-1] == '"' else value
+
+
+def _matches(row: dict, column: str, expression: str) -> bool:
+    op, _, raw = expression.partition(".")
+    value = row.get(column)
+    if op == "is":
+        return value is {"null": None, "true": True, "false": False}[raw]
+    if value is None:
+        return False
+    if op == "in":
+        return str(value) in {_unquote(item.strip()) for item in raw.strip("()").split(",")}
+    if op in ("like", "ilike"):
+        pattern = raw.replace("*", "%").replace("%", "*")
+        if op == "ilike":
+            return fnmatch.fnmatchcase(str(value).lower(), pattern.lower())
+        return fnmatch.fnmatchcase(str(value), pattern)
+    target = _coerce(_unquote(raw), value)
+    if op == "eq":
+        return value == target
+    if op == "neq":
+        return value != target
+    if op == "gt":
+        return value > target
+    if op == "gte":
+        return value >= target
+    if op == "lt":
+        return value < target
+    if op == "lte":
+        return value <= target
+    raise PostgRESTError(400, f"unsupported operator {op!r}")
+
+
+def _sort(rows: List[dict], order: str) -> List[dict]:
+    # Stable sorts applied last key first give the multi-column order
+    for term in reversed(order.split(",")):
+        column, _, direction = term.partition(".")
+        descending = direction.startswith("desc")
+        present = [row for row in rows if row.get(column) is not None]
+        missing = [row for row in rows if row.get(column) is None]
+        present.sort(key=lambda row: row[column], reverse=descending)
+        # PostgreSQL puts NULLs last ascending and first descending
+        rows = missing + present if descending else present + missing
+    return rows
+
+
+class FakePostgREST:
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tables: Dict[str, List[dict]] = defaultdict(list)
+        self.functions: Dict[str, Callable] = {"mark_invoice_paid": mark_invoice_paid}
+        self.requests: Counter = Counter()
+        self._indexes: Dict[Tuple[str, str], Dict[str, List[dict]]] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self) -> float:
+        """Seconds the next request should wait"""
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0
+        return (self.latency_ms + jitter) / 1000
+
+    def insert(self, table: str, row: dict) -> dict:
+        self.tables[table].append(row)
+        for (indexed_table, column), index in self._indexes.items():
+            if indexed_table == table and row.get(column) is not None:
+                index[str(row[column])].append(row)
+        return row
+
+    def _index(self, table: str, column: str) -> Dict[str, List[dict]]:
+        index = self._indexes.get((table, column))
+        if index is None:
+            index = self._indexes[(table, column)] = defaultdict(list)
+            for row in self.tables[table]:
+                if row.get(column) is not None:
+                    index[str(row[column])].append(row)
+        return index
+
+    def _candidates(self, table: str, filters: List[Tuple[str, str]]) -> List[dict]:
+        if table in VIEWS:
+            return [row for base in VIEWS[table] for row in self._candidates(base, filters)]
+        for column, expression in filters:
+            if column in INDEXED_COLUMNS and expression.startswith("eq."):
+                return self._index(table, column).get(_unquote(expression[3:]), [])
+        return self.tables[table]
+
+    def handle(self, method: str, path: str, params: List[Tuple[str, str]], headers: Dict[str, str],
+               body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        """Serve one request; returns (status, headers, body)"""
+        _, _, resource = path.partition("/rest/v1/")
+        prefer = headers.get("prefer", "")
+        try:
+            with self._lock:
+                if resource.startswith("rpc/"):
+                    name = resource[4:]
+                    self.requests[f"rpc {name}"] += 1
+                    function = self.functions.get(name)
+                    if function is None:
+                        raise PostgRESTError(404, f"function {name} not found")
+                    result = function(self, **(json.loads(body) if body else {}))
+                    return 200, {"content-type": "application/json"}, json.dumps(result).encode()
+                self.requests[f"{method} {resource}"] += 1
+                status, rows, content_range = self._table(method, resource, params, headers, prefer, body)
+        except PostgRESTError as e:
+            return e.status, {"content-type": "application/json"}, json.dumps({"message": str(e)}).encode()
+
+        response_headers = {"content-type": "application/json"}
+        if content_range:
+            response_headers["content-range"] = content_range
+        if method == "HEAD" or (method != "GET" and "return=minimal" in prefer):
+            return status, response_headers, b""
+        return status, response_headers, json.dumps(rows, default=str).encode()
+
+    def _invalidate(self, table: str, changes) -> None:
+        """Drop indexes on ``table`` over columns in ``changes`` (all of them when None)"""
+        for key in [key for key in self._indexes if key[0] == table and (changes is None or key[1] in changes)]:
+            del self._indexes[key]
+
+    def _table(self, method, table, params, headers, prefer, body):
+        filters = [(key, value) for key, value in params if key not in RESERVED_PARAMS]
+        options = dict((key, value) for key, value in params if key in RESERVED_PARAMS)
+
+        if method == "POST":
+            payload = json.loads(body)
+            new_rows = payload if isinstance(payload, list) else [payload]
+            conflict = options.get("on_conflict", "id") if "resolution=merge-duplicates" in prefer else None
+            written = []
+            for new in new_rows:
+                new = dict(new)
+                new.setdefault("id", str(uuid.uuid4()))
+                existing = None
+                if conflict and new.get(conflict) is not None:
+                    existing = next(iter(self._candidates(table, [(conflict, f"eq.{new[conflict]}")])), None)
+                if existing is not None:
+                    self._invalidate(table, new)
+                    existing.update(new)
+                    written.append(existing)
+                else:
+                    written.append(self.insert(table, new))
+            return 201, [dict(row) for row in written], None
+
+        candidates = self._candidates(table, filters)
+        selected = [row for row in candidates if all(_matches(row, key, value) for key, value in filters)]
+        if method == "PATCH":
+            changes = json.loads(body)
+            self._invalidate(table, changes)
+            for row in selected:
+                row.update(changes)
+            return 200, [dict(row) for row in selected], None
+        if method == "DELETE":
+            gone = {id(row) for row in selected}
+            self.tables[table] = [row for row in self.tables[table] if id(row) not in gone]
+            self._invalidate(table, None)
+            return 200, selected, None
+
+        total = len(selected)
+        if "order" in options:
+            selected = _sort(selected, options["order"])
+        start = int(options.get("offset", 0))
+        stop = None
+        if "limit" in options:
+            stop = start + int(options["limit"])
+        page = headers.get("range")
+        if page:
+            first, _, last = page.partition("-")
+            start, stop = int(first), int(last) + 1 if last else None
+        selected = selected[start:stop]
+
+        columns = options.get("select", "*")
+        if columns != "*":
+            names = [name.strip() for name in columns.split(",")]
+            selected = [{name: row.get(name) for name in names} for row in selected]
+        else:
+            selected = [dict(row) for row in selected]
+
+        count = str(total) if "count=exact" in prefer else "*"
+        content_range = f"{start}-{start + len(selected) - 1}/{count}" if selected else f"*/{count}"
+        return 200, selected, content_range
+
+
+def mark_invoice_paid(db: FakePostgREST, p_invoice_id, p_tx_hash, p_paid_at, p_paid_amount=None,
+                      p_paid_amount_units=None, p_paid_token=None, p_jobs=()):
+    """Same contract as the SQL function in migrations/001_outbox.sql"""
+    for row in db._candidates("invoices", [("id", f"eq.{p_invoice_id}")]):
+        if row["status"] == "ISSUED" and not row.get("tx_hash"):
+            row.update(status="PAID", tx_hash=p_tx_hash, paid_at=p_paid_at, updated_at=p_paid_at)
+            if p_paid_amount is not None:
+                row["paid_amount"] = p_paid_amount
+            if p_paid_amount_units is not None:
+                row["paid_amount_units"] = p_paid_amount_units
+            if p_paid_token is not None:
+                row["paid_token"] = p_paid_token
+            for job in p_jobs:
+                db.insert("outbox", {"id": len(db.tables["outbox"]) + 1, "topic": job["topic"],
+                                     "payload": job.get("payload", {}), "status": "PENDING", "attempts": 0})
+            return dict(row)
+    return None
+
+
+class FakeTransport(httpx.BaseTransport):
+    """httpx transport answering from a FakePostgREST, blocking for its latency like a socket read"""
+
+    def __init__(self, db: FakePostgREST):
+        self.db = db
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        time.sleep(self.db.delay())
+        status, headers, body = self.db.handle(
+            request.method, request.url.path, list(request.url.params.multi_items()),
+            {key.lower(): value for key, value in request.headers.items()}, request.read()
+        )
+        return httpx.Response(status, headers=headers, content=body, request=request)
+
+
+def install(db: FakePostgREST) -> None:
+    """Route the app's Supabase client to ``db``; DATABASE_URL/DATABASE_APIKEY must already be set"""
+    from utils.database import get_supabase_client
+    session = get_supabase_client().postgrest.session
+    # postgrest-py builds its own httpx.Client with no transport argument
+    session._transport = FakeTransport(db)
+
+
+def asgi_app(db: FakePostgREST):
+    """The fake as an ASGI app, for serving over HTTP"""
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        await asyncio.sleep(db.delay())
+        request = httpx.Request(scope["method"], "http://fake" + scope["path"] + "?" + scope["query_string"].decode())
+        headers = {key.decode().lower(): value.decode() for key, value in scope["headers"]}
+        status, response_headers, content = await asyncio.to_thread(
+            db.handle, scope["method"], scope["path"], list(request.url.params.multi_items()), headers, body
+        )
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(key.encode(), value.encode()) for key, value in response_headers.items()]})
+        await send({"type": "http.response.body", "body": content})
+    return app
+
+
+# --- dataset ---
+
+def invoice_row(rng: random.Random, merchant_email: str, index: int, status: str, created_at: datetime) -> dict:
+    invoice_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+    units = rng.randrange(1, 500) * 1_000_000 + rng.randrange(0, 1_000_000, 10_000)
+    items = [{"name": f"Item {n}", "qty": n + 1, "unit_price": 9.99} for n in range(rng.randint(1, 4))]
+    row = {
+        "id": invoice_id,
+        "merchant_email": merchant_email,
+        "customer_email": f"customer{index}@example.com",
+        "items": items,
+        "subtotal": round(units / 1.15 / 1e6, 2),
+        "tax_amount": round(units / 1e6 - units / 1.15 / 1e6, 2),
+        "tax_rate": 0.15,
+        "total": units / 1e6,
+        "total_usdc": units / 1e6,
+        "total_usdc_units": units,
+        "status": status,
+        "created_at": created_at.isoformat(),
+        "updated_at": created_at.isoformat(),
+        "einvoice_status": "PENDING",
+        "einvoice_attempts": 0,
+        "tx_hash": None,
+    }
+    if status != "DRAFT":
+        row.update(
+            invoice_id=f"INV-{created_at.strftime('%Y%m%d')}-{invoice_id[:8].upper()}",
+            issued_at=created_at.isoformat(),
+            qr_url=f"ethereum:{TOKEN_ADDRESS}/transfer?uint256={units}&chainId=8453",
+            checkout_url=f"http://localhost:3000/pay/{invoice_id}",
+        )
+    if status == "PAID":
+        row.update(tx_hash="0x" + "%064x" % rng.getrandbits(256), paid_at=created_at.isoformat(),
+                   einvoice_status="SENT")
+    return row
+
+
+def seed_dataset(db: FakePostgREST, merchants: int = 20, invoices_per_merchant: int = 500, seed: int = 0) -> dict:
+    """Fill ``db`` with merchants, invoices and passkeys; returns what the load generator needs to know"""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    manifest = {"merchants": [], "issued": [], "credentials": {}}
+    for number in range(merchants):
+        email = f"merchant{number}@example.com"
+        manifest["merchants"].append(email)
+        db.insert("company_info", {"email": email, "name": f"Store {number}", "tax_number": "1790012345001",
+                                          "address": "Av. Amazonas N34-451, Quito"})
+        credential_id = rng.getrandbits(8 * 32).to_bytes(32, "big")
+        manifest["credentials"][email] = credential_id
+        db.insert("credentials", {
+            "email": email,
+            "credential_id": base64.b64encode(credential_id).decode(),
+            "public_key": "",
+            "sign_count": 0,
+        })
+        for index in range(invoices_per_merchant):
+            status = rng.choices(["ISSUED", "PAID", "DRAFT", "CANCELED", "EXPIRED"], [45, 35, 10, 5, 5])[0]
+            created_at = start + timedelta(minutes=index * 17 + number)
+            row = invoice_row(rng, email, index, status, created_at)
+            db.insert("invoices", row)
+            if status == "ISSUED":
+                manifest["issued"].append((row["invoice_id"], row["total_usdc_units"]))
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency-ms", type=float, default=5)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--merchants", type=int, default=20)
+    parser.add_argument("--invoices", type=int, default=500, help="invoices per merchant")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    db = FakePostgREST(args.latency_ms, args.jitter_ms, args.seed)
+    seed_dataset(db, args.merchants, args.invoices, args.seed)
+    print(f"Serving {len(db.tables['invoices'])} invoices; DATABASE_URL=http://{args.host}:{args.port} "
+          f"DATABASE_APIKEY={API_KEY}")
+    uvicorn.run(asgi_app(db), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
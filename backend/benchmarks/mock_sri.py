@@ -0,0 +1,129 @@
+"""Local stand-in for the SRI e-invoicing provider.
+
+Implements the two endpoints the e-invoice pipeline calls, with
+configurable latency and failure modes for exercising timeouts, retries,
+the circuit breaker and load. Documents are {"invoice_id", "access_key",
+"xml"}; the XML is not validated.
+
+    POST /recepcion     {"comprobantes": [...]}  -> RECIBIDA / DEVUELTA per document
+    POST /autorizacion  {"claves_acceso": [...]} -> AUTORIZADO / EN PROCESO per key
+
+Documents are authorized ``--auth-delay-ms`` after they were received.
+
+    python benchmarks/mock_sri.py --port 8081 --latency-ms 50 --error-rate 0.1
+
+then run the API with SRI_MODE=live SRI_ENDPOINT=http://127.0.0.1:8081.
+POST /_mode {"down": true} toggles a full outage at runtime.
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+from datetime import datetime, timezone
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Mock SRI")
+state = {
+    "latency_ms": 0,
+    "error_rate": 0.0,
+    "reject_rate": 0.0,
+    "auth_delay_ms": 0,
+    "down": False,
+    "received": 0,
+    "requests": 0,
+}
+received_at = {}  # access key -> monotonic receive time
+
+
+def access_key_for(document: dict) -> str:
+    if document.get("access_key"):
+        return document["access_key"]
+    digest = hashlib.sha256(document["invoice_id"].encode()).hexdigest()
+    return str(int(digest, 16))[:49].zfill(49)
+
+
+async def simulate():
+    """Latency and injected failures shared by both endpoints; returns an error response or None"""
+    state["requests"] += 1
+    if state["latency_ms"]:
+        await asyncio.sleep(random.uniform(0.5, 1.5) * state["latency_ms"] / 1000)
+    if state["down"] or random.random() < state["error_rate"]:
+        return JSONResponse({"error": "service unavailable"}, status_code=503)
+    return None
+
+
+@app.post("/recepcion")
+async def receive(request: Request):
+    body = await request.json()
+    error = await simulate()
+    if error:
+        return error
+    results = []
+    now = time.monotonic()
+    for document in body["comprobantes"]:
+        key = access_key_for(document)
+        if random.random() < state["reject_rate"]:
+            results.append({"invoice_id": document["invoice_id"], "access_key": key, "estado": "DEVUELTA",
+                            "mensajes": ["ERROR SECUENCIAL REGISTRADO"]})
+            continue
+        received_at.setdefault(key, now)
+        state["received"] += 1
+        results.append({"invoice_id": document["invoice_id"], "access_key": key, "estado": "RECIBIDA"})
+    return {"comprobantes": results}
+
+
+@app.post("/autorizacion")
+async def authorize(request: Request):
+    body = await request.json()
+    error = await simulate()
+    if error:
+        return error
+    now = time.monotonic()
+    results = []
+    for key in body["claves_acceso"]:
+        received = received_at.get(key)
+        if received is None:
+            results.append({"access_key": key, "estado": "NO AUTORIZADO", "mensajes": ["CLAVE DE ACCESO NO REGISTRADA"]})
+        elif (now - received) * 1000 < state["auth_delay_ms"]:
+            results.append({"access_key": key, "estado": "EN PROCESO"})
+        else:
+            results.append({
+                "access_key": key,
+                "estado": "AUTORIZADO",
+                "numero_autorizacion": key,
+                "fecha_autorizacion": datetime.now(timezone.utc).isoformat()
+            })
+    return {"autorizaciones": results}
+
+
+@app.post("/_mode")
+async def set_mode(request: Request):
+    state.update(await request.json())
+    return state
+
+
+@app.get("/_stats")
+async def stats():
+    return {**state, "documents": len(received_at)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=int, default=0, help="mean response latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered 503")
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="fraction of documents returned (DEVUELTA)")
+    parser.add_argument("--auth-delay-ms", type=int, default=0, help="time from receipt to authorization")
+    parser.add_argument("--down", action="store_true", help="answer every request with 503")
+    args = parser.parse_args()
+    state.update(latency_ms=args.latency_ms, error_rate=args.error_rate, reject_rate=args.reject_rate,
+                 auth_delay_ms=args.auth_delay_ms, down=args.down)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
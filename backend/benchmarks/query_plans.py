@@ -0,0 +1,178 @@
+"""EXPLAIN every query shape the API issues and flag sequential scans.
+
+``QUERY_SHAPES`` lists the reads the endpoints, workers and monitoring make
+(the same SQL the SQLite repositories run, and what PostgREST generates for
+the Supabase ones); merchant-facing reads go through the invoices_all view
+over both storage tiers. Each is explained against either backend:
+
+  * SQLite (default): a scratch database at ``--sqlite`` (``:memory:`` if
+    not given) built by the repositories' own schema migrations, using
+    EXPLAIN QUERY PLAN
+  * Postgres: ``--dsn`` (or DATABASE_DSN), using EXPLAIN (FORMAT JSON) with
+    ``enable_seqscan`` off, so a small table can't hide a missing index:
+    a Seq Scan that is left means no index can serve the query
+
+A shape is flagged when its plan reads a table from start to end
+(SQLite ``SCAN <table>`` without an index, Postgres ``Seq Scan``); sorts
+that can't use an index are reported as notes. Exits with status 1 if any
+shape is flagged.
+
+Run from the backend directory:
+    python benchmarks/query_plans.py
+    python benchmarks/query_plans.py --dsn postgresql://...
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+NOW = "2025-08-30T12:00:00.000000+00:00"
+EMAIL = "merchant@example.com"
+INVOICE_ID = "00000000-0000-4000-8000-000000000000"
+
+# (name, caller, SQL with ? placeholders, parameters)
+QUERY_SHAPES = [
+    ("invoice by id", "invoice detail, emit, cancel, e-invoice send",
+     "select * from invoices_all where id = ? and merchant_email = ?", [INVOICE_ID, EMAIL]),
+    ("invoice by number", "checkout page, payment webhook, status stream",
+     "select * from invoices where invoice_id = ?", ["INV-20250830-00000000"]),
+    ("merchant invoices, newest first", "GET /invoices",
+     "select * from invoices_all where merchant_email = ? order by created_at desc, id desc limit ? offset ?",
+     [EMAIL, 50, 0]),
+    ("merchant invoices by status and dates", "GET /invoices?status=&from_date=&to_date=",
+     "select * from invoices_all where merchant_email = ? and status = ? and created_at >= ? and created_at <= ? "
+     "order by created_at desc limit ?", [EMAIL, "ISSUED", NOW, NOW, 50]),
+    ("invoice list ETag probe", "GET /invoices, GET /dashboard/metrics",
+     "select count(*), max(updated_at) from invoices_all where merchant_email = ? and status = ?", [EMAIL, "PAID"]),
+    ("export keyset page", "GET /invoices/export",
+     "select * from invoices_all where merchant_email = ? and (created_at, id) < (?, ?) "
+     "order by created_at desc, id desc limit ?", [EMAIL, NOW, INVOICE_ID, 500]),
+    ("dashboard totals", "GET /dashboard/metrics",
+     "select status, total_usdc, total_usdc_units from invoices_all where merchant_email = ? and created_at >= ?",
+     [EMAIL, NOW]),
+    ("analytics changes", "GET /dashboard/analytics",
+     "select id, status, customer_email, total_usdc, total_usdc_units, created_at, issued_at, paid_at, updated_at "
+     "from invoices_all where merchant_email = ? and updated_at > ?", [EMAIL, NOW]),
+    ("expiry sweep", "POST /payments/expire-invoices",
+     "select id, invoice_id, merchant_email from invoices where status = 'ISSUED' and issued_at < ?", [NOW]),
+    ("change feed", "event streams",
+     "select id, invoice_id, merchant_email, status, tx_hash, updated_at from invoices "
+     "where updated_at > ? order by updated_at limit ?", [NOW, 500]),
+    ("archival batch", "invoice archiver",
+     "select id from invoices where updated_at < ? "
+     "and (status in ('CANCELED', 'EXPIRED') or (status = 'PAID' and einvoice_status = 'SENT')) "
+     "order by updated_at limit ?", [NOW, 500]),
+    ("e-invoice submission claim", "e-invoice pipeline",
+     "select id from invoices where status = 'PAID' and einvoice_status = 'PENDING' "
+     "and (einvoice_locked_until is null or einvoice_locked_until < ?) "
+     "order by coalesce(einvoice_submitted_at, paid_at) limit ?", [NOW, 200]),
+    ("e-invoice authorization claim", "e-invoice pipeline",
+     "select id from invoices where status = 'PAID' and einvoice_status = 'SUBMITTED' "
+     "and (einvoice_locked_until is null or einvoice_locked_until < ?) "
+     "order by coalesce(einvoice_submitted_at, paid_at) limit ?", [NOW, 400]),
+    ("e-invoice retry claim", "e-invoice pipeline",
+     "select id from invoices where status = 'PAID' and einvoice_status = 'FAILED' "
+     "and einvoice_next_attempt_at <= ? and (einvoice_locked_until is null or einvoice_locked_until < ?) "
+     "order by einvoice_next_attempt_at limit ?", [NOW, NOW, 50]),
+    ("e-invoice submission queue", "/metrics, GET /einvoice/pipeline/metrics",
+     "select count(*), min(paid_at) from invoices where status = 'PAID' and einvoice_status = 'PENDING'", []),
+    ("e-invoice dead letters", "/metrics, GET /einvoice/pipeline/metrics",
+     "select count(*) from invoices where einvoice_status = 'DEAD'", []),
+    ("merchant by email", "e-invoice send, receipts, login",
+     "select * from company_info where email = ?", [EMAIL]),
+    ("merchants by email", "e-invoice pipeline",
+     "select * from company_info where email in (?, ?)", [EMAIL, "other@example.com"]),
+    ("passkeys by email", "login, registration",
+     "select * from credentials where email = ?", [EMAIL]),
+    ("passkey challenge", "login, registration",
+     "select state from webauthn_challenges where email = ? and expires_at > ?", [EMAIL, NOW]),
+    ("outbox claim", "job workers",
+     "select id from outbox where status = 'PENDING' and available_at <= ? "
+     "and (locked_until is null or locked_until < ?) order by available_at limit ?", [NOW, NOW, 4]),
+    ("outbox dead letters", "/metrics",
+     "select count(*) from outbox where status = 'DEAD'", []),
+]
+
+
+def explain_sqlite(path: str) -> list:
+    """(flags, notes, plan lines) per shape"""
+    from repositories.sqlite_backend import SQLiteDatabase
+
+    db = SQLiteDatabase(path)
+    results = []
+    for _, _, sql, params in QUERY_SHAPES:
+        with db._lock:
+            rows = db._conn.execute("explain query plan " + sql, params).fetchall()
+        details = [row["detail"] for row in rows]
+        # Scans of a view's or subquery's own rows (CO-ROUTINE) read no table
+        coroutines = {detail.split()[1] for detail in details if detail.startswith("CO-ROUTINE ")}
+        flags = [detail for detail in details
+                 if detail.startswith("SCAN ") and " INDEX " not in detail and "CONSTANT ROW" not in detail
+                 and detail.split()[1] not in coroutines]
+        notes = [detail for detail in details if "TEMP B-TREE" in detail]
+        results.append((flags, notes, details))
+    return results
+
+
+def _plan_nodes(node: dict):
+    yield node
+    for child in node.get("Plans", ()):
+        yield from _plan_nodes(child)
+
+
+def _describe(node: dict) -> str:
+    name = node["Node Type"]
+    if node.get("Index Name"):
+        name += f" using {node['Index Name']}"
+    if node.get("Relation Name"):
+        name += f" on {node['Relation Name']}"
+    return name
+
+
+def explain_postgres(dsn: str) -> list:
+    try:
+        import psycopg
+    except ImportError:
+        sys.exit('psycopg is not installed: pip install "psycopg[binary]"')
+
+    results = []
+    with psycopg.connect(dsn) as conn:
+        # Rolled back at the end; nothing is written
+        conn.execute("set local enable_seqscan = off")
+        for _, _, sql, params in QUERY_SHAPES:
+            plan = conn.execute("explain (format json) " + sql.replace("?", "%s"), params).fetchone()[0][0]["Plan"]
+            nodes = list(_plan_nodes(plan))
+            flags = [_describe(node) for node in nodes if node["Node Type"] == "Seq Scan"]
+            notes = [_describe(node) for node in nodes if node["Node Type"] in ("Sort", "Incremental Sort")]
+            results.append((flags, notes, [_describe(node) for node in nodes]))
+        conn.rollback()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_DSN"), help="Postgres connection string")
+    parser.add_argument("--sqlite", default=":memory:", help="SQLite database file (default: a scratch one)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="print every plan")
+    args = parser.parse_args()
+
+    results = explain_postgres(args.dsn) if args.dsn else explain_sqlite(args.sqlite)
+    flagged = 0
+    for (name, caller, _, _), (flags, notes, plan) in zip(QUERY_SHAPES, results):
+        verdict = "SEQ SCAN" if flags else "ok"
+        flagged += bool(flags)
+        print(f"  {verdict:<9} {name:<38} {caller}")
+        for flag in flags:
+            print(f"            scan: {flag}")
+        for note in notes:
+            print(f"            sort: {note}")
+        if args.verbose:
+            for line in plan:
+                print(f"            plan: {line}")
+    print(f"{len(QUERY_SHAPES)} query shapes, {flagged} with sequential scans")
+    sys.exit(1 if flagged else 0)
+
+
+if __name__ == "__main__":
+    main()
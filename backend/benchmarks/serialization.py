@@ -0,0 +1,123 @@
+"""Invoice list serialization benchmark: rows/sec before and after the fast path.
+
+"model" is the previous path: build an InvoiceResponse per row (re-parsing
+timestamps and item lists), let FastAPI validate it against the
+response_model and render with the stdlib json encoder.
+"fast" maps rows straight to dicts and renders with FastJSONResponse.
+
+Run from the backend directory:
+    python benchmarks/serialization.py --rows 100 --seconds 3
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from endpoints.invoices import invoice_to_dict
+from utils.models import EInvoiceStatus, InvoiceResponse, InvoiceStatus
+from utils.money import row_units
+from utils.serialization import FastJSONResponse, orjson
+
+
+def make_rows(count: int, items_per_invoice: int) -> list:
+    rows = []
+    for index in range(count):
+        invoice_id = str(uuid.uuid4())
+        rows.append({
+            "id": invoice_id,
+            "merchant_email": "merchant@example.com",
+            "customer_email": f"customer{index}@example.com",
+            "items": [{"name": f"Item {n}", "qty": n + 1, "unit_price": 9.99} for n in range(items_per_invoice)],
+            "subtotal": 99.9,
+            "tax_amount": 11.99,
+            "total": 111.89,
+            "total_usdc": 111.89,
+            "total_usdc_units": 111890000,
+            "status": "ISSUED",
+            "created_at": "2025-08-30T10:00:00.123456+00:00",
+            "updated_at": "2025-08-30T10:05:00.123456+00:00",
+            "invoice_id": f"INV-20250830-{invoice_id[:8].upper()}",
+            "qr_url": "ethereum:0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913/transfer?address=0x4BD84bAc39cFd77C14D08d51b65f584664Ac1FF5&uint256=111890000&chainId=8453",
+            "checkout_url": f"http://localhost:3000/pay/{invoice_id}",
+            "tx_hash": None,
+            "einvoice_number": None,
+            "einvoice_url": None,
+            "einvoice_status": "PENDING",
+        })
+    return rows
+
+
+RESPONSE_FIELD = create_response_field(name="Response_get_invoices", type_=List[InvoiceResponse], mode="serialization")
+
+
+def model_path(rows: list) -> bytes:
+    invoices = []
+    for data in rows:
+        invoices.append(InvoiceResponse(
+            id=data["id"],
+            merchant_email=data["merchant_email"],
+            customer_email=data["customer_email"],
+            items=data["items"],
+            subtotal=data["subtotal"],
+            tax_amount=data["tax_amount"],
+            total=data["total"],
+            total_usdc=data["total_usdc"],
+            total_usdc_units=row_units(data, "total_usdc"),
+            status=InvoiceStatus(data["status"]),
+            created_at=datetime.fromisoformat(data["created_at"].replace('Z', '+00:00')),
+            updated_at=datetime.fromisoformat(data["updated_at"].replace('Z', '+00:00')),
+            invoice_id=data.get("invoice_id"),
+            qr_url=data.get("qr_url"),
+            checkout_url=data.get("checkout_url"),
+            tx_hash=data.get("tx_hash"),
+            einvoice_number=data.get("einvoice_number"),
+            einvoice_url=data.get("einvoice_url"),
+            einvoice_status=EInvoiceStatus(data["einvoice_status"]) if data.get("einvoice_status") else None
+        ))
+    content = asyncio.run(serialize_response(field=RESPONSE_FIELD, response_content=invoices))
+    return JSONResponse(content).body
+
+
+def fast_path(rows: list) -> bytes:
+    return FastJSONResponse([invoice_to_dict(data) for data in rows]).body
+
+
+def measure(func, rows: list, seconds: float) -> float:
+    func(rows)  # warm up
+    pages = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        func(rows)
+        pages += 1
+    return pages * len(rows) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100, help="rows per page")
+    parser.add_argument("--items", type=int, default=3, help="line items per invoice")
+    parser.add_argument("--seconds", type=float, default=3.0, help="time per path")
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows, args.items)
+    before = measure(model_path, rows, args.seconds)
+    after = measure(fast_path, rows, args.seconds)
+    encoder = "orjson" if orjson is not None else "json (orjson not installed)"
+    print(f"page size {args.rows}, {args.items} items/invoice, encoder {encoder}")
+    print(f"  model + response_model validation: {before:10.0f} rows/sec")
+    print(f"  fast path:                         {after:10.0f} rows/sec")
+    print(f"  speedup:                           {after / before:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
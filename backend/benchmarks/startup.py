@@ -0,0 +1,121 @@
+"""Cold-start benchmark for the API.
+
+Measures, each in a fresh interpreter:
+  * import time of ``main`` and which heavy modules it drags in
+  * time-to-first-request: uvicorn process spawn until ``GET /`` answers 200
+
+Run from the backend directory:
+    python benchmarks/startup.py --runs 5 --budget-ms 800
+Exits non-zero if the median import time exceeds the budget or a module that
+should load lazily (fido2, qrcode, PIL, requests) is imported at startup.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LAZY_MODULES = ["fido2", "qrcode", "PIL", "requests"]
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+lazy = %r
+print(json.dumps({
+    "import_ms": elapsed * 1000,
+    "eager": [name for name in lazy if name in sys.modules],
+}))
+""" % (LAZY_MODULES,)
+
+
+def measure_import() -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_first_request(timeout: float = 30.0) -> float:
+    port = _free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as resp:
+                    if resp.status == 200:
+                        return (time.perf_counter() - start) * 1000
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError("server did not answer within timeout")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def import_profile(top: int) -> list:
+    """Heaviest modules by cumulative import time (python -X importtime)"""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(cumulative) / 1000, depth, name.strip()))
+    # Only direct imports of main, so nested modules aren't counted twice
+    direct = [(ms, name) for ms, depth, name in rows if depth == 1]
+    return sorted(direct, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail if median import time exceeds this")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    first_requests = [measure_first_request() for _ in range(args.runs)]
+    import_ms = [run["import_ms"] for run in imports]
+    eager = sorted({name for run in imports for name in run["eager"]})
+
+    print(f"import main:           median {statistics.median(import_ms):.0f} ms  (min {min(import_ms):.0f}, max {max(import_ms):.0f})")
+    print(f"time-to-first-request: median {statistics.median(first_requests):.0f} ms  (min {min(first_requests):.0f}, max {max(first_requests):.0f})")
+    print("heaviest imports:")
+    for ms, name in import_profile(args.top):
+        print(f"  {ms:8.1f} ms  {name}")
+
+    failed = False
+    if eager:
+        print(f"FAIL: modules that should load lazily were imported at startup: {', '.join(eager)}")
+        failed = True
+    if args.budget_ms is not None and statistics.median(import_ms) > args.budget_ms:
+        print(f"FAIL: import time over budget of {args.budget_ms:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
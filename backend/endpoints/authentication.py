@@ -1,52 +1,36 @@
 from fastapi import APIRouter, Request, HTTPException, Response
 from fastapi.responses import RedirectResponse
-import fido2
 from utils.models import CompanyRegisterRequest, LoginRequest
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
+from utils.tokens import encode_token, decode_token
+from utils.database import get_repositories
+from utils.settings import get_settings
+from utils.mailer import send_html_email
+from utils.metrics import timed
+from utils.tracing import span
 import json
 import jwt
 from datetime import datetime, timezone, timedelta
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from fido2.server import Fido2Server
-from fido2.webauthn import (
-    PublicKeyCredentialRpEntity, 
-    UserVerificationRequirement,
-    PublicKeyCredentialDescriptor,
-    PublicKeyCredentialType,
-    CollectedClientData,
-    AttestationObject,
-    AuthenticatorAttestationResponse,
-    RegistrationResponse,
-    AuthenticatorAssertionResponse,
-    AuthenticationResponse,
-    AttestedCredentialData
-)
-from fido2.webauthn import CollectedClientData, AttestationObject, AuthenticatorAttestationResponse, RegistrationResponse
-from fido2 import cbor
-from fido2 import features
+from functools import lru_cache
 import base64
 
-# Enable webauthn_json_mapping feature
-features.webauthn_json_mapping.enabled = True
-
 router = APIRouter()
 
-load_dotenv()
 
-def load_config():
-    with open("config.json", "r", encoding="utf-8") as config:
-        return json.load(config)
-        
-config = load_config()
+@lru_cache(maxsize=1)
+def get_fido_server():
+    """Build the FIDO2 server on first use; fido2 and its crypto backends are slow to import"""
+    from fido2 import features
+    from fido2.server import Fido2Server
+    from fido2.webauthn import PublicKeyCredentialRpEntity
+
+    # Enable webauthn_json_mapping feature
+    features.webauthn_json_mapping.enabled = True
 
-rp = PublicKeyCredentialRpEntity(id="localhost", name="CryptoPay")
-fido_server = Fido2Server(rp, verify_origin=lambda origin: origin == "http://localhost:3000")
+    rp = PublicKeyCredentialRpEntity(id="localhost", name="CryptoPay")
+    return Fido2Server(rp, verify_origin=lambda origin: origin == "http://localhost:3000")
 
-CHALLENGES = {}  # { email: state }
+# Seconds a registration or login challenge stays valid
+CHALLENGE_TTL = 300
 def create_email_html(magic_link: str) -> str:
     
     severity_color = "#28a745"
@@ -99,8 +83,6 @@ def create_email_html(magic_link: str) -> str:
 
 def send_email(magic_link: str, token: str) -> bool:
     
-    SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
-    
     payload = decode_jwt_token(token)
     print(f"Decoded payload for email: {payload}")
     
@@ -109,29 +91,7 @@ def send_email(magic_link: str, token: str) -> bool:
         print(f"Email recipient: {payload.get('email')}")
         print(f"Magic link: {magic_link}")
         
-        subject = "Completa tu registro"
-        html_content = create_email_html(magic_link)
-
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = f"{config.get('smtp').get('from_name')} <{config.get('smtp').get('from_email')}>"
-        msg['To'] = payload.get("email")
-
-        html_part = MIMEText(html_content, 'html', 'utf-8')
-        msg.attach(html_part)
-
-        print(f"Connecting to SMTP server: {config.get('smtp').get('smtp_server')}:{config.get('smtp').get('smtp_port')}")
-        print(f"SMTP user: {config.get('smtp').get('smtp_user')}")
-        print(f"SMTP password configured: {'Yes' if SMTP_PASSWORD else 'No'}")
-        
-        with smtplib.SMTP(config.get("smtp").get("smtp_server"), config.get("smtp").get("smtp_port")) as server:
-            print("SMTP connection established")
-            server.starttls()
-            print("TLS started")
-            server.login(config.get("smtp").get("smtp_user"), SMTP_PASSWORD)
-            print("SMTP login successful")
-            server.send_message(msg)
-            print("Email sent successfully!")
+        send_html_email(payload.get("email"), "Completa tu registro", create_email_html(magic_link))
         return True
     except Exception as e:
         print(f"Email sending error: {e}")
@@ -142,10 +102,6 @@ def send_email(magic_link: str, token: str) -> bool:
     
 def generate_jwt_token(payload_entry: CompanyRegisterRequest):
     
-    JWT_EXPIRATION_TIME = os.getenv("JWT_EXPIRATION_TIME")
-    JWT_SECRET = os.getenv("JWT_SECRET")
-    JWT_ALGORITHM = os.getenv("JWT_ALGORITHM")
-    
     payload = {
         "name": payload_entry.name,
         "country": payload_entry.country,
@@ -154,18 +110,16 @@ def generate_jwt_token(payload_entry: CompanyRegisterRequest):
         "address": payload_entry.address,
         "email": payload_entry.email,
         "tax_number": payload_entry.tax_number,
-        "exp": datetime.now(timezone.utc) + timedelta(seconds=int(JWT_EXPIRATION_TIME)),
+        "exp": datetime.now(timezone.utc) + timedelta(seconds=get_settings().jwt_expiration_time),
         "iat": datetime.now(timezone.utc)
     }
     print(f"Generating JWT with payload: {payload}")
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    return encode_token(payload)
 
 def decode_jwt_token(token: str):
     
-    JWT_SECRET = os.getenv("JWT_SECRET")
-    
     try:
-        decoded = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        decoded = decode_token(token)
         print(f"Token decoded successfully: {decoded}")
         return decoded
     except jwt.ExpiredSignatureError:
@@ -175,29 +129,20 @@ def decode_jwt_token(token: str):
         print(f"Invalid token: {e}")
         return {"msg": "¡The magic link is not valid!"} 
 
-def create_supabase_client():
-    url: str = os.getenv("DATABASE_URL")
-    key: str = os.getenv("DATABASE_APIKEY")
-    supabase: Client = create_client(url, key)
-    return supabase
-
-def is_valid_email(email: str, supabase: Client):
-    response = ( supabase.table("company_info").select("email").eq("email", email).execute() )
-    return not response.data
+def is_valid_email(email: str):
+    return not get_repositories().companies.exists(email)
 
 @router.post("/send-magic-link")
 async def send_magic_link(payload: CompanyRegisterRequest):
     print(f"Received magic link request for: {payload.email}")
     print(f"Company data: name={payload.name}, country={payload.country}, city={payload.city}")
     
-    supabase = create_supabase_client()
+    repositories = get_repositories()
     
     # Verificar estado actual del usuario
-    company_resp = supabase.table("company_info").select("email").eq("email", payload.email).execute()
-    company_exists = bool(company_resp.data)
+    company_exists = repositories.companies.exists(payload.email)
     
-    creds_resp = supabase.table("credentials").select("email").eq("email", payload.email).execute()
-    has_passkey = bool(creds_resp.data)
+    has_passkey = repositories.credentials.exists(payload.email)
     
     print(f"Current status - Company exists: {company_exists}, Has PassKey: {has_passkey}")
     
@@ -212,7 +157,7 @@ async def send_magic_link(payload: CompanyRegisterRequest):
     
     # Generar token y magic link
     token = generate_jwt_token(payload)
-    magic_link = config.get("server") + token
+    magic_link = get_settings().magic_link_base + token
     print(f"Generated magic link: {magic_link}")
     
     # Intentar enviar email
@@ -231,7 +176,7 @@ async def send_magic_link(payload: CompanyRegisterRequest):
 
 @router.get("/register/{token}")
 async def register(token: str):
-    supabase = create_supabase_client()
+    repositories = get_repositories()
     payload = decode_jwt_token(token)
     
     print(f"Processing magic link token for: {payload.get('email') if payload else 'invalid token'}")
@@ -245,12 +190,10 @@ async def register(token: str):
     print(f"Checking registration status for: {email}")
 
     # Verificar si el email ya existe en company_info
-    company_resp = supabase.table("company_info").select("email").eq("email", email).execute()
-    company_exists = bool(company_resp.data)
+    company_exists = repositories.companies.exists(email)
     
     # Verificar si ya tiene PassKey registrado
-    creds_resp = supabase.table("credentials").select("email").eq("email", email).execute()
-    has_passkey = bool(creds_resp.data)
+    has_passkey = repositories.credentials.exists(email)
     
     print(f"Company exists: {company_exists}, Has PassKey: {has_passkey}")
     
@@ -262,7 +205,7 @@ async def register(token: str):
     # Si no existe la company_info, crearla
     if not company_exists:
         print("Creating company info record")
-        supabase.table("company_info").insert({
+        repositories.companies.insert({
             "name": payload.get("name"),
             "country_alpha_3": payload.get("country"),
             "city": payload.get("city"),
@@ -270,7 +213,7 @@ async def register(token: str):
             "address": payload.get("address"),
             "email": email,
             "tax_number": payload.get("tax_number")
-        }).execute()
+        })
         print("Company info created successfully")
     else:
         print("Company info already exists, proceeding to PassKey setup")
@@ -289,25 +232,26 @@ async def register_begin(request: Request):
         raise HTTPException(status_code=400, detail="Email is required")
 
     # Verificar que el usuario existe en company_info pero no tiene PassKey aún
-    supabase = create_supabase_client()
-    company_resp = supabase.table("company_info").select("email").eq("email", email).execute()
-    if not company_resp.data:
+    repositories = get_repositories()
+    if not repositories.companies.exists(email):
         raise HTTPException(status_code=404, detail="User not registered")
     
     # Verificar que no tenga PassKey ya registrado
-    creds_resp = supabase.table("credentials").select("email").eq("email", email).execute()
-    if creds_resp.data:
+    if repositories.credentials.exists(email):
         raise HTTPException(status_code=400, detail="PassKey already registered for this user")
 
     # Create user with properly encoded ID for webauthn_json_mapping
     user_id = base64.urlsafe_b64encode(email.encode()).decode().rstrip('=')
     user = {"id": user_id, "name": email, "displayName": email}
-    registration_data, state = fido_server.register_begin(
+    from fido2 import cbor
+    from fido2.webauthn import UserVerificationRequirement
+
+    registration_data, state = get_fido_server().register_begin(
         user,
         credentials=[],
         user_verification=UserVerificationRequirement.PREFERRED
     )
-    CHALLENGES[email] = state
+    repositories.challenges.put(email, state, CHALLENGE_TTL)
     
     # Convert the CredentialCreationOptions to a dictionary that can be CBOR encoded
     # The frontend expects a dictionary with challenge, rp, user, etc.
@@ -364,6 +308,14 @@ async def register_begin(request: Request):
 @router.post("/register/finish")
 async def register_finish(request: Request):
     body = await request.body()
+    fido_server = get_fido_server()
+    from fido2 import cbor
+    from fido2.webauthn import (
+        CollectedClientData,
+        AttestationObject,
+        AuthenticatorAttestationResponse,
+        RegistrationResponse
+    )
     
     try:
         print(f"Received body type: {type(body)}, length: {len(body)}")
@@ -415,7 +367,7 @@ async def register_finish(request: Request):
     print(f"Processing PassKey registration for email: {email}")
     print(f"Available data keys: {list(data.keys())}")
 
-    state = CHALLENGES.get(email)
+    state = get_repositories().challenges.get(email)
     if not state:
         raise HTTPException(status_code=400, detail="No challenge found for user")
 
@@ -497,8 +449,6 @@ async def register_finish(request: Request):
             except Exception as state_decode_err:
                 print(f"Error decoding state challenge: {state_decode_err}")
         
-        # Additional debug: Check what's in the CHALLENGES dict
-        print(f"All stored challenges keys: {list(CHALLENGES.keys())}")
         print(f"Current state object: {state}")
         if isinstance(state, dict):
             print(f"State dict keys: {state.keys()}")
@@ -527,10 +477,11 @@ async def register_finish(request: Request):
         
         # The FIDO2 server expects the state object exactly as returned by register_begin
         # Don't modify it, just pass it directly
-        auth_data = fido_server.register_complete(
-            state,
-            registration_response
-        )
+        with timed("fido2.register_complete"), span("fido2.register_complete"):
+            auth_data = fido_server.register_complete(
+                state,
+                registration_response
+            )
     except Exception as e:
         print(f"Error in register_complete: {e}")
         import traceback
@@ -578,8 +529,7 @@ async def register_finish(request: Request):
         # Use string representation as final fallback
         public_key_bytes = str(auth_data.credential_data.public_key).encode('utf-8')
 
-    supabase = create_supabase_client()
-    supabase.table("credentials").insert({
+    get_repositories().credentials.insert({
         "email": email,
         "credential_id": base64.b64encode(auth_data.credential_data.credential_id).decode('utf-8'),
         "public_key": base64.b64encode(public_key_bytes).decode('utf-8'),
@@ -587,7 +537,7 @@ async def register_finish(request: Request):
         "transports": getattr(auth_data, "transports", []),
         "attestation_type": getattr(auth_data, "attestation_type", "none"),
         "aaguid": str(getattr(auth_data.credential_data, "aaguid", ""))
-    }).execute()
+    })
 
     return {"msg": "¡User registered with PassKey!"}
 
@@ -597,12 +547,13 @@ async def login_begin(request: Request):
     data = await request.json()
     email = data.get("email")
 
-    supabase = create_supabase_client()
-    resp = supabase.table("credentials").select("*").eq("email", email).execute()
-    credentials = resp.data
+    credentials = get_repositories().credentials.list_for(email)
     if not credentials:
         raise HTTPException(status_code=404, detail="User not found or no passkey registered")
 
+    fido_server = get_fido_server()
+    from fido2.webauthn import PublicKeyCredentialDescriptor, PublicKeyCredentialType
+
     creds = []
     for c in credentials:
         try:
@@ -657,7 +608,7 @@ async def login_begin(request: Request):
         # Still use open authentication to allow Windows Hello
         auth_data, state = fido_server.authenticate_begin([])
     
-    CHALLENGES[email] = state
+    get_repositories().challenges.put(email, state, CHALLENGE_TTL)
 
     print(f"Auth data public key attributes: {dir(auth_data.public_key)}")
     print(f"Allow credentials count: {len(auth_data.public_key.allow_credentials)}")
@@ -708,6 +659,9 @@ async def login_begin(request: Request):
 
 @router.post("/login/complete")
 async def login_complete(request: Request):
+    get_fido_server()  # also enables the webauthn_json_mapping feature
+    from fido2.webauthn import CollectedClientData
+
     try:
         data = await request.json()  # Changed from CBOR to JSON
         email = data.get("email")
@@ -715,7 +669,7 @@ async def login_complete(request: Request):
         if not email:
             raise HTTPException(status_code=400, detail="Email is required")
             
-        state = CHALLENGES.get(email)
+        state = get_repositories().challenges.get(email)
         if not state:
             raise HTTPException(status_code=400, detail="No challenge found")
 
@@ -779,10 +733,9 @@ async def login_complete(request: Request):
         print(f"Client data challenge matches: {client_data.challenge == state_challenge_bytes}")
         
         # Get credentials from database to verify ownership
-        supabase = create_supabase_client()
-        resp = supabase.table("credentials").select("*").eq("email", email).execute()
+        credentials = get_repositories().credentials.list_for(email)
         
-        if not resp.data:
+        if not credentials:
             raise HTTPException(status_code=400, detail="No credentials found for user")
             
         # Find matching credential ID
@@ -791,7 +744,7 @@ async def login_complete(request: Request):
         print(f"Received credential ID length: {len(credential_id)}")
         print(f"Received credential ID: {credential_id}")
         
-        for cred in resp.data:
+        for cred in credentials:
             try:
                 # Try to decode stored credential_id to compare
                 stored_cred_id = cred["credential_id"]
@@ -897,7 +850,7 @@ async def login_complete(request: Request):
         print(f"Authentication verification successful for {email}")
         
         # Remove used challenge
-        del CHALLENGES[email]
+        get_repositories().challenges.delete(email)
         
     except HTTPException:
         raise
@@ -908,13 +861,12 @@ async def login_complete(request: Request):
         raise HTTPException(status_code=400, detail=f"Authentication failed: {str(e)}")
 
     # Create JWT token for successful authentication
-    JWT_SECRET = os.getenv("JWT_SECRET")
-    JWT_EXP = int(os.getenv("JWT_EXPIRATION_TIME", 3600))
+    JWT_EXP = get_settings().jwt_expiration_time
     token_payload = {
         "email": email,
         "exp": datetime.now(timezone.utc) + timedelta(seconds=JWT_EXP)
     }
-    token = jwt.encode(token_payload, JWT_SECRET, algorithm="HS256")
+    token = encode_token(token_payload)
 
     return {"status": "logged_in", "token": token}
 
@@ -923,28 +875,25 @@ async def login_complete(request: Request):
 @router.post("/auth/login")
 async def merchant_login(request: LoginRequest):
     """Login endpoint for merchants using email and passkey"""
-    supabase = create_supabase_client()
+    companies = get_repositories().companies
     
     try:
         # Check if merchant exists
-        response = supabase.table("company_info").select("email").eq("email", request.email).execute()
-        
-        if not response.data:
+        if not companies.exists(request.email):
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
         # For now, we'll use a simple check - in production you'd verify passkey
         # You can implement WebAuthn passkey verification here
         
         # Generate JWT token
-        JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key")
-        JWT_EXP = int(os.getenv("JWT_EXPIRATION_TIME", "3600"))
+        JWT_EXP = get_settings().jwt_expiration_time
         
         token_payload = {
             "email": request.email,
             "exp": datetime.now(timezone.utc) + timedelta(seconds=JWT_EXP)
         }
         
-        token = jwt.encode(token_payload, JWT_SECRET, algorithm="HS256")
+        token = encode_token(token_payload)
         
         return {"tokenJWT": token}
         
@@ -2,105 +2,78 @@ from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from utils.models import EInvoiceRequest, EInvoiceResponse, EInvoiceStatus, InvoiceStatus
 from datetime import datetime, timezone
-from supabase import create_client, Client
-from dotenv import load_dotenv
-import os
+from utils.database import get_read_repositories, get_repositories, note_write
+from utils.einvoice_pipeline import SUBMIT_LEASE_SECONDS, pipeline
+from utils.jobs import job
+from utils.tokens import decode_token
+import asyncio
 import jwt
-import requests
 import json
 
 router = APIRouter()
 security = HTTPBearer()
-load_dotenv()
 
-def create_supabase_client():
-    url: str = os.getenv("DATABASE_URL")
-    key: str = os.getenv("DATABASE_APIKEY")
-    supabase: Client = create_client(url, key)
-    return supabase
+# E-invoice states a merchant may submit by hand (SUBMITTED and SENT are past submission)
+SENDABLE_STATUSES = [EInvoiceStatus.PENDING.value, EInvoiceStatus.FAILED.value, EInvoiceStatus.DEAD.value]
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verify JWT token and return merchant email"""
     token = credentials.credentials
     try:
-        payload = jwt.decode(token, os.getenv("JWT_SECRET", "your-secret-key"), algorithms=["HS256"])
+        payload = decode_token(token)
         return payload.get("email")
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-async def send_to_sri_service(invoice_data: dict) -> dict:
-    """Send invoice to SRI/electronic invoicing service"""
-    # This is a mock implementation
-    # In a real implementation, you would integrate with your country's
-    # electronic invoicing system (SRI in Ecuador, DIAN in Colombia, etc.)
-    
-    sri_endpoint = os.getenv("SRI_ENDPOINT", "https://api.sri.gob.ec/invoices")
-    api_key = os.getenv("SRI_API_KEY", "your-sri-api-key")
+@job("einvoice.send")
+async def einvoice_job(payload: dict):
+    """Jobs queued before the two-phase pipeline; PENDING invoices are its queue now"""
+    pipeline.wake()
+
+async def submit_leased(invoice: dict, merchant: dict) -> EInvoiceResponse:
+    """Phase 1 for one invoice this request holds the lease on; authorization follows on the pipeline's schedule"""
+    merchant_email = invoice["merchant_email"]
+    changes = await pipeline.submit_invoices([invoice], {merchant_email: merchant})
+    await asyncio.to_thread(pipeline.apply_changes, changes)
+    note_write(merchant_email, invoice["id"])
+    change = changes[0]
     
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+    if "einvoice_status" not in change:
+        # Provider unavailable: the invoice stays PENDING for a later retry
+        raise HTTPException(status_code=503, detail="E-invoice provider unavailable, invoice left PENDING")
     
-    payload = {
-        "invoice_id": invoice_data["invoice_id"],
-        "merchant": {
-            "name": invoice_data["merchant_name"],
-            "email": invoice_data["merchant_email"],
-            "tax_number": invoice_data["merchant_tax_number"]
-        },
-        "customer": {
-            "email": invoice_data["customer_email"]
-        },
-        "items": invoice_data["items"],
-        "subtotal": invoice_data["subtotal"],
-        "tax_amount": invoice_data["tax_amount"],
-        "total": invoice_data["total"],
-        "payment_method": "CRYPTO",
-        "payment_reference": invoice_data["tx_hash"]
-    }
+    if change["einvoice_status"] in (EInvoiceStatus.FAILED.value, EInvoiceStatus.DEAD.value):
+        raise HTTPException(status_code=502, detail=f"Failed to send e-invoice: {change['einvoice_error']}")
     
-    try:
-        # Mock response for demonstration
-        # In production, you would make the actual API call:
-        # response = requests.post(sri_endpoint, json=payload, headers=headers)
-        # response.raise_for_status()
-        # result = response.json()
-        
-        # Mock successful response
-        result = {
-            "einvoice_number": f"001-001-{invoice_data['invoice_id'][-6:]}",
-            "einvoice_url": f"https://sri.gob.ec/einvoice/{invoice_data['invoice_id']}",
-            "status": "SENT",
-            "authorization_code": f"AUTH-{invoice_data['invoice_id'][-8:]}"
-        }
-        
-        return result
-        
-    except requests.RequestException as e:
-        raise Exception(f"SRI service error: {str(e)}")
-    except Exception as e:
-        raise Exception(f"Failed to send to SRI: {str(e)}")
+    return EInvoiceResponse(
+        status=EInvoiceStatus.SUBMITTED,
+        access_key=change["einvoice_access_key"]
+    )
+
+def claim_or_conflict(invoice_id: str, merchant_email: str, statuses: list) -> dict:
+    """Lease the invoice like a pipeline pass would, so the two never submit it together"""
+    invoice = get_repositories().invoices.claim_einvoice(invoice_id, merchant_email, statuses, SUBMIT_LEASE_SECONDS)
+    if invoice is None:
+        raise HTTPException(status_code=409, detail="E-invoice is being processed, try again shortly")
+    return invoice
 
 @router.post("/einvoice/{invoice_id}/send", response_model=EInvoiceResponse)
 async def send_einvoice(
     invoice_id: str,
     merchant_email: str = Depends(verify_token)
 ):
-    """Send invoice to electronic invoicing service (SRI/provider)"""
-    supabase = create_supabase_client()
+    """Submit invoice to electronic invoicing service (SRI/provider) now instead of waiting for the pipeline"""
+    repositories = get_repositories()
     
     try:
         # Get invoice
-        response = supabase.table("invoices").select("*").eq("id", invoice_id).eq("merchant_email", merchant_email).execute()
+        invoice = repositories.invoices.get(invoice_id, merchant_email)
         
-        if not response.data:
+        if invoice is None:
             raise HTTPException(status_code=404, detail="Invoice not found")
         
-        invoice = response.data[0]
-        
         # Check if invoice is paid
         if invoice["status"] != InvoiceStatus.PAID.value:
             raise HTTPException(status_code=400, detail="Invoice must be PAID to send e-invoice")
@@ -109,66 +82,21 @@ async def send_einvoice(
         if invoice.get("einvoice_status") == EInvoiceStatus.SENT.value:
             raise HTTPException(status_code=400, detail="E-invoice already sent")
         
+        if invoice.get("einvoice_status") == EInvoiceStatus.SUBMITTED.value:
+            raise HTTPException(status_code=400, detail="E-invoice already submitted, awaiting authorization")
+        
         # Get merchant details
-        merchant_response = supabase.table("company_info").select("*").eq("email", merchant_email).execute()
+        merchant = repositories.companies.get(merchant_email)
         
-        if not merchant_response.data:
+        if merchant is None:
             raise HTTPException(status_code=400, detail="Merchant details not found")
         
-        merchant = merchant_response.data[0]
-        
-        # Prepare invoice data for SRI
-        invoice_data = {
-            "invoice_id": invoice["invoice_id"],
-            "merchant_name": merchant.get("name", ""),
-            "merchant_email": merchant_email,
-            "merchant_tax_number": merchant.get("tax_number", ""),
-            "customer_email": invoice["customer_email"],
-            "items": invoice["items"],
-            "subtotal": invoice["subtotal"],
-            "tax_amount": invoice["tax_amount"],
-            "total": invoice["total"],
-            "tx_hash": invoice.get("tx_hash", "")
-        }
-        
-        # Send to SRI service
-        sri_result = await send_to_sri_service(invoice_data)
-        
-        # Update invoice with e-invoice details
-        now = datetime.now(timezone.utc)
-        update_data = {
-            "einvoice_number": sri_result["einvoice_number"],
-            "einvoice_url": sri_result["einvoice_url"],
-            "einvoice_status": EInvoiceStatus.SENT.value,
-            "einvoice_sent_at": now.isoformat(),
-            "updated_at": now.isoformat()
-        }
-        
-        if sri_result.get("authorization_code"):
-            update_data["einvoice_authorization"] = sri_result["authorization_code"]
-        
-        supabase.table("invoices").update(update_data).eq("id", invoice_id).execute()
-        
-        return EInvoiceResponse(
-            einvoice_number=sri_result["einvoice_number"],
-            einvoice_url=sri_result["einvoice_url"],
-            status=EInvoiceStatus.SENT
-        )
+        invoice = claim_or_conflict(invoice_id, merchant_email, SENDABLE_STATUSES)
+        return await submit_leased(invoice, merchant)
         
     except HTTPException:
         raise
     except Exception as e:
-        # Mark as failed
-        now = datetime.now(timezone.utc)
-        try:
-            supabase.table("invoices").update({
-                "einvoice_status": EInvoiceStatus.FAILED.value,
-                "einvoice_error": str(e),
-                "updated_at": now.isoformat()
-            }).eq("id", invoice_id).execute()
-        except:
-            pass
-        
         raise HTTPException(status_code=500, detail=f"Failed to send e-invoice: {str(e)}")
 
 @router.post("/einvoice/{invoice_id}/retry", response_model=EInvoiceResponse)
@@ -176,36 +104,45 @@ async def retry_einvoice(
     invoice_id: str,
     merchant_email: str = Depends(verify_token)
 ):
-    """Retry sending e-invoice if previously failed"""
-    supabase = create_supabase_client()
+    """Retry sending e-invoice now if previously failed, including dead-lettered ones"""
+    repositories = get_repositories()
+    invoices = repositories.invoices
     
     try:
         # Get invoice
-        response = supabase.table("invoices").select("*").eq("id", invoice_id).eq("merchant_email", merchant_email).execute()
+        invoice = invoices.get(invoice_id, merchant_email)
         
-        if not response.data:
+        if invoice is None:
             raise HTTPException(status_code=404, detail="Invoice not found")
         
-        invoice = response.data[0]
-        
         # Check if invoice is paid
         if invoice["status"] != InvoiceStatus.PAID.value:
             raise HTTPException(status_code=400, detail="Invoice must be PAID to send e-invoice")
         
         # Check if in FAILED status
-        if invoice.get("einvoice_status") not in [EInvoiceStatus.FAILED.value, EInvoiceStatus.PENDING.value]:
-            raise HTTPException(status_code=400, detail="Can only retry FAILED or PENDING e-invoices")
+        if invoice.get("einvoice_status") not in SENDABLE_STATUSES:
+            raise HTTPException(status_code=400, detail="Can only retry FAILED, DEAD or PENDING e-invoices")
+        
+        merchant = repositories.companies.get(merchant_email)
+        
+        if merchant is None:
+            raise HTTPException(status_code=400, detail="Merchant details not found")
         
-        # Reset status to PENDING before retry
-        now = datetime.now(timezone.utc)
-        supabase.table("invoices").update({
+        # Lease before resetting, so the reset can't land on a row a pipeline pass is submitting
+        invoice = claim_or_conflict(invoice_id, merchant_email, SENDABLE_STATUSES)
+        
+        # Reset status to PENDING before retry; a manual retry starts a fresh attempt budget
+        reset = {
             "einvoice_status": EInvoiceStatus.PENDING.value,
             "einvoice_error": None,
-            "updated_at": now.isoformat()
-        }).eq("id", invoice_id).execute()
+            "einvoice_attempts": 0,
+            "einvoice_next_attempt_at": None,
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }
+        invoices.update(invoice_id, reset)
+        invoice.update(reset)
         
-        # Call the send function
-        return await send_einvoice(invoice_id, merchant_email)
+        return await submit_leased(invoice, merchant)
         
     except HTTPException:
         raise
@@ -218,25 +155,31 @@ async def get_einvoice_status(
     merchant_email: str = Depends(verify_token)
 ):
     """Get e-invoice status"""
-    supabase = create_supabase_client()
-    
     try:
         # Get invoice
-        response = supabase.table("invoices").select(
-            "einvoice_status,einvoice_number,einvoice_url,einvoice_error,einvoice_sent_at"
-        ).eq("id", invoice_id).eq("merchant_email", merchant_email).execute()
+        invoice = get_read_repositories(merchant_email, invoice_id).invoices.get(
+            invoice_id,
+            merchant_email,
+            "einvoice_status,einvoice_number,einvoice_url,einvoice_error,einvoice_sent_at,"
+            "einvoice_access_key,einvoice_authorization,einvoice_submitted_at,einvoice_authorized_at,"
+            "einvoice_attempts,einvoice_next_attempt_at"
+        )
         
-        if not response.data:
+        if invoice is None:
             raise HTTPException(status_code=404, detail="Invoice not found")
         
-        invoice = response.data[0]
-        
         return {
             "invoice_id": invoice_id,
             "status": invoice.get("einvoice_status", EInvoiceStatus.PENDING.value),
             "einvoice_number": invoice.get("einvoice_number"),
             "einvoice_url": invoice.get("einvoice_url"),
+            "access_key": invoice.get("einvoice_access_key"),
+            "authorization": invoice.get("einvoice_authorization"),
             "error": invoice.get("einvoice_error"),
+            "attempts": invoice.get("einvoice_attempts") or 0,
+            "next_attempt_at": invoice.get("einvoice_next_attempt_at"),
+            "submitted_at": invoice.get("einvoice_submitted_at"),
+            "authorized_at": invoice.get("einvoice_authorized_at"),
             "sent_at": invoice.get("einvoice_sent_at")
         }
         
@@ -248,72 +191,19 @@ async def get_einvoice_status(
 # Batch process for automatic e-invoice sending
 @router.post("/einvoice/batch/process")
 async def process_pending_einvoices():
-    """Background task to process pending e-invoices"""
-    supabase = create_supabase_client()
-    
+    """Run one pipeline pass now: submit pending e-invoices, retry due failed ones and poll authorizations"""
     try:
-        # Get paid invoices with pending e-invoice status
-        response = supabase.table("invoices").select("*").eq("status", InvoiceStatus.PAID.value).eq("einvoice_status", EInvoiceStatus.PENDING.value).limit(10).execute()
-        
-        processed_count = 0
-        failed_count = 0
-        
-        for invoice in response.data:
-            try:
-                # Get merchant details
-                merchant_response = supabase.table("company_info").select("*").eq("email", invoice["merchant_email"]).execute()
-                
-                if not merchant_response.data:
-                    continue
-                
-                merchant = merchant_response.data[0]
-                
-                # Prepare invoice data
-                invoice_data = {
-                    "invoice_id": invoice["invoice_id"],
-                    "merchant_name": merchant.get("name", ""),
-                    "merchant_email": invoice["merchant_email"],
-                    "merchant_tax_number": merchant.get("tax_number", ""),
-                    "customer_email": invoice["customer_email"],
-                    "items": invoice["items"],
-                    "subtotal": invoice["subtotal"],
-                    "tax_amount": invoice["tax_amount"],
-                    "total": invoice["total"],
-                    "tx_hash": invoice.get("tx_hash", "")
-                }
-                
-                # Send to SRI
-                sri_result = await send_to_sri_service(invoice_data)
-                
-                # Update invoice
-                now = datetime.now(timezone.utc)
-                update_data = {
-                    "einvoice_number": sri_result["einvoice_number"],
-                    "einvoice_url": sri_result["einvoice_url"],
-                    "einvoice_status": EInvoiceStatus.SENT.value,
-                    "einvoice_sent_at": now.isoformat(),
-                    "updated_at": now.isoformat()
-                }
-                
-                supabase.table("invoices").update(update_data).eq("id", invoice["id"]).execute()
-                processed_count += 1
-                
-            except Exception as e:
-                # Mark as failed
-                now = datetime.now(timezone.utc)
-                supabase.table("invoices").update({
-                    "einvoice_status": EInvoiceStatus.FAILED.value,
-                    "einvoice_error": str(e),
-                    "updated_at": now.isoformat()
-                }).eq("id", invoice["id"]).execute()
-                failed_count += 1
-        
-        return {
-            "status": "success",
-            "processed": processed_count,
-            "failed": failed_count,
-            "total": len(response.data)
-        }
+        result = await pipeline.tick()
+        return {"status": "success", **result}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process pending e-invoices: {str(e)}")
+
+@router.get("/einvoice/pipeline/metrics")
+async def get_pipeline_metrics():
+    """Queue depth and lag of both pipeline phases, plus this worker's counters"""
+    try:
+        return await asyncio.to_thread(pipeline.queue_metrics)
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get pipeline metrics: {str(e)}")
@@ -0,0 +1,95 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import json
+import jwt
+from utils.database import get_repositories
+from utils.events import CLOSED, hub, invoice_event
+from utils.models import InvoiceStatus
+from utils.singleflight import reads
+from utils.tokens import decode_token
+
+router = APIRouter()
+
+# Comment line sent on idle streams so proxies don't close them
+HEARTBEAT_SECONDS = 15
+# Client reconnect delay (EventSource "retry" field)
+RETRY_MS = 3000
+TERMINAL_STATUSES = {InvoiceStatus.PAID.value, InvoiceStatus.CANCELED.value, InvoiceStatus.EXPIRED.value}
+# Initial snapshot of a checkout stream
+STREAM_COLUMNS = "id,invoice_id,status,tx_hash,updated_at"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # disable nginx response buffering
+}
+
+def format_event(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+async def event_stream(topic: str, initial: Optional[dict] = None, close_on_terminal: bool = False):
+    # Subscribe once the response starts streaming, so a client that is gone
+    # before then never leaves a subscription behind
+    subscription = hub.subscribe(topic)
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        if initial:
+            yield format_event(initial)
+            if close_on_terminal and initial["status"] in TERMINAL_STATUSES:
+                return
+        while True:
+            event = await subscription.get(HEARTBEAT_SECONDS)
+            if event is CLOSED:
+                return
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            if event == initial:
+                # The change feed re-reads recent changes; don't repeat the snapshot just sent
+                continue
+            yield format_event(event)
+            if close_on_terminal and event["status"] in TERMINAL_STATUSES:
+                return
+    finally:
+        subscription.close()
+
+@router.get("/pay/{invoice_id}/events")
+async def invoice_events(invoice_id: str):
+    """Public SSE stream of status changes for one invoice (checkout page)"""
+    try:
+        # By invoice number, falling back to the internal id
+        invoices = get_repositories().invoices
+        invoice = await reads.run(
+            "invoices.get_public", (invoice_id, STREAM_COLUMNS, invoices), invoices.get_public, invoice_id, STREAM_COLUMNS
+        )
+
+        if invoice is None:
+            raise HTTPException(status_code=404, detail="Invoice not found")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get invoice: {str(e)}")
+
+    return StreamingResponse(
+        event_stream(f"invoice:{invoice['id']}", invoice_event(invoice), close_on_terminal=True),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+@router.get("/events")
+async def merchant_events(request: Request, token: Optional[str] = Query(None, description="JWT (EventSource cannot send headers)")):
+    """SSE stream of status changes for all of the merchant's invoices"""
+    if token is None:
+        authorization = request.headers.get("authorization", "")
+        if authorization.lower().startswith("bearer "):
+            token = authorization[7:]
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    try:
+        merchant_email = decode_token(token).get("email")
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    return StreamingResponse(event_stream(f"merchant:{merchant_email}"), media_type="text/event-stream", headers=SSE_HEADERS)
@@ -1,110 +1,129 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from utils.models import (
     CreateInvoiceRequest, InvoiceResponse, EmitInvoiceResponse, 
-    PaymentRequest, InvoiceStatus, EInvoiceStatus, DashboardMetrics
+    PaymentRequest, InvoiceStatus, EInvoiceStatus, DashboardMetrics, DashboardAnalytics,
+    BulkCreateInvoiceRequest, BulkEmitInvoiceRequest, BulkInvoiceResult, BulkInvoiceResponse
 )
+from pydantic import ValidationError
 from typing import List, Optional
 import jwt
-import os
 import uuid
 import json
-from datetime import datetime, timezone, timedelta
-from supabase import create_client, Client
-from dotenv import load_dotenv
+import csv
+import io
+from datetime import date, datetime, timezone, timedelta
+import asyncio
+from utils.analytics import INTERVALS, refresh_snapshot
+from utils.database import get_read_repositories, get_repositories, note_write
+from utils.events import hub
+from utils.http_cache import cache_headers, make_etag, not_modified
+from utils.money import calculate_totals, from_units, row_units
+from utils.serialization import FastJSONResponse, utc_timestamp
+from utils.settings import get_settings
+from utils.singleflight import reads
+from utils.tokens import decode_token
 
 router = APIRouter()
 security = HTTPBearer()
-load_dotenv()
 
-def create_supabase_client():
-    url: str = os.getenv("DATABASE_URL")
-    key: str = os.getenv("DATABASE_APIKEY")
-    supabase: Client = create_client(url, key)
-    return supabase
+# Rows per multi-row insert/upsert in the bulk endpoints
+BULK_CHUNK_SIZE = 500
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verify JWT token and return merchant email"""
     token = credentials.credentials
     try:
-        payload = jwt.decode(token, os.getenv("JWT_SECRET", "your-secret-key"), algorithms=["HS256"])
+        payload = decode_token(token)
         return payload.get("email")
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-def calculate_totals(items, tax_rate):
-    """Calculate subtotal, tax amount, and total"""
-    subtotal = sum(item.qty * item.unit_price for item in items)
-    tax_amount = subtotal * tax_rate
-    total = subtotal + tax_amount
-    # Assuming 1 USD = 1 USDC for simplicity (you can add exchange rate logic)
-    total_usdc = total
-    return subtotal, tax_amount, total, total_usdc
-
-def generate_qr_url(invoice_id: str, amount_usdc: float) -> str:
+def generate_qr_url(invoice_id: str, amount_units: int) -> str:
     """Generate EIP-681 QR URL for USDC payment on Base"""
     # Base USDC contract address (you should update this with the actual address)
     usdc_contract = "0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913"  # USDC on Base
-    # Convert amount to USDC decimals (6 decimals)
-    amount_wei = int(amount_usdc * 10**6)
+    # Amounts are already in USDC base units (6 decimals)
+    amount_wei = amount_units
     
     # EIP-681 format for token transfer
     # ethereum:<contract_address>/transfer?address=<recipient>&uint256=<amount>
-    merchant_wallet = os.getenv("MERCHANT_WALLET_ADDRESS", "0x0000000000000000000000000000000000000000")
+    merchant_wallet = get_settings().merchant_wallet_address
     
     eip681_uri = f"ethereum:{usdc_contract}/transfer?address={merchant_wallet}&uint256={amount_wei}&chainId=8453"
     return eip681_uri
 
 def generate_checkout_url(invoice_id: str) -> str:
     """Generate checkout URL"""
-    base_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
+    base_url = get_settings().frontend_url
     return f"{base_url}/pay/{invoice_id}"
 
-@router.post("/invoices", response_model=InvoiceResponse)
-async def create_invoice(
-    request: CreateInvoiceRequest,
-    merchant_email: str = Depends(verify_token)
-):
-    """Create invoice in DRAFT status"""
-    supabase = create_supabase_client()
-    
-    # Calculate totals
-    subtotal, tax_amount, total, total_usdc = calculate_totals(request.items, request.tax)
-    
-    # Create invoice record
-    invoice_id = str(uuid.uuid4())
-    now = datetime.now(timezone.utc)
-    
-    invoice_data = {
-        "id": invoice_id,
+def build_invoice_row(merchant_email: str, request: CreateInvoiceRequest, now: datetime) -> dict:
+    """Invoice row in DRAFT status with totals computed in USDC base units"""
+    totals = calculate_totals(request.items, request.tax)
+    return {
+        "id": str(uuid.uuid4()),
         "merchant_email": merchant_email,
         "customer_email": request.customer_email,
         "items": [item.dict() for item in request.items],
-        "subtotal": subtotal,
-        "tax_amount": tax_amount,
+        "subtotal": from_units(totals.subtotal),
+        "tax_amount": from_units(totals.tax_amount),
         "tax_rate": request.tax,
-        "total": total,
-        "total_usdc": total_usdc,
+        "total": from_units(totals.total),
+        "total_usdc": from_units(totals.total_usdc),
+        "subtotal_units": totals.subtotal,
+        "tax_amount_units": totals.tax_amount,
+        "total_units": totals.total,
+        "total_usdc_units": totals.total_usdc,
         "status": InvoiceStatus.DRAFT.value,
         "created_at": now.isoformat(),
         "updated_at": now.isoformat(),
         "einvoice_status": EInvoiceStatus.PENDING.value
     }
+
+def issue_fields(invoice_id: str, amount_units: int, now: datetime) -> dict:
+    """Fields that move an invoice from DRAFT to ISSUED"""
+    return {
+        "status": InvoiceStatus.ISSUED.value,
+        "invoice_id": f"INV-{now.strftime('%Y%m%d')}-{invoice_id[:8].upper()}",
+        "qr_url": generate_qr_url(invoice_id, amount_units),
+        "checkout_url": generate_checkout_url(invoice_id),
+        "updated_at": now.isoformat(),
+        "issued_at": now.isoformat()
+    }
+
+def chunked(values: list, size: int = BULK_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+@router.post("/invoices", response_model=InvoiceResponse)
+async def create_invoice(
+    request: CreateInvoiceRequest,
+    merchant_email: str = Depends(verify_token)
+):
+    """Create invoice in DRAFT status"""
+    invoices = get_repositories().invoices
+    
+    now = datetime.now(timezone.utc)
+    invoice_data = build_invoice_row(merchant_email, request, now)
     
     try:
-        response = supabase.table("invoices").insert(invoice_data).execute()
+        invoices.insert(invoice_data)
+        note_write(merchant_email)
         
         return InvoiceResponse(
-            id=invoice_id,
+            id=invoice_data["id"],
             merchant_email=merchant_email,
             customer_email=request.customer_email,
             items=request.items,
-            subtotal=subtotal,
-            tax_amount=tax_amount,
-            total=total,
-            total_usdc=total_usdc,
+            subtotal=invoice_data["subtotal"],
+            tax_amount=invoice_data["tax_amount"],
+            total=invoice_data["total"],
+            total_usdc=invoice_data["total_usdc"],
+            total_usdc_units=invoice_data["total_usdc_units"],
             status=InvoiceStatus.DRAFT,
             created_at=now,
             updated_at=now,
@@ -113,50 +132,153 @@ async def create_invoice(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create invoice: {str(e)}")
 
+@router.post("/invoices/bulk", response_model=BulkInvoiceResponse)
+async def create_invoices_bulk(
+    request: BulkCreateInvoiceRequest,
+    merchant_email: str = Depends(verify_token)
+):
+    """Create many invoices with chunked multi-row inserts; optionally emit them in the same write"""
+    invoices = get_repositories().invoices
+    now = datetime.now(timezone.utc)
+    results: List[BulkInvoiceResult] = []
+    pending = []  # (result, row) pairs ready to insert
+
+    # Validate each invoice on its own so one bad entry doesn't reject the batch
+    for index, entry in enumerate(request.invoices):
+        try:
+            invoice_request = CreateInvoiceRequest.model_validate(entry)
+        except ValidationError as e:
+            results.append(BulkInvoiceResult(index=index, status="error", error=str(e)))
+            continue
+        row = build_invoice_row(merchant_email, invoice_request, now)
+        if request.emit:
+            row.update(issue_fields(row["id"], row["total_usdc_units"], now))
+        result = BulkInvoiceResult(
+            index=index,
+            id=row["id"],
+            status="emitted" if request.emit else "created",
+            invoice_id=row.get("invoice_id"),
+            qr_url=row.get("qr_url"),
+            checkout_url=row.get("checkout_url")
+        )
+        results.append(result)
+        pending.append((result, row))
+
+    for chunk in chunked(pending):
+        try:
+            invoices.insert_many([row for _, row in chunk])
+        except Exception:
+            # Isolate the offending rows so the rest of the chunk still lands
+            for result, row in chunk:
+                try:
+                    invoices.insert(row)
+                except Exception as e:
+                    result.status = "error"
+                    result.error = f"Failed to create invoice: {str(e)}"
+    note_write(merchant_email)
+
+    results.sort(key=lambda result: result.index)
+    failed = sum(1 for result in results if result.status == "error")
+    return BulkInvoiceResponse(succeeded=len(results) - failed, failed=failed, results=results)
+
+@router.post("/invoices/bulk/emit", response_model=BulkInvoiceResponse)
+async def emit_invoices_bulk(
+    request: BulkEmitInvoiceRequest,
+    merchant_email: str = Depends(verify_token)
+):
+    """Move many DRAFT invoices to ISSUED with one select and one conditional update per chunk"""
+    invoices = get_repositories().invoices
+    now = datetime.now(timezone.utc)
+    results = {}
+
+    for chunk in chunked(list(dict.fromkeys(request.ids))):
+        try:
+            rows = invoices.find_many(chunk, merchant_email)
+        except Exception as e:
+            for invoice_id in chunk:
+                results[invoice_id] = BulkInvoiceResult(index=0, id=invoice_id, status="error", error=f"Failed to emit invoice: {str(e)}")
+            continue
+
+        found = {row["id"]: row for row in rows}
+        issued_rows = []
+        for invoice_id in chunk:
+            row = found.get(invoice_id)
+            if row is None:
+                results[invoice_id] = BulkInvoiceResult(index=0, id=invoice_id, status="error", error="Invoice not found")
+            elif row["status"] != InvoiceStatus.DRAFT.value:
+                results[invoice_id] = BulkInvoiceResult(index=0, id=invoice_id, status="error", error="Invoice must be in DRAFT status to emit")
+            else:
+                issued_rows.append({"id": invoice_id, **issue_fields(invoice_id, row_units(row, "total_usdc"), now)})
+
+        if not issued_rows:
+            continue
+
+        # One conditional update for the chunk: a row emitted or canceled since the
+        # select above is skipped rather than overwritten, keeping its invoice number
+        try:
+            issued = set(invoices.issue_many(merchant_email, issued_rows))
+        except Exception as e:
+            for row in issued_rows:
+                results[row["id"]] = BulkInvoiceResult(index=0, id=row["id"], status="error", error=f"Failed to emit invoice: {str(e)}")
+            continue
+        for row in issued_rows:
+            if row["id"] not in issued:
+                results[row["id"]] = BulkInvoiceResult(index=0, id=row["id"], status="error", error="Invoice must be in DRAFT status to emit")
+                continue
+            results[row["id"]] = BulkInvoiceResult(
+                index=0,
+                id=row["id"],
+                status="emitted",
+                invoice_id=row["invoice_id"],
+                qr_url=row["qr_url"],
+                checkout_url=row["checkout_url"]
+            )
+
+    note_write(merchant_email)
+    ordered = []
+    first_index = {}
+    for index, invoice_id in enumerate(request.ids):
+        if invoice_id in first_index:
+            # Emitted (or failed) once, under the first occurrence; a repeat is not another success
+            result = BulkInvoiceResult(index=index, id=invoice_id, status="error",
+                                       error=f"Duplicate id; see index {first_index[invoice_id]}")
+        else:
+            first_index[invoice_id] = index
+            result = results[invoice_id].model_copy(update={"index": index})
+        ordered.append(result)
+    failed = sum(1 for result in ordered if result.status == "error")
+    return BulkInvoiceResponse(succeeded=len(ordered) - failed, failed=failed, results=ordered)
+
 @router.post("/invoices/{invoice_id}/emit", response_model=EmitInvoiceResponse)
 async def emit_invoice(
     invoice_id: str,
     merchant_email: str = Depends(verify_token)
 ):
     """Change invoice from DRAFT to ISSUED and generate QR/checkout URLs"""
-    supabase = create_supabase_client()
+    invoices = get_repositories().invoices
     
     # Get invoice
     try:
-        response = supabase.table("invoices").select("*").eq("id", invoice_id).eq("merchant_email", merchant_email).execute()
+        invoice = invoices.get(invoice_id, merchant_email)
         
-        if not response.data:
+        if invoice is None:
             raise HTTPException(status_code=404, detail="Invoice not found")
         
-        invoice = response.data[0]
-        
         if invoice["status"] != InvoiceStatus.DRAFT.value:
             raise HTTPException(status_code=400, detail="Invoice must be in DRAFT status to emit")
         
-        # Generate unique invoice number
-        invoice_number = f"INV-{datetime.now().strftime('%Y%m%d')}-{invoice_id[:8].upper()}"
-        
-        # Generate QR and checkout URLs
-        qr_url = generate_qr_url(invoice_id, invoice["total_usdc"])
-        checkout_url = generate_checkout_url(invoice_id)
-        
-        # Update invoice status
+        # Generate invoice number, QR and checkout URLs
         now = datetime.now(timezone.utc)
-        update_data = {
-            "status": InvoiceStatus.ISSUED.value,
-            "invoice_id": invoice_number,
-            "qr_url": qr_url,
-            "checkout_url": checkout_url,
-            "updated_at": now.isoformat(),
-            "issued_at": now.isoformat()
-        }
+        update_data = issue_fields(invoice_id, row_units(invoice, "total_usdc"), now)
         
-        supabase.table("invoices").update(update_data).eq("id", invoice_id).execute()
+        # Update invoice status
+        invoices.update(invoice_id, update_data)
+        note_write(merchant_email, invoice_id, update_data["invoice_id"])
         
         return EmitInvoiceResponse(
-            invoice_id=invoice_number,
-            qr_url=qr_url,
-            checkout_url=checkout_url
+            invoice_id=update_data["invoice_id"],
+            qr_url=update_data["qr_url"],
+            checkout_url=update_data["checkout_url"]
         )
         
     except Exception as e:
@@ -168,17 +290,15 @@ async def cancel_invoice(
     merchant_email: str = Depends(verify_token)
 ):
     """Cancel invoice if ISSUED and not paid"""
-    supabase = create_supabase_client()
+    invoices = get_repositories().invoices
     
     try:
         # Get invoice
-        response = supabase.table("invoices").select("*").eq("id", invoice_id).eq("merchant_email", merchant_email).execute()
+        invoice = invoices.get(invoice_id, merchant_email)
         
-        if not response.data:
+        if invoice is None:
             raise HTTPException(status_code=404, detail="Invoice not found")
         
-        invoice = response.data[0]
-        
         if invoice["status"] != InvoiceStatus.ISSUED.value:
             raise HTTPException(status_code=400, detail="Only ISSUED invoices can be canceled")
         
@@ -187,19 +307,114 @@ async def cancel_invoice(
         
         # Update status
         now = datetime.now(timezone.utc)
-        supabase.table("invoices").update({
+        update_data = {
             "status": InvoiceStatus.CANCELED.value,
             "updated_at": now.isoformat(),
             "canceled_at": now.isoformat()
-        }).eq("id", invoice_id).execute()
+        }
+        invoices.update(invoice_id, update_data)
+        note_write(merchant_email, invoice_id, invoice.get("invoice_id"))
+        hub.publish_invoice({**invoice, **update_data})
         
         return {"status": "success", "message": "Invoice canceled successfully"}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to cancel invoice: {str(e)}")
 
+def invoice_to_dict(data: dict) -> dict:
+    """InvoiceResponse-shaped dict built from a trusted database row, without model validation"""
+    return {
+        "id": data["id"],
+        "merchant_email": data["merchant_email"],
+        "customer_email": data["customer_email"],
+        "items": data["items"],
+        "subtotal": float(data["subtotal"]),
+        "tax_amount": float(data["tax_amount"]),
+        "total": float(data["total"]),
+        "total_usdc": float(data["total_usdc"]),
+        "status": data["status"],
+        "created_at": utc_timestamp(data["created_at"]),
+        "updated_at": utc_timestamp(data["updated_at"]),
+        "total_usdc_units": row_units(data, "total_usdc"),
+        "invoice_id": data.get("invoice_id"),
+        "qr_url": data.get("qr_url"),
+        "checkout_url": data.get("checkout_url"),
+        "tx_hash": data.get("tx_hash"),
+        "einvoice_number": data.get("einvoice_number"),
+        "einvoice_url": data.get("einvoice_url"),
+        "einvoice_status": data.get("einvoice_status") or None
+    }
+
+EXPORT_COLUMNS = [
+    "id", "invoice_id", "customer_email", "status", "subtotal", "tax_amount", "total",
+    "total_usdc", "total_usdc_units", "tx_hash", "einvoice_status", "einvoice_number",
+    "created_at", "issued_at", "paid_at", "canceled_at", "expired_at", "items"
+]
+EXPORT_PAGE_SIZE = 500
+
+def iter_invoice_pages(merchant_email: str, status: Optional[str], from_date: Optional[str], to_date: Optional[str]):
+    """Yield pages of invoices newest first using keyset pagination on (created_at, id)"""
+    invoices = get_repositories().invoices
+    last = None
+    while True:
+        rows = invoices.page(merchant_email, status, from_date, to_date, last, EXPORT_PAGE_SIZE)
+        if not rows:
+            return
+        yield rows
+        if len(rows) < EXPORT_PAGE_SIZE:
+            return
+        last = rows[-1]
+
+def export_csv(pages):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in pages:
+        for row in rows:
+            writer.writerow([
+                json.dumps(row.get("items")) if column == "items"
+                else row_units(row, "total_usdc") if column == "total_usdc_units"
+                else row.get(column)
+                for column in EXPORT_COLUMNS
+            ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def export_ndjson(pages):
+    for rows in pages:
+        lines = []
+        for row in rows:
+            record = {column: row.get(column) for column in EXPORT_COLUMNS}
+            record["total_usdc_units"] = row_units(row, "total_usdc")
+            lines.append(json.dumps(record))
+        yield "\n".join(lines) + "\n"
+
+@router.get("/invoices/export")
+async def export_invoices(
+    merchant_email: str = Depends(verify_token),
+    format: str = Query("csv", pattern="^(csv|ndjson)$", description="csv or ndjson"),
+    status: Optional[str] = Query(None, description="Filter by status"),
+    from_date: Optional[str] = Query(None, description="From date (YYYY-MM-DD)"),
+    to_date: Optional[str] = Query(None, description="To date (YYYY-MM-DD)")
+):
+    """Stream the merchant's full invoice history; memory use doesn't grow with history size"""
+    pages = iter_invoice_pages(merchant_email, status, from_date, to_date)
+    if format == "csv":
+        body, media_type = export_csv(pages), "text/csv"
+    else:
+        body, media_type = export_ndjson(pages), "application/x-ndjson"
+    filename = f"invoices-{datetime.now(timezone.utc).strftime('%Y%m%d')}.{format}"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @router.get("/invoices", response_model=List[InvoiceResponse])
 async def get_invoices(
+    request: Request,
     merchant_email: str = Depends(verify_token),
     status: Optional[str] = Query(None, description="Filter by status"),
     from_date: Optional[str] = Query(None, description="From date (YYYY-MM-DD)"),
@@ -208,48 +423,22 @@ async def get_invoices(
     offset: int = Query(0, description="Offset for pagination")
 ):
     """Get invoices list with filters"""
-    supabase = create_supabase_client()
+    invoices = get_read_repositories(merchant_email).invoices
     
     try:
-        query = supabase.table("invoices").select("*").eq("merchant_email", merchant_email)
-        
-        if status:
-            query = query.eq("status", status)
-        
-        if from_date:
-            query = query.gte("created_at", f"{from_date}T00:00:00Z")
+        # Every write bumps updated_at, so the filtered set's count and
+        # max(updated_at) change whenever any page of it could
+        version = invoices.version(merchant_email, status, from_date, to_date)
+        etag = make_etag("invoices", merchant_email, status, from_date, to_date, limit, offset, *version)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
         
-        if to_date:
-            query = query.lte("created_at", f"{to_date}T23:59:59Z")
+        rows = invoices.list(merchant_email, status, from_date, to_date, limit=limit, offset=offset)
         
-        query = query.order("created_at", desc=True).range(offset, offset + limit - 1)
-        
-        response = query.execute()
-        
-        invoices = []
-        for data in response.data:
-            invoices.append(InvoiceResponse(
-                id=data["id"],
-                merchant_email=data["merchant_email"],
-                customer_email=data["customer_email"],
-                items=data["items"],
-                subtotal=data["subtotal"],
-                tax_amount=data["tax_amount"],
-                total=data["total"],
-                total_usdc=data["total_usdc"],
-                status=InvoiceStatus(data["status"]),
-                created_at=datetime.fromisoformat(data["created_at"].replace('Z', '+00:00')),
-                updated_at=datetime.fromisoformat(data["updated_at"].replace('Z', '+00:00')),
-                invoice_id=data.get("invoice_id"),
-                qr_url=data.get("qr_url"),
-                checkout_url=data.get("checkout_url"),
-                tx_hash=data.get("tx_hash"),
-                einvoice_number=data.get("einvoice_number"),
-                einvoice_url=data.get("einvoice_url"),
-                einvoice_status=EInvoiceStatus(data["einvoice_status"]) if data.get("einvoice_status") else None
-            ))
-        
-        return invoices
+        # Rows map straight to the response shape; returning a Response skips
+        # FastAPI's second response_model validation pass
+        return FastJSONResponse([invoice_to_dict(data) for data in rows], headers=cache_headers(etag))
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get invoices: {str(e)}")
@@ -260,78 +449,104 @@ async def get_invoice_detail(
     merchant_email: str = Depends(verify_token)
 ):
     """Get invoice detail"""
-    supabase = create_supabase_client()
+    invoices = get_read_repositories(merchant_email, invoice_id).invoices
     
     try:
-        response = supabase.table("invoices").select("*").eq("id", invoice_id).eq("merchant_email", merchant_email).execute()
+        invoice = invoices.get(invoice_id, merchant_email)
         
-        if not response.data:
+        if invoice is None:
             raise HTTPException(status_code=404, detail="Invoice not found")
         
-        data = response.data[0]
-        
-        return InvoiceResponse(
-            id=data["id"],
-            merchant_email=data["merchant_email"],
-            customer_email=data["customer_email"],
-            items=data["items"],
-            subtotal=data["subtotal"],
-            tax_amount=data["tax_amount"],
-            total=data["total"],
-            total_usdc=data["total_usdc"],
-            status=InvoiceStatus(data["status"]),
-            created_at=datetime.fromisoformat(data["created_at"].replace('Z', '+00:00')),
-            updated_at=datetime.fromisoformat(data["updated_at"].replace('Z', '+00:00')),
-            invoice_id=data.get("invoice_id"),
-            qr_url=data.get("qr_url"),
-            checkout_url=data.get("checkout_url"),
-            tx_hash=data.get("tx_hash"),
-            einvoice_number=data.get("einvoice_number"),
-            einvoice_url=data.get("einvoice_url"),
-            einvoice_status=EInvoiceStatus(data["einvoice_status"]) if data.get("einvoice_status") else None
-        )
+        return FastJSONResponse(invoice_to_dict(invoice))
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get invoice: {str(e)}")
 
+def dashboard_metrics(invoices, merchant_email: str, from_date: Optional[str], to_date: Optional[str]) -> dict:
+    """Invoice counts by status and paid total for a date range"""
+    rows = invoices.list(merchant_email, from_date=from_date, to_date=to_date,
+                         columns="status,total_usdc,total_usdc_units", newest_first=False)
+    
+    # Calculate metrics
+    metrics = {
+        "issued": 0,
+        "paid": 0,
+        "canceled": 0,
+        "expired": 0
+    }
+    paid_units = 0
+    
+    for invoice in rows:
+        status = invoice["status"].lower()
+        if status in metrics:
+            metrics[status] += 1
+        
+        if status == "paid":
+            paid_units += row_units(invoice, "total_usdc")
+    
+    return DashboardMetrics(**metrics, total_usdc=from_units(paid_units), total_usdc_units=paid_units).dict()
+
 @router.get("/dashboard/metrics", response_model=DashboardMetrics)
 async def get_dashboard_metrics(
+    request: Request,
     merchant_email: str = Depends(verify_token),
     from_date: Optional[str] = Query(None, description="From date (YYYY-MM-DD)"),
     to_date: Optional[str] = Query(None, description="To date (YYYY-MM-DD)")
 ):
     """Get dashboard metrics"""
-    supabase = create_supabase_client()
+    invoices = get_read_repositories(merchant_email).invoices
+    # Concurrent loads of the same dashboard (several tabs, a team) share the queries
+    key = (merchant_email, from_date, to_date, invoices)
     
     try:
-        query = supabase.table("invoices").select("status,total_usdc").eq("merchant_email", merchant_email)
-        
-        if from_date:
-            query = query.gte("created_at", f"{from_date}T00:00:00Z")
-        
-        if to_date:
-            query = query.lte("created_at", f"{to_date}T23:59:59Z")
-        
-        response = query.execute()
+        version = await reads.run(
+            "invoices.version", key, lambda: invoices.version(merchant_email, from_date=from_date, to_date=to_date)
+        )
+        etag = make_etag("metrics", merchant_email, from_date, to_date, *version)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
         
-        # Calculate metrics
-        metrics = {
-            "issued": 0,
-            "paid": 0,
-            "canceled": 0,
-            "expired": 0,
-            "total_usdc": 0.0
-        }
+        metrics = await reads.run(
+            "dashboard.metrics", key + version, dashboard_metrics, invoices, merchant_email, from_date, to_date
+        )
+        return FastJSONResponse(metrics, headers=cache_headers(etag))
         
-        for invoice in response.data:
-            status = invoice["status"].lower()
-            if status in metrics:
-                metrics[status] += 1
-            
-            if status == "paid":
-                metrics["total_usdc"] += invoice["total_usdc"]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get metrics: {str(e)}")
+
+@router.get("/dashboard/analytics", response_model=DashboardAnalytics)
+async def get_dashboard_analytics(
+    request: Request,
+    merchant_email: str = Depends(verify_token),
+    interval: str = Query("day", description="Revenue period: day, week or month"),
+    utc_offset: int = Query(0, ge=-720, le=840, description="Merchant's UTC offset in minutes, for period and date boundaries"),
+    from_date: Optional[str] = Query(None, description="From date (YYYY-MM-DD)"),
+    to_date: Optional[str] = Query(None, description="To date (YYYY-MM-DD)"),
+    top: int = Query(10, ge=1, le=100, description="Number of top customers")
+):
+    """Revenue by period, average ticket, time-to-pay distribution and top customers"""
+    if interval not in INTERVALS:
+        raise HTTPException(status_code=400, detail=f"interval must be one of {', '.join(INTERVALS)}")
+    try:
+        start = date.fromisoformat(from_date) if from_date else None
+        end = date.fromisoformat(to_date) if to_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    invoices = get_read_repositories(merchant_email).invoices
+    
+    try:
+        # One query for the invoices changed since this worker's last look
+        snapshot = await asyncio.to_thread(refresh_snapshot, merchant_email, invoices)
+        etag = make_etag("analytics", merchant_email, interval, utc_offset, start, end, top, *snapshot.version)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
         
-        return DashboardMetrics(**metrics)
+        report = await asyncio.to_thread(snapshot.query, interval, utc_offset, start, end, top)
+        return FastJSONResponse(report, headers=cache_headers(etag))
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get metrics: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get analytics: {str(e)}")
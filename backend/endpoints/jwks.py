@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from utils.tokens import get_jwks
+
+router = APIRouter()
+
+@router.get("/.well-known/jwks.json")
+async def jwks():
+    """Public keys other services use to verify merchant tokens offline"""
+    return JSONResponse(
+        content=get_jwks(),
+        headers={"Cache-Control": "public, max-age=300"}
+    )
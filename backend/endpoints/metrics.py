@@ -0,0 +1,89 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from datetime import datetime, timezone
+from utils.einvoice_pipeline import pipeline
+from utils.events import hub
+from utils.jobs import queue_depth
+from utils.metrics import lru_cache_collector, registry
+from utils.settings import get_settings
+from utils.sri_client import CircuitBreaker, breaker_state
+from utils.tokens import get_jwks, get_keyring
+from utils.tracing import tracer
+from utils.xades import signer_cache_info
+import asyncio
+import secrets
+
+router = APIRouter()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Queue depths cost a few count queries; refresh them at most this often
+QUEUE_DEPTH_TTL_SECONDS = 10
+
+_queue_depths = {"at": None, "outbox": {}, "einvoice": {}}
+
+
+def refresh_queue_depths() -> None:
+    now = datetime.now(timezone.utc)
+    if _queue_depths["at"] and (now - _queue_depths["at"]).total_seconds() < QUEUE_DEPTH_TTL_SECONDS:
+        return
+    _queue_depths["at"] = now
+    _queue_depths["outbox"] = queue_depth()
+    _queue_depths["einvoice"] = pipeline.queue_metrics()
+
+
+@registry.shared_collector
+def queue_collector():
+    outbox, einvoice = _queue_depths["outbox"], _queue_depths["einvoice"]
+    yield ("outbox_jobs", "gauge", "Outbox jobs by status", ("status",),
+           [((status,), count) for status, count in outbox.items()])
+    yield ("einvoice_queue_depth", "gauge", "E-invoices waiting in each pipeline queue", ("queue",),
+           [((queue,), einvoice[queue]) for queue in ("pending", "submitted", "retry_due", "dead") if queue in einvoice])
+    yield ("einvoice_queue_lag_seconds", "gauge", "Age of the oldest e-invoice waiting in each phase", ("phase",),
+           [((phase,), einvoice[f"{phase}_lag_seconds"]) for phase in ("submission", "authorization")
+            if f"{phase}_lag_seconds" in einvoice])
+
+
+@registry.collector
+def process_collector():
+    stats = pipeline.stats
+    yield ("einvoice_pipeline_events_total", "counter", "E-invoice pipeline outcomes", ("event",),
+           [((event,), stats[event]) for event in
+            ("submitted", "returned", "authorized", "rejected", "deferred", "retried", "dead")])
+    yield ("einvoice_provider_requests_total", "counter", "Batched SRI requests made by the pipeline", ("phase",),
+           [(("submission",), stats["submit_requests"]), (("authorization",), stats["authorization_requests"])])
+    state = breaker_state()
+    yield ("sri_circuit_state", "gauge", "1 for the SRI circuit breaker's current state", ("state",),
+           [((name,), int(name == state)) for name in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)])
+    yield ("event_stream_subscribers", "gauge", "Open server-sent event subscriptions", (),
+           [((), hub.subscriber_count)])
+    yield ("trace_spans_total", "counter", "Finished trace spans by export result", ("result",),
+           [(("exported",), tracer.exported), (("dropped",), tracer.dropped)])
+
+
+registry.collector(lru_cache_collector({
+    "sri_signer": signer_cache_info,
+    "jwt_keyring": get_keyring.cache_info,
+    "jwks": get_jwks.cache_info,
+}))
+
+
+def verify_metrics_token(request: Request) -> None:
+    token = get_settings().metrics_token
+    if not token:
+        return
+    header = request.headers.get("authorization", "")
+    if not secrets.compare_digest(header.encode(), f"Bearer {token}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """Prometheus scrape endpoint"""
+    verify_metrics_token(request)
+    try:
+        await asyncio.to_thread(refresh_queue_depths)
+    except Exception as e:
+        # Keep serving in-process metrics when the database is unreachable
+        print(f"Failed to refresh queue depths: {e}")
+    # Every worker's values when serve.py runs several, whichever worker answers
+    return PlainTextResponse(await asyncio.to_thread(registry.render, get_settings().metrics_dir), media_type=CONTENT_TYPE)
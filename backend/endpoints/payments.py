@@ -4,55 +4,116 @@ from utils.models import (
     InvoiceStatus, InvoiceItem
 )
 from datetime import datetime, timezone, timedelta
-from supabase import create_client, Client
-from dotenv import load_dotenv
-import os
+from typing import Optional
+from utils.database import get_read_repositories, get_repositories, note_write
+from utils.einvoice_pipeline import pipeline
+from utils.events import hub
+from utils.jobs import job, outbox_job
+from utils.mailer import send_html_email
+from utils.money import from_units, row_units, to_units
+from utils.singleflight import reads
+import asyncio
+import html
 import json
 
 router = APIRouter()
-load_dotenv()
-
-def create_supabase_client():
-    url: str = os.getenv("DATABASE_URL")
-    key: str = os.getenv("DATABASE_APIKEY")
-    supabase: Client = create_client(url, key)
-    return supabase
 
 def get_merchant_name(merchant_email: str) -> str:
     """Get merchant company name"""
     try:
-        supabase = create_supabase_client()
-        response = supabase.table("company_info").select("name").eq("email", merchant_email).execute()
-        if response.data:
-            return response.data[0].get("name", "Unknown Merchant")
+        merchant = get_read_repositories().companies.get(merchant_email, "name")
+        if merchant:
+            return merchant.get("name", "Unknown Merchant")
         return "Unknown Merchant"
     except:
         return "Unknown Merchant"
 
+# Follow-up work queued in the same transaction as the PAID transition. The
+# e-invoice needs no job: PAID invoices with a PENDING e-invoice are the
+# e-invoice pipeline's queue.
+PAID_JOBS = ("receipt.email",)
+
+def mark_invoice_paid(invoice: dict, tx_hash: str, now: datetime, paid_units: Optional[int] = None, token: Optional[str] = None):
+    """ISSUED -> PAID plus outbox jobs in one transaction; None if it was no longer payable"""
+    # The checkout page and the merchant's dashboard read it back right away
+    note_write(invoice["id"], invoice.get("invoice_id"), invoice["merchant_email"])
+    return get_repositories().invoices.mark_paid(
+        invoice["id"],
+        tx_hash,
+        now.isoformat(),
+        paid_amount=from_units(paid_units) if paid_units is not None else None,
+        paid_amount_units=paid_units,
+        paid_token=token,
+        jobs=[outbox_job(topic, {"invoice_id": invoice["id"]}) for topic in PAID_JOBS]
+    )
+
+def create_receipt_html(invoice: dict, merchant_name: str) -> str:
+    # Item and merchant names are merchant input: escape them so they can't inject markup into customer mail
+    rows = "".join(
+        f"<tr><td>{html.escape(str(item['name']))}</td><td style='text-align: right;'>{html.escape(str(item['qty']))}</td>"
+        f"<td style='text-align: right;'>{item['unit_price']:.2f}</td></tr>"
+        for item in invoice["items"]
+    )
+    return f"""
+    <!DOCTYPE html>
+    <html>
+    <head><meta charset="UTF-8"><title>Recibo de pago</title></head>
+    <body style='font-family: Arial, sans-serif; background-color: #f4f4f4; margin: 0; padding: 20px;'>
+        <div style='max-width: 600px; margin: 0 auto; background: #ffffff; border-radius: 8px; padding: 30px;'>
+            <h2 style='color: #28a745;'>Pago recibido</h2>
+            <p>{html.escape(str(merchant_name))} confirmó tu pago de la factura <strong>{html.escape(str(invoice.get("invoice_id") or invoice["id"]))}</strong>.</p>
+            <table style='width: 100%; border-collapse: collapse;'>
+                <tr><th style='text-align: left;'>Producto</th><th style='text-align: right;'>Cant.</th><th style='text-align: right;'>Precio</th></tr>
+                {rows}
+            </table>
+            <p><strong>Total: {float(invoice["total_usdc"]):.2f} USDC</strong></p>
+            <p style='color: #6c757d; font-size: 12px;'>Transacción: {html.escape(str(invoice.get("tx_hash")))}</p>
+        </div>
+    </body>
+    </html>
+    """
+
+@job("receipt.email")
+async def receipt_email_job(payload: dict):
+    """Email the customer a payment receipt (outbox job)"""
+    invoices = get_repositories().invoices
+    
+    invoice = invoices.get(payload["invoice_id"])
+    if invoice is None:
+        return
+    
+    # At-least-once delivery: don't email twice
+    if invoice.get("receipt_sent_at") or invoice["status"] != InvoiceStatus.PAID.value:
+        return
+    
+    html_content = create_receipt_html(invoice, get_merchant_name(invoice["merchant_email"]))
+    await asyncio.to_thread(send_html_email, invoice["customer_email"], "Recibo de pago", html_content)
+    
+    invoices.update(invoice["id"], {
+        "receipt_sent_at": datetime.now(timezone.utc).isoformat()
+    })
+
 @router.get("/pay/{invoice_id}", response_model=PublicInvoiceResponse)
 async def get_public_invoice(invoice_id: str):
     """Public endpoint to get invoice details for payment"""
-    supabase = create_supabase_client()
-    
     try:
-        # Get invoice by invoice_id (not internal id)
-        response = supabase.table("invoices").select("*").eq("invoice_id", invoice_id).execute()
-        
-        if not response.data:
-            # Try with internal id as fallback
-            response = supabase.table("invoices").select("*").eq("id", invoice_id).execute()
+        # Get invoice by invoice_id (not internal id), falling back to the internal id;
+        # a shared checkout link's concurrent loads make one query
+        invoices = get_read_repositories(invoice_id).invoices
+        invoice = await reads.run("invoices.get_public", (invoice_id, "*", invoices), invoices.get_public, invoice_id)
             
-        if not response.data:
+        if invoice is None:
             raise HTTPException(status_code=404, detail="Invoice not found")
         
-        invoice = response.data[0]
-        
         # Check if invoice is in payable status
         if invoice["status"] not in [InvoiceStatus.ISSUED.value]:
             raise HTTPException(status_code=400, detail="Invoice is not available for payment")
         
         # Get merchant name
-        merchant_name = get_merchant_name(invoice["merchant_email"])
+        merchant_email = invoice["merchant_email"]
+        merchant_name = await reads.run(
+            "company_info.name", (merchant_email, get_read_repositories().companies), get_merchant_name, merchant_email
+        )
         
         # Convert items back to InvoiceItem objects
         items = [InvoiceItem(**item) for item in invoice["items"]]
@@ -67,7 +128,8 @@ async def get_public_invoice(invoice_id: str):
             total_usdc=invoice["total_usdc"],
             status=InvoiceStatus(invoice["status"]),
             qr_url=invoice.get("qr_url"),
-            checkout_url=invoice.get("checkout_url")
+            checkout_url=invoice.get("checkout_url"),
+            total_usdc_units=row_units(invoice, "total_usdc")
         )
         
     except HTTPException:
@@ -78,21 +140,13 @@ async def get_public_invoice(invoice_id: str):
 @router.post("/pay/{invoice_id}/confirm")
 async def confirm_payment(invoice_id: str, request: PaymentRequest):
     """Confirm payment with transaction hash (Account Abstraction flow)"""
-    supabase = create_supabase_client()
-    
     try:
-        # Get invoice
-        response = supabase.table("invoices").select("*").eq("invoice_id", invoice_id).execute()
-        
-        if not response.data:
-            # Try with internal id
-            response = supabase.table("invoices").select("*").eq("id", invoice_id).execute()
+        # Get invoice by number or internal id
+        invoice = get_repositories().invoices.get_public(invoice_id)
             
-        if not response.data:
+        if invoice is None:
             raise HTTPException(status_code=404, detail="Invoice not found")
         
-        invoice = response.data[0]
-        
         # Verify invoice is in ISSUED status
         if invoice["status"] != InvoiceStatus.ISSUED.value:
             raise HTTPException(status_code=400, detail="Invoice is not in ISSUED status")
@@ -105,16 +159,15 @@ async def confirm_payment(invoice_id: str, request: PaymentRequest):
         # Here you would implement blockchain verification logic
         # For now, we'll assume the transaction is valid
         
-        # Update invoice status
+        # Update invoice status and queue the follow-up jobs
         now = datetime.now(timezone.utc)
-        update_data = {
-            "status": InvoiceStatus.PAID.value,
-            "tx_hash": request.tx_hash,
-            "paid_at": now.isoformat(),
-            "updated_at": now.isoformat()
-        }
+        paid = mark_invoice_paid(invoice, request.tx_hash, now)
+        
+        if not paid:
+            raise HTTPException(status_code=400, detail="Invoice already paid")
         
-        supabase.table("invoices").update(update_data).eq("id", invoice["id"]).execute()
+        hub.publish_invoice(paid)
+        pipeline.wake()
         
         return {
             "status": "success",
@@ -130,21 +183,13 @@ async def confirm_payment(invoice_id: str, request: PaymentRequest):
 @router.post("/payments/webhook")
 async def payment_webhook(request: WebhookPaymentRequest):
     """Webhook to receive payment notifications from blockchain monitoring"""
-    supabase = create_supabase_client()
-    
     try:
-        # Get invoice
-        response = supabase.table("invoices").select("*").eq("invoice_id", request.invoice_id).execute()
-        
-        if not response.data:
-            # Try with internal id
-            response = supabase.table("invoices").select("*").eq("id", request.invoice_id).execute()
+        # Get invoice by number or internal id
+        invoice = get_repositories().invoices.get_public(request.invoice_id)
             
-        if not response.data:
+        if invoice is None:
             raise HTTPException(status_code=404, detail="Invoice not found")
         
-        invoice = response.data[0]
-        
         # Verify invoice is in ISSUED status
         if invoice["status"] != InvoiceStatus.ISSUED.value:
             return {"status": "ignored", "reason": "Invoice not in ISSUED status"}
@@ -153,14 +198,14 @@ async def payment_webhook(request: WebhookPaymentRequest):
         if invoice.get("tx_hash"):
             return {"status": "ignored", "reason": "Invoice already paid"}
         
-        # Validate payment amount (with tolerance)
-        expected_amount = invoice["total_usdc"]
-        tolerance = 0.01  # $0.01 tolerance
+        # Validate payment amount (exact match in USDC base units)
+        expected_units = row_units(invoice, "total_usdc")
+        received_units = request.amount_units if request.amount_units is not None else to_units(request.amount)
         
-        if abs(request.amount - expected_amount) > tolerance:
+        if received_units != expected_units:
             raise HTTPException(
                 status_code=400, 
-                detail=f"Payment amount mismatch. Expected: {expected_amount}, Received: {request.amount}"
+                detail=f"Payment amount mismatch. Expected: {from_units(expected_units)}, Received: {from_units(received_units)}"
             )
         
         # Validate token (should be USDC)
@@ -168,21 +213,17 @@ async def payment_webhook(request: WebhookPaymentRequest):
         if request.token not in expected_tokens:
             raise HTTPException(status_code=400, detail=f"Invalid token: {request.token}")
         
-        # Update invoice status
+        # Update invoice status; the e-invoice and receipt jobs are written
+        # in the same transaction and run on the job workers
         now = datetime.now(timezone.utc)
-        update_data = {
-            "status": InvoiceStatus.PAID.value,
-            "tx_hash": request.tx_hash,
-            "paid_amount": request.amount,
-            "paid_token": request.token,
-            "paid_at": now.isoformat(),
-            "updated_at": now.isoformat()
-        }
+        paid = mark_invoice_paid(invoice, request.tx_hash, now, received_units, request.token)
         
-        supabase.table("invoices").update(update_data).eq("id", invoice["id"]).execute()
+        if not paid:
+            # Lost a race with another notification for the same invoice
+            return {"status": "ignored", "reason": "Invoice already paid"}
         
-        # TODO: Trigger e-invoice generation here
-        # You could add a background task or queue job
+        hub.publish_invoice(paid)
+        pipeline.wake()
         
         return {
             "status": "success",
@@ -200,17 +241,17 @@ async def payment_webhook(request: WebhookPaymentRequest):
 @router.post("/payments/expire-invoices")
 async def expire_old_invoices():
     """Background task to expire invoices older than 24 hours"""
-    supabase = create_supabase_client()
+    invoices = get_repositories().invoices
     
     try:
         # Calculate 24 hours ago
         expiry_time = datetime.now(timezone.utc) - timedelta(hours=24)
         
         # Get ISSUED invoices older than 24 hours
-        response = supabase.table("invoices").select("id").eq("status", InvoiceStatus.ISSUED.value).lt("issued_at", expiry_time.isoformat()).execute()
+        expired = invoices.issued_before(expiry_time.isoformat())
         
-        if response.data:
-            invoice_ids = [invoice["id"] for invoice in response.data]
+        if expired:
+            invoice_ids = [invoice["id"] for invoice in expired]
             
             # Update to EXPIRED status
             now = datetime.now(timezone.utc)
@@ -221,8 +262,9 @@ async def expire_old_invoices():
             }
             
             # Update all expired invoices
-            for invoice_id in invoice_ids:
-                supabase.table("invoices").update(update_data).eq("id", invoice_id).execute()
+            for invoice in expired:
+                invoices.update(invoice["id"], update_data)
+                hub.publish_invoice({**invoice, **update_data})
             
             return {
                 "status": "success",
@@ -1,6 +1,7 @@
 from fastapi import APIRouter
+from utils.metrics import timed
+from utils.tracing import span
 from utils.models import QRRequest, QRResponse
-import qrcode
 import base64
 from io import BytesIO
 
@@ -14,10 +15,14 @@ async def generate_qr(payload: QRRequest):
     """
     uri = f"ethereum:{payload.to_address}?value={payload.amount}&gas={payload.gas_limit}"
 
+    # qrcode/PIL se importan aquí para no pagar su carga en el arranque
+    import qrcode
+
     # Generar QR en memoria
-    qr_img = qrcode.make(uri)
-    buf = BytesIO()
-    qr_img.save(buf, format="PNG")
+    with timed("qr.render"), span("qr.render"):
+        qr_img = qrcode.make(uri)
+        buf = BytesIO()
+        qr_img.save(buf, format="PNG")
     qr_b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
 
     return {"uri": uri, "qr_base64": qr_b64}
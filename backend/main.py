@@ -1,14 +1,116 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from io import BytesIO
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from endpoints.authentication import router as authentication_router
+from endpoints.authentication import get_fido_server, router as authentication_router
 from endpoints.qr_generator import router as qr_generator_router
 from endpoints.user_operation import router as user_operation_router
 from endpoints.invoices import router as invoices_router
 from endpoints.payments import router as payments_router
 from endpoints.einvoice import router as einvoice_router
-import uvicorn
+from endpoints.jwks import router as jwks_router
+from endpoints.events import router as events_router
+from endpoints.metrics import router as metrics_router
+from utils.archive import run_archiver
+from utils.compression import CompressionMiddleware
+from utils.database import ReadYourWritesMiddleware, get_read_repositories, get_repositories
+from utils.einvoice_documents import documents
+from utils.einvoice_pipeline import pipeline
+from utils.events import hub
+from utils.jobs import JobWorker
+from utils.metrics import MetricsMiddleware, publish_snapshots
+from utils.rate_limit import RateLimitMiddleware, close_rate_limit_store
+from utils.settings import Settings, get_settings, install_reload_handler
+from utils.sri_client import close_sri_client, get_sri_client
+from utils.tokens import get_jwks, get_keyring
+from utils.tracing import TracingMiddleware, configure_tracing, tracer
 
-app = FastAPI(title="Crypto Payments API", version="0.1.0")
+# Fail fast on missing or invalid configuration
+get_settings()
+
+
+def _open_connections() -> None:
+    # One round trip per database opens the pooled connection (and TLS session)
+    for repositories in {get_repositories(), get_read_repositories()}:
+        repositories.companies.get("warm-up@invalid", "email")
+
+
+def _render_qr() -> None:
+    import qrcode
+    qrcode.make("ethereum:0x0").save(BytesIO(), format="PNG")
+
+
+def warm_up(settings: Settings) -> None:
+    """Do the work a cold worker would put on its first requests: imports, keys, connections"""
+    steps = [
+        ("database connections", _open_connections),
+        ("JWT keys", lambda: (get_keyring(), get_jwks())),
+        ("FIDO2 server", get_fido_server),
+        ("QR renderer", _render_qr),
+        ("SRI client", get_sri_client),
+    ]
+    if settings.einvoice_poll_interval:
+        steps.append(("e-invoice signing workers", documents.warm_up))
+    started = time.perf_counter()
+    for name, step in steps:
+        try:
+            step()
+        except Exception as e:
+            # Not fatal: the step runs again on first use
+            print(f"Warm-up of {name} failed: {e}")
+    print(f"Warmed up in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    install_reload_handler(asyncio.get_running_loop())
+    settings = get_settings()
+    configure_tracing(settings)
+    # Before the server accepts connections (WARM_UP=1, set by serve.py)
+    if settings.warm_up:
+        await asyncio.to_thread(warm_up, settings)
+    # Pick up invoice changes made by other workers for open event streams
+    change_feed = None
+    if settings.events_poll_interval:
+        change_feed = asyncio.create_task(hub.run_change_feed(settings.events_poll_interval))
+    # Drain the outbox (receipt emails) in this process
+    job_worker = None
+    if settings.job_workers:
+        job_worker = JobWorker(settings.job_workers, settings.job_visibility_timeout).start()
+    # Submit e-invoices and poll their authorization
+    if settings.einvoice_poll_interval:
+        pipeline.start(settings.einvoice_poll_interval)
+    # Move old terminal invoices to the archive tier
+    archiver = None
+    if settings.invoice_archive_days and settings.invoice_archive_interval:
+        archiver = asyncio.create_task(run_archiver(settings.invoice_archive_days, settings.invoice_archive_interval))
+    # Share this worker's metrics with whichever worker answers /metrics
+    publisher = None
+    if settings.metrics_dir:
+        publisher = asyncio.create_task(publish_snapshots(settings.metrics_dir))
+    yield
+    # In-flight requests have finished; jobs and the e-invoice pass in progress get SHUTDOWN_TIMEOUT seconds
+    if archiver:
+        archiver.cancel()
+    timeout = get_settings().shutdown_timeout
+    draining = [pipeline.stop(timeout)]
+    if job_worker:
+        draining.append(job_worker.stop(timeout))
+    await asyncio.gather(*draining)
+    await close_sri_client()
+    await close_rate_limit_store()
+    documents.shutdown()
+    if change_feed:
+        change_feed.cancel()
+    if publisher:
+        # Its last snapshot includes the drained jobs and e-invoice pass
+        publisher.cancel()
+        await asyncio.gather(publisher, return_exceptions=True)
+    tracer.shutdown()
+
+app = FastAPI(title="Crypto Payments API", version="0.1.0", lifespan=lifespan)
 
 # Routers
 app.include_router(authentication_router, prefix="/api", tags=["Authentication"])
@@ -17,6 +119,9 @@ app.include_router(user_operation_router, prefix="/api", tags=["User Operations"
 app.include_router(invoices_router, prefix="/api", tags=["Invoices"])
 app.include_router(payments_router, prefix="/api", tags=["Payments"])
 app.include_router(einvoice_router, prefix="/api", tags=["E-Invoice"])
+app.include_router(events_router, prefix="/api", tags=["Events"])
+app.include_router(jwks_router, tags=["Authentication"])
+app.include_router(metrics_router, tags=["Monitoring"])
 
 
 @app.get("/")
@@ -24,6 +129,15 @@ async def root():
     return {"status": "ok", "message": "Crypto Payments API running"}
 
 
+# Reads follow a client's own writes to the primary while a read replica is configured
+app.add_middleware(ReadYourWritesMiddleware)
+
+# gzip/brotli for bodies over 1 KiB; event streams pass through untouched
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+# Token buckets per client IP, merchant or route; inside CORS so 429s carry its headers
+app.add_middleware(RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -32,8 +146,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so request timings include compression and CORS
+app.add_middleware(TracingMiddleware)
+app.add_middleware(MetricsMiddleware)
+
 
 if __name__ == "__main__":
+    # Development server; run serve.py in production
+    import uvicorn
+
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
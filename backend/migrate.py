@@ -0,0 +1,102 @@
+"""Apply the versioned SQL files in migrations/ to a Postgres database.
+
+Each file runs in its own transaction and is recorded in
+``schema_migrations`` with a checksum, so ``up`` only applies new files and
+``status`` warns when an applied file was edited afterwards. The files are
+idempotent, so a database migrated by hand in the Supabase SQL editor can be
+brought under the runner with a plain ``up``.
+
+Needs a direct Postgres connection (Supabase: Settings > Database >
+Connection string) and psycopg 3 (``pip install "psycopg[binary]"``).
+The SQLite backend migrates itself on connect.
+
+Run from the backend directory:
+    python migrate.py status --dsn postgresql://...
+    python migrate.py up                      # DSN from DATABASE_DSN
+"""
+import argparse
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+
+CREATE_TABLE = """
+create table if not exists schema_migrations (
+    version text primary key,
+    checksum text not null,
+    applied_at timestamptz not null default now()
+)
+"""
+
+
+def migration_files() -> list:
+    """(version, path) for every migrations/NNN_name.sql, in order"""
+    return [(path.stem, path) for path in sorted(MIGRATIONS_DIR.glob("[0-9][0-9][0-9]_*.sql"))]
+
+
+def checksum(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def applied_versions(conn) -> dict:
+    conn.execute(CREATE_TABLE)
+    return dict(conn.execute("select version, checksum from schema_migrations").fetchall())
+
+
+def status(conn) -> int:
+    applied = applied_versions(conn)
+    pending = 0
+    for version, path in migration_files():
+        if version not in applied:
+            pending += 1
+            print(f"  pending  {version}")
+        elif applied[version] != checksum(path):
+            print(f"  changed  {version}  (edited after it was applied; add a new migration instead)")
+        else:
+            print(f"  applied  {version}")
+    return pending
+
+
+def up(conn) -> int:
+    applied = applied_versions(conn)
+    count = 0
+    for version, path in migration_files():
+        if version in applied:
+            continue
+        print(f"Applying {version}")
+        with conn.transaction():
+            # No parameters, so the file may hold several statements
+            conn.execute(path.read_text(encoding="utf-8"))
+            conn.execute("insert into schema_migrations (version, checksum) values (%s, %s)",
+                         (version, checksum(path)))
+        count += 1
+    print(f"{count} migration(s) applied" if count else "Database is up to date")
+    return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("status", "up"))
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_DSN"), help="Postgres connection string (default: DATABASE_DSN)")
+    args = parser.parse_args()
+
+    if psycopg is None:
+        sys.exit('psycopg is not installed: pip install "psycopg[binary]"')
+    if not args.dsn:
+        sys.exit("Pass --dsn or set DATABASE_DSN")
+
+    with psycopg.connect(args.dsn, autocommit=True) as conn:
+        if args.command == "status":
+            sys.exit(1 if status(conn) else 0)
+        up(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+-- Base tables the API expects before 001. Databases created by hand in the
+-- Supabase dashboard already have them; every statement is a no-op there.
+
+create table if not exists company_info (
+    email text primary key,
+    name text,
+    country_alpha_3 text,
+    city text,
+    postal_code text,
+    address text,
+    tax_number text,
+    created_at timestamptz not null default now()
+);
+
+create table if not exists credentials (
+    id bigserial primary key,
+    email text not null,
+    credential_id text not null,
+    public_key text,
+    sign_count bigint not null default 0,
+    transports jsonb,
+    attestation_type text,
+    aaguid text,
+    created_at timestamptz not null default now()
+);
+
+create table if not exists invoices (
+    id uuid primary key default gen_random_uuid(),
+    invoice_id text,
+    merchant_email text not null,
+    customer_email text,
+    items jsonb not null default '[]'::jsonb,
+    subtotal numeric,
+    tax_amount numeric,
+    tax_rate numeric,
+    total numeric,
+    total_usdc numeric,
+    status text not null default 'DRAFT',
+    tx_hash text,
+    paid_amount numeric,
+    paid_token text,
+    qr_url text,
+    checkout_url text,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now(),
+    issued_at timestamptz,
+    paid_at timestamptz,
+    canceled_at timestamptz,
+    expired_at timestamptz,
+    einvoice_status text default 'PENDING',
+    einvoice_number text,
+    einvoice_url text,
+    einvoice_error text,
+    einvoice_sent_at timestamptz
+);
+
+-- Integer USDC base-unit amounts (6 decimals) next to the legacy numerics
+alter table invoices add column if not exists subtotal_units bigint;
+alter table invoices add column if not exists tax_amount_units bigint;
+alter table invoices add column if not exists total_units bigint;
+alter table invoices add column if not exists total_usdc_units bigint;
+alter table invoices add column if not exists paid_amount_units bigint;
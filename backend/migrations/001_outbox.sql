@@ -0,0 +1,94 @@
+-- Transactional outbox for post-payment side effects.
+-- Apply in the Supabase SQL editor (or psql) before deploying the job workers.
+
+create table if not exists outbox (
+    id bigserial primary key,
+    topic text not null,
+    payload jsonb not null default '{}'::jsonb,
+    status text not null default 'PENDING' check (status in ('PENDING', 'DONE', 'DEAD')),
+    attempts integer not null default 0,
+    max_attempts integer not null default 8,
+    available_at timestamptz not null default now(),
+    locked_until timestamptz,
+    locked_by text,
+    last_error text,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now()
+);
+
+-- Only claimable rows are indexed; DONE rows don't slow the claim query down
+create index if not exists outbox_pending_idx on outbox (available_at) where status = 'PENDING';
+
+alter table invoices add column if not exists receipt_sent_at timestamptz;
+
+-- ISSUED -> PAID and the follow-up jobs in one transaction. Returns the
+-- updated invoice, or null when it was no longer payable (already paid,
+-- canceled or expired), in which case no jobs are enqueued.
+create or replace function mark_invoice_paid(
+    p_invoice_id uuid,
+    p_tx_hash text,
+    p_paid_at timestamptz,
+    p_paid_amount numeric default null,
+    p_paid_amount_units bigint default null,
+    p_paid_token text default null,
+    p_jobs jsonb default '[]'::jsonb
+) returns jsonb
+language plpgsql
+as $$
+declare
+    paid invoices;
+begin
+    update invoices
+       set status = 'PAID',
+           tx_hash = p_tx_hash,
+           paid_at = p_paid_at,
+           paid_amount = coalesce(p_paid_amount, paid_amount),
+           paid_amount_units = coalesce(p_paid_amount_units, paid_amount_units),
+           paid_token = coalesce(p_paid_token, paid_token),
+           updated_at = p_paid_at
+     where id = p_invoice_id
+       and status = 'ISSUED'
+       and tx_hash is null
+    returning * into paid;
+
+    if not found then
+        return null;
+    end if;
+
+    insert into outbox (topic, payload)
+    select job ->> 'topic', coalesce(job -> 'payload', '{}'::jsonb)
+      from jsonb_array_elements(p_jobs) as job;
+
+    return to_jsonb(paid);
+end;
+$$;
+
+-- Lease up to p_limit due jobs to one worker. SKIP LOCKED lets any number of
+-- workers claim concurrently without blocking each other; a job whose lease
+-- expires (worker crashed) becomes claimable again.
+create or replace function claim_outbox_jobs(
+    p_worker text,
+    p_limit integer,
+    p_visibility_seconds integer
+) returns setof outbox
+language sql
+as $$
+    with due as (
+        select id
+          from outbox
+         where status = 'PENDING'
+           and available_at <= now()
+           and (locked_until is null or locked_until < now())
+         order by available_at
+         limit p_limit
+           for update skip locked
+    )
+    update outbox o
+       set locked_until = now() + make_interval(secs => p_visibility_seconds),
+           locked_by = p_worker,
+           attempts = o.attempts + 1,
+           updated_at = now()
+      from due
+     where o.id = due.id
+    returning o.*;
+$$;
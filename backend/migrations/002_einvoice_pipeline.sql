@@ -0,0 +1,73 @@
+-- Two-phase SRI e-invoice pipeline: submission (recepción) then
+-- authorization polling (autorización).
+
+alter table invoices add column if not exists einvoice_access_key text;
+alter table invoices add column if not exists einvoice_authorization text;
+alter table invoices add column if not exists einvoice_submitted_at timestamptz;
+alter table invoices add column if not exists einvoice_authorized_at timestamptz;
+alter table invoices add column if not exists einvoice_locked_until timestamptz;
+
+create unique index if not exists invoices_einvoice_access_key_idx
+    on invoices (einvoice_access_key) where einvoice_access_key is not null;
+
+-- Submission queue: paid invoices whose e-invoice hasn't been sent yet
+create index if not exists invoices_einvoice_pending_idx
+    on invoices (paid_at) where status = 'PAID' and einvoice_status = 'PENDING';
+
+-- Authorization queue: submitted documents, next check due at einvoice_locked_until
+create index if not exists invoices_einvoice_submitted_idx
+    on invoices (einvoice_locked_until) where einvoice_status = 'SUBMITTED';
+
+-- Lease up to p_limit paid invoices in e-invoice state p_status. The lease
+-- (einvoice_locked_until) keeps other workers off them for p_lease_seconds;
+-- for SUBMITTED rows it doubles as the next authorization check time.
+create or replace function claim_einvoices(
+    p_status text,
+    p_limit integer,
+    p_lease_seconds integer
+) returns setof invoices
+language sql
+as $$
+    with due as (
+        select id
+          from invoices
+         where status = 'PAID'
+           and einvoice_status = p_status
+           and (einvoice_locked_until is null or einvoice_locked_until < now())
+         order by coalesce(einvoice_submitted_at, paid_at)
+         limit p_limit
+           for update skip locked
+    )
+    update invoices i
+       set einvoice_locked_until = now() + make_interval(secs => p_lease_seconds)
+      from due
+     where i.id = due.id
+    returning i.*;
+$$;
+
+-- Apply many e-invoice state changes in one statement. Each element of
+-- p_rows has an "id" plus only the columns to change.
+create or replace function update_einvoices(p_rows jsonb) returns integer
+language plpgsql
+as $$
+declare
+    changed integer;
+begin
+    update invoices i
+       set einvoice_status = case when r ? 'einvoice_status' then r ->> 'einvoice_status' else i.einvoice_status end,
+           einvoice_access_key = case when r ? 'einvoice_access_key' then r ->> 'einvoice_access_key' else i.einvoice_access_key end,
+           einvoice_number = case when r ? 'einvoice_number' then r ->> 'einvoice_number' else i.einvoice_number end,
+           einvoice_url = case when r ? 'einvoice_url' then r ->> 'einvoice_url' else i.einvoice_url end,
+           einvoice_authorization = case when r ? 'einvoice_authorization' then r ->> 'einvoice_authorization' else i.einvoice_authorization end,
+           einvoice_error = case when r ? 'einvoice_error' then r ->> 'einvoice_error' else i.einvoice_error end,
+           einvoice_submitted_at = case when r ? 'einvoice_submitted_at' then (r ->> 'einvoice_submitted_at')::timestamptz else i.einvoice_submitted_at end,
+           einvoice_authorized_at = case when r ? 'einvoice_authorized_at' then (r ->> 'einvoice_authorized_at')::timestamptz else i.einvoice_authorized_at end,
+           einvoice_sent_at = case when r ? 'einvoice_sent_at' then (r ->> 'einvoice_sent_at')::timestamptz else i.einvoice_sent_at end,
+           einvoice_locked_until = case when r ? 'einvoice_locked_until' then (r ->> 'einvoice_locked_until')::timestamptz else i.einvoice_locked_until end,
+           updated_at = case when r ? 'updated_at' then (r ->> 'updated_at')::timestamptz else i.updated_at end
+      from jsonb_array_elements(p_rows) as r
+     where i.id = (r ->> 'id')::uuid;
+    get diagnostics changed = row_count;
+    return changed;
+end;
+$$;
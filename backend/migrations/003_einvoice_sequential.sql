@@ -0,0 +1,5 @@
+-- Comprobante sequential (secuencial) used in the SRI access key. An
+-- identity column numbers existing rows on creation and new rows on insert,
+-- so the number never changes between resubmissions of the same invoice.
+
+alter table invoices add column if not exists einvoice_sequential bigint generated by default as identity;
@@ -0,0 +1,69 @@
+-- Automatic retries of FAILED e-invoices with exponential backoff.
+-- einvoice_attempts counts failed attempts; after EINVOICE_MAX_ATTEMPTS the
+-- e-invoice is dead-lettered (einvoice_status = 'DEAD') and only a manual
+-- retry sends it again.
+
+alter table invoices add column if not exists einvoice_attempts integer not null default 0;
+alter table invoices add column if not exists einvoice_next_attempt_at timestamptz;
+
+-- Retry queue: failed e-invoices by when they are next due
+create index if not exists invoices_einvoice_retry_idx
+    on invoices (einvoice_next_attempt_at) where status = 'PAID' and einvoice_status = 'FAILED';
+
+-- Lease up to p_limit FAILED e-invoices whose next attempt is due
+create or replace function claim_due_einvoices(
+    p_limit integer,
+    p_lease_seconds integer
+) returns setof invoices
+language sql
+as $$
+    with due as (
+        select id
+          from invoices
+         where status = 'PAID'
+           and einvoice_status = 'FAILED'
+           and einvoice_next_attempt_at <= now()
+           and (einvoice_locked_until is null or einvoice_locked_until < now())
+         order by einvoice_next_attempt_at
+         limit p_limit
+           for update skip locked
+    )
+    update invoices i
+       set einvoice_locked_until = now() + make_interval(secs => p_lease_seconds)
+      from due
+     where i.id = due.id
+    returning i.*;
+$$;
+
+-- Same as in 002, plus the retry columns
+create or replace function update_einvoices(p_rows jsonb) returns integer
+language plpgsql
+as $$
+declare
+    changed integer;
+begin
+    update invoices i
+       set einvoice_status = case when r ? 'einvoice_status' then r ->> 'einvoice_status' else i.einvoice_status end,
+           einvoice_access_key = case when r ? 'einvoice_access_key' then r ->> 'einvoice_access_key' else i.einvoice_access_key end,
+           einvoice_number = case when r ? 'einvoice_number' then r ->> 'einvoice_number' else i.einvoice_number end,
+           einvoice_url = case when r ? 'einvoice_url' then r ->> 'einvoice_url' else i.einvoice_url end,
+           einvoice_authorization = case when r ? 'einvoice_authorization' then r ->> 'einvoice_authorization' else i.einvoice_authorization end,
+           einvoice_error = case when r ? 'einvoice_error' then r ->> 'einvoice_error' else i.einvoice_error end,
+           einvoice_submitted_at = case when r ? 'einvoice_submitted_at' then (r ->> 'einvoice_submitted_at')::timestamptz else i.einvoice_submitted_at end,
+           einvoice_authorized_at = case when r ? 'einvoice_authorized_at' then (r ->> 'einvoice_authorized_at')::timestamptz else i.einvoice_authorized_at end,
+           einvoice_sent_at = case when r ? 'einvoice_sent_at' then (r ->> 'einvoice_sent_at')::timestamptz else i.einvoice_sent_at end,
+           einvoice_locked_until = case when r ? 'einvoice_locked_until' then (r ->> 'einvoice_locked_until')::timestamptz else i.einvoice_locked_until end,
+           einvoice_attempts = case when r ? 'einvoice_attempts' then (r ->> 'einvoice_attempts')::integer else i.einvoice_attempts end,
+           einvoice_next_attempt_at = case when r ? 'einvoice_next_attempt_at' then (r ->> 'einvoice_next_attempt_at')::timestamptz else i.einvoice_next_attempt_at end,
+           updated_at = case when r ? 'updated_at' then (r ->> 'updated_at')::timestamptz else i.updated_at end
+      from jsonb_array_elements(p_rows) as r
+     where i.id = (r ->> 'id')::uuid;
+    get diagnostics changed = row_count;
+    return changed;
+end;
+$$;
+
+-- E-invoices that failed before this migration are due now
+update invoices
+   set einvoice_next_attempt_at = now()
+ where einvoice_status = 'FAILED' and einvoice_next_attempt_at is null;
@@ -0,0 +1,29 @@
+-- Indexes for the invoice queries the API issues. Check a database with
+-- `python benchmarks/query_plans.py --dsn ...`, which EXPLAINs every query
+-- shape and flags sequential scans.
+
+-- Checkout page, payment webhook and status stream lookups by invoice number
+create index if not exists invoices_invoice_id_idx on invoices (invoice_id);
+
+-- Merchant lists, exports (keyset on created_at, id) and dashboard totals
+create index if not exists invoices_merchant_created_idx
+    on invoices (merchant_email, created_at desc, id desc);
+
+-- Status-filtered merchant lists and their ETag probes
+create index if not exists invoices_merchant_status_created_idx
+    on invoices (merchant_email, status, created_at desc);
+
+-- Expiry sweep: only ISSUED invoices are candidates
+create index if not exists invoices_issued_expiry_idx
+    on invoices (issued_at) where status = 'ISSUED';
+
+-- Event stream change feed
+create index if not exists invoices_updated_at_idx on invoices (updated_at);
+
+-- Dead-lettered e-invoices and jobs, counted on every /metrics refresh
+create index if not exists invoices_einvoice_dead_idx
+    on invoices (updated_at) where einvoice_status = 'DEAD';
+create index if not exists outbox_dead_idx on outbox (updated_at) where status = 'DEAD';
+
+-- Passkey lookups at login
+create index if not exists credentials_email_idx on credentials (email);
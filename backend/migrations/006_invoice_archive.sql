@@ -0,0 +1,56 @@
+-- Cold tier for terminal invoices. CANCELED, EXPIRED and fully e-invoiced
+-- PAID invoices move to invoices_archive once they haven't changed for
+-- INVOICE_ARCHIVE_DAYS, so the indexes behind the ISSUED and e-invoice
+-- queries only cover live rows. Merchant-facing reads (detail, lists, ETags,
+-- exports) go through the invoices_all view, which covers both tiers.
+
+-- Same columns in the same order as invoices (no identity: archived rows keep
+-- their einvoice_sequential). A migration adding an invoice column adds it
+-- here too and recreates invoices_all.
+create table if not exists invoices_archive (like invoices including defaults including constraints);
+
+create unique index if not exists invoices_archive_id_idx on invoices_archive (id);
+create index if not exists invoices_archive_invoice_id_idx on invoices_archive (invoice_id);
+create index if not exists invoices_archive_merchant_created_idx
+    on invoices_archive (merchant_email, created_at desc, id desc);
+create index if not exists invoices_archive_merchant_status_created_idx
+    on invoices_archive (merchant_email, status, created_at desc);
+
+create or replace view invoices_all as
+    select * from invoices
+    union all
+    select * from invoices_archive;
+
+-- Move up to p_limit archivable invoices last updated before p_before, in one
+-- transaction; rows locked by a payment or the e-invoice pipeline are skipped.
+-- Columns are matched by name, not position.
+create or replace function archive_invoices(
+    p_before timestamptz,
+    p_limit integer
+) returns integer
+language plpgsql
+as $$
+declare
+    moved integer;
+begin
+    with batch as (
+        select id
+          from invoices
+         where updated_at < p_before
+           and (status in ('CANCELED', 'EXPIRED') or (status = 'PAID' and einvoice_status = 'SENT'))
+         order by updated_at
+         limit p_limit
+           for update skip locked
+    ), deleted as (
+        delete from invoices i
+         using batch
+         where i.id = batch.id
+        returning i.*
+    )
+    insert into invoices_archive
+    select (jsonb_populate_record(null::invoices_archive, to_jsonb(d))).*
+      from deleted d;
+    get diagnostics moved = row_count;
+    return moved;
+end;
+$$;
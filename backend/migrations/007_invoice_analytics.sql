@@ -0,0 +1,4 @@
+-- Dashboard analytics keep a per-merchant snapshot and fetch only the
+-- merchant's invoices updated since its cursor on each request.
+create index if not exists invoices_merchant_updated_idx on invoices (merchant_email, updated_at);
+create index if not exists invoices_archive_merchant_updated_idx on invoices_archive (merchant_email, updated_at);
@@ -0,0 +1,8 @@
+-- Passkey registration and login state between the begin and finish
+-- requests, which may reach different worker processes. One row per email;
+-- a new ceremony replaces it, so the table stays one row per merchant.
+create table if not exists webauthn_challenges (
+    email text primary key,
+    state jsonb not null,
+    expires_at timestamptz not null
+);
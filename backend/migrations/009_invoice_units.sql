@@ -0,0 +1,25 @@
+-- Integer USDC base-unit amounts (6 decimals), written by invoice creation
+-- and matched by the payment webhook. Databases created by 000 already have
+-- them; this brings a hand-managed database (with 006 applied) up to date on
+-- its own, e.g. pasted into the Supabase SQL editor before deploying the
+-- unit-based code.
+alter table invoices add column if not exists subtotal_units bigint;
+alter table invoices add column if not exists tax_amount_units bigint;
+alter table invoices add column if not exists total_units bigint;
+alter table invoices add column if not exists total_usdc_units bigint;
+alter table invoices add column if not exists paid_amount_units bigint;
+
+-- The archive mirrors invoices column for column (see 006), in the same order
+alter table invoices_archive add column if not exists subtotal_units bigint;
+alter table invoices_archive add column if not exists tax_amount_units bigint;
+alter table invoices_archive add column if not exists total_units bigint;
+alter table invoices_archive add column if not exists total_usdc_units bigint;
+alter table invoices_archive add column if not exists paid_amount_units bigint;
+
+-- A view's column list is fixed when it is created, so invoices_all has to be
+-- rebuilt to pick up the new columns
+drop view if exists invoices_all;
+create view invoices_all as
+    select * from invoices
+    union all
+    select * from invoices_archive;
@@ -0,0 +1,21 @@
+-- Lease a single invoice's e-invoice for a manual send or retry, on the same
+-- lease (einvoice_locked_until) as claim_einvoices, so a merchant's request
+-- and a pipeline pass never submit the same comprobante together. Returns
+-- no row when the invoice is not in one of p_statuses or a worker holds it.
+create or replace function claim_einvoice(
+    p_id uuid,
+    p_merchant_email text,
+    p_statuses text[],
+    p_lease_seconds integer
+) returns setof invoices
+language sql
+as $$
+    update invoices
+       set einvoice_locked_until = now() + make_interval(secs => p_lease_seconds)
+     where id = p_id
+       and merchant_email = p_merchant_email
+       and status = 'PAID'
+       and einvoice_status = any(p_statuses)
+       and (einvoice_locked_until is null or einvoice_locked_until < now())
+    returning *;
+$$;
@@ -0,0 +1,24 @@
+-- Bulk emit: move many DRAFT invoices to ISSUED in one statement. Each
+-- element of p_rows is an id plus its issue fields; an invoice that is no
+-- longer DRAFT (emitted or canceled by a concurrent request) is left alone,
+-- so invoice numbers already handed out are never rewritten. Returns the
+-- ids that were issued.
+create or replace function issue_invoices(
+    p_merchant_email text,
+    p_rows jsonb
+) returns table (id uuid)
+language sql
+as $$
+    update invoices i
+       set status = r ->> 'status',
+           invoice_id = r ->> 'invoice_id',
+           qr_url = r ->> 'qr_url',
+           checkout_url = r ->> 'checkout_url',
+           issued_at = (r ->> 'issued_at')::timestamptz,
+           updated_at = (r ->> 'updated_at')::timestamptz
+      from jsonb_array_elements(p_rows) as r
+     where i.id = (r ->> 'id')::uuid
+       and i.merchant_email = p_merchant_email
+       and i.status = 'DRAFT'
+    returning i.id;
+$$;
@@ -0,0 +1,189 @@
+"""Data access for invoices, merchants (company_info), passkeys, passkey challenges and outbox jobs.
+
+Endpoints and background workers go through these repositories instead of
+building queries inline, so every query lives in one place per backend:
+
+  * ``supabase``: the hosted Supabase/PostgREST database (the default); the
+    transactional steps run as the RPCs in migrations/
+  * ``sqlite``: a local file (``DATABASE_PATH``) with the same tables and
+    indexes, for development, tests and benchmarks without the hosted service
+
+Select with ``DATABASE_BACKEND``; ``get_repositories()`` in utils.database
+returns the shared instance for the current settings, and
+``get_read_repositories()`` the read replica's, when one is configured.
+Rows are plain dicts with the same keys and ISO-8601 timestamps on both
+backends. Old terminal invoices move to ``invoices_archive`` (see
+utils.archive); the merchant-facing reads (get, list, page, version) cover
+both tiers through the ``invoices_all`` view.
+"""
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Columns the change feed and status streams need
+STATUS_COLUMNS = "id,invoice_id,merchant_email,status,tx_hash,updated_at"
+
+
+class InvoiceRepository(ABC):
+    @abstractmethod
+    def get(self, id: str, merchant_email: Optional[str] = None, columns: str = "*") -> Optional[dict]:
+        """Invoice by internal id, optionally scoped to its merchant; archived ones included"""
+
+    @abstractmethod
+    def get_public(self, invoice_id: str, columns: str = "*") -> Optional[dict]:
+        """Invoice by public number (INV-...), falling back to the internal id"""
+
+    @abstractmethod
+    def find_many(self, ids: List[str], merchant_email: str) -> List[dict]:
+        """The merchant's invoices among ``ids``"""
+
+    @abstractmethod
+    def insert(self, row: dict) -> None:
+        pass
+
+    @abstractmethod
+    def insert_many(self, rows: List[dict]) -> None:
+        """Insert all rows in one statement; none are written if any fails"""
+
+    @abstractmethod
+    def issue_many(self, merchant_email: str, changes: List[dict]) -> List[str]:
+        """Apply each change (issue fields plus ``id``) to the merchant's invoice if it is still DRAFT, in one
+        statement; the ids that changed"""
+
+    @abstractmethod
+    def update(self, id: str, changes: dict) -> None:
+        pass
+
+    @abstractmethod
+    def list(self, merchant_email: str, status: Optional[str] = None, from_date: Optional[str] = None,
+             to_date: Optional[str] = None, columns: str = "*", limit: Optional[int] = None,
+             offset: int = 0, newest_first: bool = True) -> List[dict]:
+        """The merchant's invoices in both tiers (unordered unless ``newest_first``); dates (YYYY-MM-DD) bound created_at inclusively"""
+
+    @abstractmethod
+    def page(self, merchant_email: str, status: Optional[str], from_date: Optional[str], to_date: Optional[str],
+             after: Optional[dict], limit: int) -> List[dict]:
+        """Keyset page over both tiers newest first: rows strictly after ``after``'s (created_at, id)"""
+
+    @abstractmethod
+    def version(self, merchant_email: str, status: Optional[str] = None, from_date: Optional[str] = None,
+                to_date: Optional[str] = None) -> Tuple[int, Optional[str]]:
+        """(row count, max updated_at) of a filtered list, for ETags"""
+
+    @abstractmethod
+    def list_changed(self, merchant_email: str, since: Optional[str], columns: str = "*") -> List[dict]:
+        """The merchant's invoices in both tiers updated after ``since`` (all of them when None)"""
+
+    @abstractmethod
+    def issued_before(self, cutoff: str) -> List[dict]:
+        """ISSUED invoices (id, invoice_id, merchant_email) issued before ``cutoff``"""
+
+    @abstractmethod
+    def changed_since(self, cursor: str, limit: int) -> List[dict]:
+        """Status columns of invoices whose updated_at is after ``cursor``, oldest first"""
+
+    @abstractmethod
+    def archive(self, before: str, limit: int) -> int:
+        """Move up to ``limit`` terminal invoices last updated before ``before`` to invoices_archive; returns how many"""
+
+    @abstractmethod
+    def mark_paid(self, id: str, tx_hash: str, paid_at: str, paid_amount: Optional[float] = None,
+                  paid_amount_units: Optional[int] = None, paid_token: Optional[str] = None,
+                  jobs: Iterable[dict] = ()) -> Optional[dict]:
+        """ISSUED -> PAID plus outbox jobs in one transaction; None if it was no longer payable"""
+
+    @abstractmethod
+    def claim_einvoices(self, einvoice_status: str, limit: int, lease_seconds: int) -> List[dict]:
+        """Lease paid invoices in e-invoice state ``einvoice_status`` (see claim_einvoices in migrations/)"""
+
+    @abstractmethod
+    def claim_due_einvoices(self, limit: int, lease_seconds: int) -> List[dict]:
+        """Lease FAILED e-invoices whose next attempt is due"""
+
+    @abstractmethod
+    def claim_einvoice(self, id: str, merchant_email: str, einvoice_statuses: Iterable[str],
+                       lease_seconds: int) -> Optional[dict]:
+        """Lease one paid invoice in one of ``einvoice_statuses``, on the pipeline's lease; None if a worker holds it"""
+
+    @abstractmethod
+    def update_einvoices(self, rows: List[dict]) -> None:
+        """Apply many e-invoice changes, each an "id" plus the columns to change"""
+
+    @abstractmethod
+    def einvoice_queues(self, now: str) -> dict:
+        """Pipeline queue sizes plus the oldest paid_at / einvoice_submitted_at waiting"""
+
+
+class CompanyRepository(ABC):
+    @abstractmethod
+    def get(self, email: str, columns: str = "*") -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    def find_many(self, emails: Iterable[str]) -> Dict[str, dict]:
+        """Merchants by email"""
+
+    @abstractmethod
+    def insert(self, row: dict) -> None:
+        pass
+
+    def exists(self, email: str) -> bool:
+        return self.get(email, "email") is not None
+
+
+class CredentialRepository(ABC):
+    @abstractmethod
+    def list_for(self, email: str) -> List[dict]:
+        """Passkeys registered by ``email``"""
+
+    @abstractmethod
+    def exists(self, email: str) -> bool:
+        pass
+
+    @abstractmethod
+    def insert(self, row: dict) -> None:
+        pass
+
+
+class ChallengeRepository(ABC):
+    """WebAuthn ceremony state between begin and finish, kept in the database
+    because the two requests may reach different worker processes"""
+
+    @abstractmethod
+    def put(self, email: str, state: dict, ttl_seconds: int) -> None:
+        """Store ``state`` for ``email``, replacing any earlier challenge"""
+
+    @abstractmethod
+    def get(self, email: str) -> Optional[dict]:
+        """The unexpired state for ``email``"""
+
+    @abstractmethod
+    def delete(self, email: str) -> None:
+        pass
+
+
+class OutboxRepository(ABC):
+    @abstractmethod
+    def enqueue(self, topic: str, payload: dict, available_at: Optional[str] = None) -> dict:
+        pass
+
+    @abstractmethod
+    def depth(self) -> dict:
+        """Counts of PENDING and DEAD jobs"""
+
+    @abstractmethod
+    def claim(self, worker: str, limit: int, visibility_seconds: int) -> List[dict]:
+        """Lease due jobs to ``worker`` (see claim_outbox_jobs in migrations/001_outbox.sql)"""
+
+    @abstractmethod
+    def update_leased(self, id: int, worker: str, changes: dict) -> None:
+        """Update a job only while ``worker`` still holds its lease"""
+
+
+@dataclass(frozen=True)
+class Repositories:
+    invoices: InvoiceRepository
+    companies: CompanyRepository
+    credentials: CredentialRepository
+    challenges: ChallengeRepository
+    outbox: OutboxRepository
@@ -0,0 +1,697 @@
+"""Repositories on a local SQLite file (DATABASE_BACKEND=sqlite).
+
+Runs the API without the hosted database: the tables are created on first
+use, with the indexes the hot queries need, and the transactional steps the
+Supabase backend runs as RPCs (mark_invoice_paid, the e-invoice and outbox
+claims) are single transactions here. One connection per process is shared
+by the request handlers and the worker threads behind a lock; writers take
+the database lock up front (BEGIN IMMEDIATE), so several worker processes
+can share one file.
+
+The schema is versioned like migrations/: ``MIGRATIONS`` are applied in
+order on connect and the count is kept in ``PRAGMA user_version``. JSON
+columns (items, payload, transports) are stored as text and decoded on
+read. Timestamps are stored in one fixed-width UTC form
+(``2025-08-30T12:00:00.000000+00:00``) so they compare correctly as text.
+"""
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from repositories.base import (
+    STATUS_COLUMNS, ChallengeRepository, CompanyRepository, CredentialRepository, InvoiceRepository, OutboxRepository, Repositories
+)
+from utils.metrics import db_duration, db_requests
+from utils.models import EInvoiceStatus, InvoiceStatus
+from utils.tracing import current_traceparent, span
+
+# Schema versions, oldest first; append, never edit an applied one. Each is
+# idempotent, so processes starting at the same time can't conflict.
+MIGRATIONS = ("""
+create table if not exists invoices (
+    id text primary key,
+    invoice_id text,
+    merchant_email text not null,
+    customer_email text,
+    items text not null default '[]',
+    subtotal real,
+    tax_amount real,
+    tax_rate real,
+    total real,
+    total_usdc real,
+    subtotal_units integer,
+    tax_amount_units integer,
+    total_units integer,
+    total_usdc_units integer,
+    status text not null,
+    tx_hash text,
+    paid_amount real,
+    paid_amount_units integer,
+    paid_token text,
+    qr_url text,
+    checkout_url text,
+    created_at text not null,
+    updated_at text not null,
+    issued_at text,
+    paid_at text,
+    canceled_at text,
+    expired_at text,
+    receipt_sent_at text,
+    einvoice_status text,
+    einvoice_number text,
+    einvoice_url text,
+    einvoice_error text,
+    einvoice_sent_at text,
+    einvoice_access_key text,
+    einvoice_authorization text,
+    einvoice_submitted_at text,
+    einvoice_authorized_at text,
+    einvoice_locked_until text,
+    einvoice_sequential integer,
+    einvoice_attempts integer not null default 0,
+    einvoice_next_attempt_at text
+);
+
+-- Public checkout lookups by invoice number
+create index if not exists invoices_invoice_id_idx on invoices (invoice_id);
+-- Merchant lists, dashboards and exports, newest first; id breaks
+-- created_at ties for the export's keyset pages
+create index if not exists invoices_merchant_created_idx on invoices (merchant_email, created_at, id);
+-- Expiry sweep over ISSUED invoices
+create index if not exists invoices_status_issued_idx on invoices (status, issued_at);
+-- Event stream change feed
+create index if not exists invoices_updated_at_idx on invoices (updated_at);
+-- E-invoice pipeline queues, as in migrations/002 and 004
+create unique index if not exists invoices_einvoice_access_key_idx
+    on invoices (einvoice_access_key) where einvoice_access_key is not null;
+create index if not exists invoices_einvoice_pending_idx
+    on invoices (paid_at) where status = 'PAID' and einvoice_status = 'PENDING';
+create index if not exists invoices_einvoice_submitted_idx
+    on invoices (einvoice_locked_until) where einvoice_status = 'SUBMITTED';
+create index if not exists invoices_einvoice_retry_idx
+    on invoices (einvoice_next_attempt_at) where status = 'PAID' and einvoice_status = 'FAILED';
+
+-- Number new invoices like the identity column in migrations/003
+create trigger if not exists invoices_einvoice_sequential after insert on invoices
+when new.einvoice_sequential is null
+begin
+    update invoices set einvoice_sequential = new.rowid where rowid = new.rowid;
+end;
+
+create table if not exists company_info (
+    email text primary key,
+    name text,
+    country_alpha_3 text,
+    city text,
+    postal_code text,
+    address text,
+    tax_number text,
+    created_at text
+);
+
+create table if not exists credentials (
+    id integer primary key autoincrement,
+    email text not null,
+    credential_id text not null,
+    public_key text,
+    sign_count integer not null default 0,
+    transports text,
+    attestation_type text,
+    aaguid text,
+    created_at text
+);
+
+create index if not exists credentials_email_idx on credentials (email);
+
+create table if not exists outbox (
+    id integer primary key autoincrement,
+    topic text not null,
+    payload text not null default '{}',
+    status text not null default 'PENDING' check (status in ('PENDING', 'DONE', 'DEAD')),
+    attempts integer not null default 0,
+    max_attempts integer not null default 8,
+    available_at text not null,
+    locked_until text,
+    locked_by text,
+    last_error text,
+    created_at text not null,
+    updated_at text not null
+);
+
+create index if not exists outbox_pending_idx on outbox (available_at) where status = 'PENDING';
+""", """
+-- Status-filtered merchant lists and their ETag probes
+create index if not exists invoices_merchant_status_created_idx on invoices (merchant_email, status, created_at);
+-- Dead-lettered e-invoices and jobs, counted on every /metrics refresh
+create index if not exists invoices_einvoice_dead_idx on invoices (updated_at) where einvoice_status = 'DEAD';
+create index if not exists outbox_dead_idx on outbox (updated_at) where status = 'DEAD';
+""", """
+-- Cold tier for old terminal invoices, as in migrations/006. Same columns in
+-- the same order as invoices: a migration adding an invoice column adds it
+-- here too and recreates invoices_all
+create table if not exists invoices_archive as select * from invoices where 0;
+create unique index if not exists invoices_archive_id_idx on invoices_archive (id);
+create index if not exists invoices_archive_invoice_id_idx on invoices_archive (invoice_id);
+create index if not exists invoices_archive_merchant_created_idx on invoices_archive (merchant_email, created_at, id);
+create index if not exists invoices_archive_merchant_status_created_idx
+    on invoices_archive (merchant_email, status, created_at);
+-- Both tiers, for merchant-facing reads
+create view if not exists invoices_all as select * from invoices union all select * from invoices_archive;
+""", """
+-- Analytics snapshots fetch a merchant's invoices changed since a cursor, as in migrations/007
+create index if not exists invoices_merchant_updated_idx on invoices (merchant_email, updated_at);
+create index if not exists invoices_archive_merchant_updated_idx on invoices_archive (merchant_email, updated_at);
+""", """
+-- Passkey ceremony state between begin and finish, as in migrations/008
+create table if not exists webauthn_challenges (
+    email text primary key,
+    state text not null,
+    expires_at text not null
+);
+""")
+
+TABLES = ("invoices", "invoices_archive", "invoices_all", "company_info", "credentials", "webauthn_challenges", "outbox")
+JSON_COLUMNS = {
+    "invoices": ("items",), "invoices_archive": ("items",), "invoices_all": ("items",),
+    "credentials": ("transports",), "webauthn_challenges": ("state",), "outbox": ("payload",)
+}
+
+
+def _timestamp(value) -> Optional[str]:
+    """Fixed-width UTC ISO-8601 text for a datetime or ISO string"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _now() -> str:
+    return _timestamp(datetime.now(timezone.utc))
+
+
+def _is_timestamp(column: str) -> bool:
+    return column.endswith(("_at", "_until"))
+
+
+@contextmanager
+def _observed(table: str, operation: str):
+    """Time and trace a statement the way the PostgREST client hooks do"""
+    started = time.perf_counter()
+    # Like the PostgREST spans, queries outside any request, job or pipeline pass aren't traced
+    scope = span(f"{operation} {table}", "client", attributes={
+        "db.system": "sqlite",
+        "db.collection.name": table,
+        "db.operation.name": operation,
+    }) if current_traceparent() is not None else nullcontext()
+    status = "ok"
+    try:
+        with scope:
+            yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        db_duration.observe(time.perf_counter() - started, table, operation)
+        db_requests.inc(table, operation, status)
+
+
+class SQLiteDatabase:
+    def __init__(self, path: str, readonly: bool = False):
+        self.path = path
+        self._lock = threading.RLock()
+        # A read replica (or a second, read-only connection to the primary's file) is migrated by its writer
+        target, uri = (f"{Path(path).resolve().as_uri()}?mode=ro", True) if readonly else (path, False)
+        self._conn = sqlite3.connect(target, uri=uri, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        if readonly:
+            self._conn.execute("pragma query_only = on")
+        else:
+            if path != ":memory:":
+                # Readers don't block the writer (and vice versa) across worker processes
+                self._conn.execute("pragma journal_mode = wal")
+                self._conn.execute("pragma synchronous = normal")
+            self.migrate()
+        self.columns = {
+            table: {row["name"] for row in self._conn.execute(f"pragma table_info({table})")}
+            for table in TABLES
+        }
+
+    def migrate(self) -> int:
+        """Apply pending schema versions; returns the resulting version"""
+        with self._lock:
+            version = self._conn.execute("pragma user_version").fetchone()[0]
+            for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+                self._conn.executescript(f"begin immediate;\n{script}\npragma user_version = {number};\ncommit;")
+            return max(version, len(MIGRATIONS))
+
+    # --- encoding ---
+
+    def column_list(self, table: str, columns) -> List[str]:
+        """Validated column names from a PostgREST-style "a,b" list or an iterable"""
+        names = [name.strip() for name in columns.split(",")] if isinstance(columns, str) else list(columns)
+        for name in names:
+            if name not in self.columns[table]:
+                raise ValueError(f"Unknown column {table}.{name}")
+        return names
+
+    def select_list(self, table: str, columns: str) -> str:
+        return "*" if columns.strip() == "*" else ", ".join(self.column_list(table, columns))
+
+    def encode(self, table: str, row: dict) -> dict:
+        encoded = {}
+        for column, value in row.items():
+            if value is not None and column in JSON_COLUMNS.get(table, ()):
+                value = json.dumps(value)
+            elif _is_timestamp(column):
+                value = _timestamp(value)
+            encoded[column] = value
+        return encoded
+
+    def decode(self, table: str, row: sqlite3.Row) -> dict:
+        decoded = dict(row)
+        for column in JSON_COLUMNS.get(table, ()):
+            if isinstance(decoded.get(column), str):
+                decoded[column] = json.loads(decoded[column])
+        return decoded
+
+    # --- statements ---
+
+    def fetch(self, table: str, operation: str, sql: str, params: Iterable = ()) -> List[dict]:
+        with _observed(table, operation), self._lock:
+            rows = self._conn.execute(sql, tuple(params)).fetchall()
+        return [self.decode(table, row) for row in rows]
+
+    def fetch_one(self, table: str, sql: str, params: Iterable = ()) -> Optional[dict]:
+        rows = self.fetch(table, "select", sql + " limit 1", params)
+        return rows[0] if rows else None
+
+    @contextmanager
+    def transaction(self, table: str, operation: str):
+        """Write transaction holding the database lock from the start"""
+        with _observed(table, operation), self._lock:
+            self._conn.execute("begin immediate")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("rollback")
+                raise
+            self._conn.execute("commit")
+
+    def insert(self, table: str, rows: List[dict], conflict_update: bool = False, operation: str = "insert") -> List[dict]:
+        """Insert rows in one transaction; with ``conflict_update`` existing ids are rewritten"""
+        inserted = []
+        with self.transaction(table, operation) as conn:
+            for row in rows:
+                encoded = self.encode(table, row)
+                columns = self.column_list(table, encoded)
+                sql = f"insert into {table} ({', '.join(columns)}) values ({', '.join('?' * len(columns))})"
+                if conflict_update:
+                    sql += " on conflict (id) do update set " + ", ".join(
+                        f"{column} = excluded.{column}" for column in columns if column != "id"
+                    )
+                sql += " returning *"
+                inserted.extend(self.decode(table, row) for row in conn.execute(sql, list(encoded.values())).fetchall())
+        return inserted
+
+    def assignments(self, table: str, changes: dict) -> Tuple[str, list]:
+        encoded = self.encode(table, changes)
+        columns = self.column_list(table, encoded)
+        return ", ".join(f"{column} = ?" for column in columns), list(encoded.values())
+
+
+def _date_filters(merchant_email: str, status: Optional[str], from_date: Optional[str],
+                  to_date: Optional[str]) -> Tuple[str, list]:
+    """Same bounds as the Supabase backend's filter_invoices"""
+    where, params = ["merchant_email = ?"], [merchant_email]
+    if status:
+        where.append("status = ?")
+        params.append(status)
+    if from_date:
+        where.append("created_at >= ?")
+        params.append(_timestamp(f"{from_date}T00:00:00Z"))
+    if to_date:
+        where.append("created_at <= ?")
+        params.append(_timestamp(f"{to_date}T23:59:59Z"))
+    return " and ".join(where), params
+
+
+class SQLiteInvoiceRepository(InvoiceRepository):
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+
+    def get(self, id: str, merchant_email: Optional[str] = None, columns: str = "*") -> Optional[dict]:
+        sql = f"select {self.db.select_list('invoices_all', columns)} from invoices_all where id = ?"
+        params = [id]
+        if merchant_email is not None:
+            sql += " and merchant_email = ?"
+            params.append(merchant_email)
+        return self.db.fetch_one("invoices_all", sql, params)
+
+    def get_public(self, invoice_id: str, columns: str = "*") -> Optional[dict]:
+        select = self.db.select_list("invoices", columns)
+        row = self.db.fetch_one("invoices", f"select {select} from invoices where invoice_id = ?", [invoice_id])
+        if row is None:
+            row = self.db.fetch_one("invoices", f"select {select} from invoices where id = ?", [invoice_id])
+        return row
+
+    def find_many(self, ids: List[str], merchant_email: str) -> List[dict]:
+        if not ids:
+            return []
+        return self.db.fetch(
+            "invoices", "select",
+            f"select * from invoices where id in ({', '.join('?' * len(ids))}) and merchant_email = ?",
+            [*ids, merchant_email]
+        )
+
+    def insert(self, row: dict) -> None:
+        self.db.insert("invoices", [row])
+
+    def insert_many(self, rows: List[dict]) -> None:
+        self.db.insert("invoices", rows)
+
+    def issue_many(self, merchant_email: str, changes: List[dict]) -> List[str]:
+        issued = []
+        with self.db.transaction("issue_invoices", "rpc") as conn:
+            for change in changes:
+                fields = {key: value for key, value in change.items() if key != "id"}
+                assignments, params = self.db.assignments("invoices", fields)
+                row = conn.execute(
+                    f"update invoices set {assignments} where id = ? and merchant_email = ? and status = 'DRAFT' returning id",
+                    [*params, change["id"], merchant_email]
+                ).fetchone()
+                if row:
+                    issued.append(row["id"])
+        return issued
+
+    def update(self, id: str, changes: dict) -> None:
+        assignments, params = self.db.assignments("invoices", changes)
+        with self.db.transaction("invoices", "update") as conn:
+            conn.execute(f"update invoices set {assignments} where id = ?", [*params, id])
+
+    def list(self, merchant_email: str, status: Optional[str] = None, from_date: Optional[str] = None,
+             to_date: Optional[str] = None, columns: str = "*", limit: Optional[int] = None,
+             offset: int = 0, newest_first: bool = True) -> List[dict]:
+        where, params = _date_filters(merchant_email, status, from_date, to_date)
+        sql = f"select {self.db.select_list('invoices_all', columns)} from invoices_all where {where}"
+        if newest_first:
+            sql += " order by created_at desc, id desc"
+        if limit is not None:
+            sql += " limit ? offset ?"
+            params += [limit, offset]
+        return self.db.fetch("invoices_all", "select", sql, params)
+
+    def page(self, merchant_email: str, status: Optional[str], from_date: Optional[str], to_date: Optional[str],
+             after: Optional[dict], limit: int) -> List[dict]:
+        where, params = _date_filters(merchant_email, status, from_date, to_date)
+        if after:
+            where += " and (created_at, id) < (?, ?)"
+            params += [_timestamp(after["created_at"]), after["id"]]
+        return self.db.fetch(
+            "invoices_all", "select",
+            f"select * from invoices_all where {where} order by created_at desc, id desc limit ?", [*params, limit]
+        )
+
+    def version(self, merchant_email: str, status: Optional[str] = None, from_date: Optional[str] = None,
+                to_date: Optional[str] = None) -> Tuple[int, Optional[str]]:
+        where, params = _date_filters(merchant_email, status, from_date, to_date)
+        row = self.db.fetch("invoices_all", "count",
+                            f"select count(*) as count, max(updated_at) as latest from invoices_all where {where}",
+                            params)[0]
+        return row["count"], row["latest"]
+
+    def list_changed(self, merchant_email: str, since: Optional[str], columns: str = "*") -> List[dict]:
+        sql = f"select {self.db.select_list('invoices_all', columns)} from invoices_all where merchant_email = ?"
+        params = [merchant_email]
+        if since is not None:
+            sql += " and updated_at > ?"
+            params.append(_timestamp(since))
+        return self.db.fetch("invoices_all", "select", sql, params)
+
+    def issued_before(self, cutoff: str) -> List[dict]:
+        return self.db.fetch(
+            "invoices", "select",
+            "select id, invoice_id, merchant_email from invoices where status = ? and issued_at < ?",
+            [InvoiceStatus.ISSUED.value, _timestamp(cutoff)]
+        )
+
+    def changed_since(self, cursor: str, limit: int) -> List[dict]:
+        return self.db.fetch(
+            "invoices", "select",
+            f"select {self.db.select_list('invoices', STATUS_COLUMNS)} from invoices "
+            "where updated_at > ? order by updated_at limit ?",
+            [_timestamp(cursor), limit]
+        )
+
+    def archive(self, before: str, limit: int) -> int:
+        columns = ", ".join(sorted(self.db.columns["invoices"]))
+        with self.db.transaction("archive_invoices", "rpc") as conn:
+            # Same selection as archive_invoices in migrations/006
+            ids = [row["id"] for row in conn.execute(
+                """
+                select id from invoices
+                 where updated_at < ?
+                   and (status in ('CANCELED', 'EXPIRED') or (status = 'PAID' and einvoice_status = 'SENT'))
+                 order by updated_at
+                 limit ?
+                """,
+                [_timestamp(before), limit]
+            ).fetchall()]
+            if ids:
+                marks = ", ".join("?" * len(ids))
+                conn.execute(f"insert into invoices_archive ({columns}) select {columns} from invoices "
+                             f"where id in ({marks})", ids)
+                conn.execute(f"delete from invoices where id in ({marks})", ids)
+        return len(ids)
+
+    def mark_paid(self, id: str, tx_hash: str, paid_at: str, paid_amount: Optional[float] = None,
+                  paid_amount_units: Optional[int] = None, paid_token: Optional[str] = None,
+                  jobs: Iterable[dict] = ()) -> Optional[dict]:
+        paid_at = _timestamp(paid_at)
+        with self.db.transaction("mark_invoice_paid", "rpc") as conn:
+            row = conn.execute(
+                """
+                update invoices
+                   set status = 'PAID',
+                       tx_hash = ?,
+                       paid_at = ?,
+                       paid_amount = coalesce(?, paid_amount),
+                       paid_amount_units = coalesce(?, paid_amount_units),
+                       paid_token = coalesce(?, paid_token),
+                       updated_at = ?
+                 where id = ? and status = 'ISSUED' and tx_hash is null
+                returning *
+                """,
+                [tx_hash, paid_at, paid_amount, paid_amount_units, paid_token, paid_at, id]
+            ).fetchone()
+            if row is None:
+                return None
+            now = _now()
+            conn.executemany(
+                "insert into outbox (topic, payload, available_at, created_at, updated_at) values (?, ?, ?, ?, ?)",
+                [(entry["topic"], json.dumps(entry.get("payload") or {}), now, now, now) for entry in jobs]
+            )
+        return self.db.decode("invoices", row)
+
+    def _lease(self, operation: str, where: str, order: str, params: list, limit: int, lease_seconds: int) -> List[dict]:
+        now = datetime.now(timezone.utc)
+        with self.db.transaction(operation, "rpc") as conn:
+            rows = conn.execute(
+                f"""
+                update invoices set einvoice_locked_until = ?
+                 where id in (
+                    select id from invoices
+                     where status = 'PAID' and {where}
+                       and (einvoice_locked_until is null or einvoice_locked_until < ?)
+                     order by {order}
+                     limit ?
+                 )
+                returning *
+                """,
+                [_timestamp(now + timedelta(seconds=lease_seconds)), *params, _timestamp(now), limit]
+            ).fetchall()
+        return [self.db.decode("invoices", row) for row in rows]
+
+    def claim_einvoices(self, einvoice_status: str, limit: int, lease_seconds: int) -> List[dict]:
+        # Inlined (validated) so the query matches the queue's partial index
+        state = EInvoiceStatus(einvoice_status).value
+        return self._lease("claim_einvoices", f"einvoice_status = '{state}'", "coalesce(einvoice_submitted_at, paid_at)",
+                           [], limit, lease_seconds)
+
+    def claim_due_einvoices(self, limit: int, lease_seconds: int) -> List[dict]:
+        return self._lease("claim_due_einvoices", "einvoice_status = 'FAILED' and einvoice_next_attempt_at <= ?",
+                           "einvoice_next_attempt_at", [_now()], limit, lease_seconds)
+
+    def claim_einvoice(self, id: str, merchant_email: str, einvoice_statuses: Iterable[str],
+                       lease_seconds: int) -> Optional[dict]:
+        states = [EInvoiceStatus(state).value for state in einvoice_statuses]
+        now = datetime.now(timezone.utc)
+        with self.db.transaction("claim_einvoice", "rpc") as conn:
+            row = conn.execute(
+                f"""
+                update invoices set einvoice_locked_until = ?
+                 where id = ? and merchant_email = ? and status = 'PAID'
+                   and einvoice_status in ({', '.join('?' * len(states))})
+                   and (einvoice_locked_until is null or einvoice_locked_until < ?)
+                returning *
+                """,
+                [_timestamp(now + timedelta(seconds=lease_seconds)), id, merchant_email, *states, _timestamp(now)]
+            ).fetchone()
+        return self.db.decode("invoices", row) if row else None
+
+    def update_einvoices(self, rows: List[dict]) -> None:
+        with self.db.transaction("update_einvoices", "rpc") as conn:
+            for row in rows:
+                changes = {column: value for column, value in row.items() if column != "id"}
+                assignments, params = self.db.assignments("invoices", changes)
+                conn.execute(f"update invoices set {assignments} where id = ?", [*params, row["id"]])
+
+    def einvoice_queues(self, now: str) -> dict:
+        # Literal states so each count can use its partial index
+        pending = self.db.fetch("invoices", "count", """
+            select count(*) as count, min(paid_at) as oldest from invoices
+             where status = 'PAID' and einvoice_status = 'PENDING'
+        """)[0]
+        submitted = self.db.fetch("invoices", "count", """
+            select count(*) as count, min(einvoice_submitted_at) as oldest from invoices
+             where einvoice_status = 'SUBMITTED'
+        """)[0]
+        retry_due = self.db.fetch("invoices", "count", """
+            select count(*) as count from invoices
+             where status = 'PAID' and einvoice_status = 'FAILED' and einvoice_next_attempt_at <= ?
+        """, [_timestamp(now)])[0]
+        dead = self.db.fetch("invoices", "count", "select count(*) as count from invoices where einvoice_status = 'DEAD'")[0]
+        return {
+            "pending": pending["count"],
+            "submitted": submitted["count"],
+            "retry_due": retry_due["count"],
+            "dead": dead["count"],
+            "oldest_paid_at": pending["oldest"],
+            "oldest_submitted_at": submitted["oldest"],
+        }
+
+
+class SQLiteCompanyRepository(CompanyRepository):
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+
+    def get(self, email: str, columns: str = "*") -> Optional[dict]:
+        return self.db.fetch_one(
+            "company_info", f"select {self.db.select_list('company_info', columns)} from company_info where email = ?",
+            [email]
+        )
+
+    def find_many(self, emails: Iterable[str]) -> Dict[str, dict]:
+        emails = list(emails)
+        if not emails:
+            return {}
+        rows = self.db.fetch(
+            "company_info", "select",
+            f"select * from company_info where email in ({', '.join('?' * len(emails))})", emails
+        )
+        return {merchant["email"]: merchant for merchant in rows}
+
+    def insert(self, row: dict) -> None:
+        self.db.insert("company_info", [{"created_at": _now(), **row}])
+
+
+class SQLiteCredentialRepository(CredentialRepository):
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+
+    def list_for(self, email: str) -> List[dict]:
+        return self.db.fetch("credentials", "select", "select * from credentials where email = ? order by id", [email])
+
+    def exists(self, email: str) -> bool:
+        return self.db.fetch_one("credentials", "select email from credentials where email = ?", [email]) is not None
+
+    def insert(self, row: dict) -> None:
+        self.db.insert("credentials", [{"created_at": _now(), **row}])
+
+
+class SQLiteChallengeRepository(ChallengeRepository):
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+
+    def put(self, email: str, state: dict, ttl_seconds: int) -> None:
+        expires_at = _timestamp(datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds))
+        with self.db.transaction("webauthn_challenges", "upsert") as conn:
+            conn.execute(
+                "insert into webauthn_challenges (email, state, expires_at) values (?, ?, ?) "
+                "on conflict (email) do update set state = excluded.state, expires_at = excluded.expires_at",
+                [email, json.dumps(state), expires_at]
+            )
+
+    def get(self, email: str) -> Optional[dict]:
+        row = self.db.fetch_one("webauthn_challenges", "select state from webauthn_challenges where email = ? and expires_at > ?",
+                                [email, _now()])
+        return row["state"] if row else None
+
+    def delete(self, email: str) -> None:
+        with self.db.transaction("webauthn_challenges", "delete") as conn:
+            conn.execute("delete from webauthn_challenges where email = ?", [email])
+
+
+class SQLiteOutboxRepository(OutboxRepository):
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+
+    def enqueue(self, topic: str, payload: dict, available_at: Optional[str] = None) -> dict:
+        now = _now()
+        return self.db.insert("outbox", [{
+            "topic": topic,
+            "payload": payload,
+            "available_at": available_at or now,
+            "created_at": now,
+            "updated_at": now
+        }])[0]
+
+    def depth(self) -> dict:
+        # One count per state so each reads its partial index
+        pending = self.db.fetch("outbox", "count", "select count(*) as count from outbox where status = 'PENDING'")[0]
+        dead = self.db.fetch("outbox", "count", "select count(*) as count from outbox where status = 'DEAD'")[0]
+        return {"pending": pending["count"], "dead": dead["count"]}
+
+    def claim(self, worker: str, limit: int, visibility_seconds: int) -> List[dict]:
+        now = datetime.now(timezone.utc)
+        with self.db.transaction("claim_outbox_jobs", "rpc") as conn:
+            rows = conn.execute(
+                """
+                update outbox
+                   set locked_until = ?, locked_by = ?, attempts = attempts + 1, updated_at = ?
+                 where id in (
+                    select id from outbox
+                     where status = 'PENDING' and available_at <= ?
+                       and (locked_until is null or locked_until < ?)
+                     order by available_at
+                     limit ?
+                 )
+                returning *
+                """,
+                [_timestamp(now + timedelta(seconds=visibility_seconds)), worker, _timestamp(now),
+                 _timestamp(now), _timestamp(now), limit]
+            ).fetchall()
+        return [self.db.decode("outbox", row) for row in rows]
+
+    def update_leased(self, id: int, worker: str, changes: dict) -> None:
+        assignments, params = self.db.assignments("outbox", changes)
+        with self.db.transaction("outbox", "update") as conn:
+            conn.execute(f"update outbox set {assignments} where id = ? and locked_by = ?", [*params, id, worker])
+
+
+def sqlite_repositories(path: str, readonly: bool = False) -> Repositories:
+    db = SQLiteDatabase(path, readonly)
+    return Repositories(
+        invoices=SQLiteInvoiceRepository(db),
+        companies=SQLiteCompanyRepository(db),
+        credentials=SQLiteCredentialRepository(db),
+        challenges=SQLiteChallengeRepository(db),
+        outbox=SQLiteOutboxRepository(db),
+    )
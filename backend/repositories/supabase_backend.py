@@ -0,0 +1,279 @@
+"""Repositories on the hosted Supabase database, through supabase-py's PostgREST client."""
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from repositories.base import (
+    STATUS_COLUMNS, ChallengeRepository, CompanyRepository, CredentialRepository, InvoiceRepository, OutboxRepository, Repositories
+)
+from utils.database import get_supabase_client
+from utils.models import EInvoiceStatus, InvoiceStatus
+
+
+def or_filter(query, conditions: str):
+    """PostgREST ``or=(...)`` filter; postgrest-py 0.13 has no or_() builder method"""
+    if hasattr(query, "or_"):
+        return query.or_(conditions)
+    query.params = query.params.add("or", f"({conditions})")
+    return query
+
+
+def filter_invoices(query, status: Optional[str] = None, from_date: Optional[str] = None, to_date: Optional[str] = None):
+    """Apply the shared status and created_at date-range filters"""
+    if status:
+        query = query.eq("status", status)
+    if from_date:
+        query = query.gte("created_at", f"{from_date}T00:00:00Z")
+    if to_date:
+        query = query.lte("created_at", f"{to_date}T23:59:59Z")
+    return query
+
+
+LIST_PAGE_SIZE = 1000
+
+
+def _first(response) -> Optional[dict]:
+    return response.data[0] if response.data else None
+
+
+class _SupabaseClient:
+    def __init__(self, client: Callable = get_supabase_client):
+        # A getter rather than a client, so a settings reload swaps it
+        self.client = client
+
+
+class SupabaseInvoiceRepository(_SupabaseClient, InvoiceRepository):
+    def _table(self, name: str = "invoices"):
+        return self.client().table(name)
+
+    def get(self, id: str, merchant_email: Optional[str] = None, columns: str = "*") -> Optional[dict]:
+        query = self._table("invoices_all").select(columns).eq("id", id)
+        if merchant_email is not None:
+            query = query.eq("merchant_email", merchant_email)
+        return _first(query.execute())
+
+    def get_public(self, invoice_id: str, columns: str = "*") -> Optional[dict]:
+        row = _first(self._table().select(columns).eq("invoice_id", invoice_id).execute())
+        if row is None:
+            # Try with internal id as fallback
+            row = _first(self._table().select(columns).eq("id", invoice_id).execute())
+        return row
+
+    def find_many(self, ids: List[str], merchant_email: str) -> List[dict]:
+        return self._table().select("*").in_("id", ids).eq("merchant_email", merchant_email).execute().data
+
+    def insert(self, row: dict) -> None:
+        self._table().insert(row).execute()
+
+    def insert_many(self, rows: List[dict]) -> None:
+        self._table().insert(rows).execute()
+
+    def issue_many(self, merchant_email: str, changes: List[dict]) -> List[str]:
+        response = self.client().rpc("issue_invoices", {"p_merchant_email": merchant_email, "p_rows": changes}).execute()
+        return [row["id"] for row in response.data]
+
+    def update(self, id: str, changes: dict) -> None:
+        self._table().update(changes).eq("id", id).execute()
+
+    def list(self, merchant_email: str, status: Optional[str] = None, from_date: Optional[str] = None,
+             to_date: Optional[str] = None, columns: str = "*", limit: Optional[int] = None,
+             offset: int = 0, newest_first: bool = True) -> List[dict]:
+        query = filter_invoices(self._table("invoices_all").select(columns).eq("merchant_email", merchant_email),
+                                status, from_date, to_date)
+        if newest_first:
+            query = query.order("created_at", desc=True)
+        if limit is not None:
+            query = query.range(offset, offset + limit - 1)
+        return query.execute().data
+
+    def page(self, merchant_email: str, status: Optional[str], from_date: Optional[str], to_date: Optional[str],
+             after: Optional[dict], limit: int) -> List[dict]:
+        query = filter_invoices(self._table("invoices_all").select("*").eq("merchant_email", merchant_email),
+                                status, from_date, to_date)
+        if after:
+            # Rows strictly after the previous page's last (created_at, id)
+            query = or_filter(
+                query,
+                f'created_at.lt."{after["created_at"]}",'
+                f'and(created_at.eq."{after["created_at"]}",id.lt.{after["id"]})'
+            )
+        # One order param: "created_at.desc,id.desc" (repeated order params aren't combined)
+        return query.order("created_at.desc,id", desc=True).limit(limit).execute().data
+
+    def version(self, merchant_email: str, status: Optional[str] = None, from_date: Optional[str] = None,
+                to_date: Optional[str] = None) -> Tuple[int, Optional[str]]:
+        query = self._table("invoices_all").select("updated_at", count="exact").eq("merchant_email", merchant_email)
+        query = filter_invoices(query, status, from_date, to_date)
+        response = query.order("updated_at", desc=True).limit(1).execute()
+        latest = response.data[0]["updated_at"] if response.data else None
+        return response.count, latest
+
+    def list_changed(self, merchant_email: str, since: Optional[str], columns: str = "*") -> List[dict]:
+        rows = []
+        while True:
+            query = self._table("invoices_all").select(columns).eq("merchant_email", merchant_email)
+            if since is not None:
+                query = query.gt("updated_at", since)
+            # Paged: PostgREST caps a response at its max-rows setting (1000 on Supabase);
+            # postgrest-py's range() end is exclusive
+            page = query.order("id").range(len(rows), len(rows) + LIST_PAGE_SIZE).execute().data
+            rows.extend(page)
+            if len(page) < LIST_PAGE_SIZE:
+                return rows
+
+    def issued_before(self, cutoff: str) -> List[dict]:
+        return (
+            self._table().select("id,invoice_id,merchant_email")
+            .eq("status", InvoiceStatus.ISSUED.value).lt("issued_at", cutoff).execute().data
+        )
+
+    def changed_since(self, cursor: str, limit: int) -> List[dict]:
+        return self._table().select(STATUS_COLUMNS).gt("updated_at", cursor).order("updated_at").limit(limit).execute().data
+
+    def archive(self, before: str, limit: int) -> int:
+        response = self.client().rpc("archive_invoices", {"p_before": before, "p_limit": limit}).execute()
+        return response.data or 0
+
+    def mark_paid(self, id: str, tx_hash: str, paid_at: str, paid_amount: Optional[float] = None,
+                  paid_amount_units: Optional[int] = None, paid_token: Optional[str] = None,
+                  jobs: Iterable[dict] = ()) -> Optional[dict]:
+        response = self.client().rpc("mark_invoice_paid", {
+            "p_invoice_id": id,
+            "p_tx_hash": tx_hash,
+            "p_paid_at": paid_at,
+            "p_paid_amount": paid_amount,
+            "p_paid_amount_units": paid_amount_units,
+            "p_paid_token": paid_token,
+            "p_jobs": list(jobs)
+        }).execute()
+        return response.data
+
+    def claim_einvoices(self, einvoice_status: str, limit: int, lease_seconds: int) -> List[dict]:
+        response = self.client().rpc("claim_einvoices", {
+            "p_status": einvoice_status,
+            "p_limit": limit,
+            "p_lease_seconds": lease_seconds
+        }).execute()
+        return response.data or []
+
+    def claim_due_einvoices(self, limit: int, lease_seconds: int) -> List[dict]:
+        response = self.client().rpc("claim_due_einvoices", {
+            "p_limit": limit,
+            "p_lease_seconds": lease_seconds
+        }).execute()
+        return response.data or []
+
+    def claim_einvoice(self, id: str, merchant_email: str, einvoice_statuses: Iterable[str],
+                       lease_seconds: int) -> Optional[dict]:
+        response = self.client().rpc("claim_einvoice", {
+            "p_id": id,
+            "p_merchant_email": merchant_email,
+            "p_statuses": list(einvoice_statuses),
+            "p_lease_seconds": lease_seconds
+        }).execute()
+        return response.data[0] if response.data else None
+
+    def update_einvoices(self, rows: List[dict]) -> None:
+        self.client().rpc("update_einvoices", {"p_rows": rows}).execute()
+
+    def einvoice_queues(self, now: str) -> dict:
+        pending = (
+            self._table().select("paid_at", count="exact")
+            .eq("status", InvoiceStatus.PAID.value).eq("einvoice_status", EInvoiceStatus.PENDING.value)
+            .order("paid_at").limit(1).execute()
+        )
+        submitted = (
+            self._table().select("einvoice_submitted_at", count="exact")
+            .eq("einvoice_status", EInvoiceStatus.SUBMITTED.value)
+            .order("einvoice_submitted_at").limit(1).execute()
+        )
+        retry_due = (
+            self._table().select("id", count="exact")
+            .eq("status", InvoiceStatus.PAID.value).eq("einvoice_status", EInvoiceStatus.FAILED.value)
+            .lte("einvoice_next_attempt_at", now).limit(1).execute()
+        )
+        dead = (
+            self._table().select("id", count="exact")
+            .eq("einvoice_status", EInvoiceStatus.DEAD.value).limit(1).execute()
+        )
+        return {
+            "pending": pending.count or 0,
+            "submitted": submitted.count or 0,
+            "retry_due": retry_due.count or 0,
+            "dead": dead.count or 0,
+            "oldest_paid_at": pending.data[0].get("paid_at") if pending.data else None,
+            "oldest_submitted_at": submitted.data[0].get("einvoice_submitted_at") if submitted.data else None,
+        }
+
+
+class SupabaseCompanyRepository(_SupabaseClient, CompanyRepository):
+    def get(self, email: str, columns: str = "*") -> Optional[dict]:
+        return _first(self.client().table("company_info").select(columns).eq("email", email).execute())
+
+    def find_many(self, emails: Iterable[str]) -> Dict[str, dict]:
+        response = self.client().table("company_info").select("*").in_("email", list(emails)).execute()
+        return {merchant["email"]: merchant for merchant in response.data}
+
+    def insert(self, row: dict) -> None:
+        self.client().table("company_info").insert(row).execute()
+
+
+class SupabaseCredentialRepository(_SupabaseClient, CredentialRepository):
+    def list_for(self, email: str) -> List[dict]:
+        return self.client().table("credentials").select("*").eq("email", email).execute().data
+
+    def exists(self, email: str) -> bool:
+        return bool(self.client().table("credentials").select("email").eq("email", email).execute().data)
+
+    def insert(self, row: dict) -> None:
+        self.client().table("credentials").insert(row).execute()
+
+
+class SupabaseChallengeRepository(_SupabaseClient, ChallengeRepository):
+    def put(self, email: str, state: dict, ttl_seconds: int) -> None:
+        expires_at = (datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)).isoformat()
+        self.client().table("webauthn_challenges").upsert(
+            {"email": email, "state": state, "expires_at": expires_at}, on_conflict="email"
+        ).execute()
+
+    def get(self, email: str) -> Optional[dict]:
+        row = _first(self.client().table("webauthn_challenges").select("state").eq("email", email)
+                     .gt("expires_at", datetime.now(timezone.utc).isoformat()).execute())
+        return row["state"] if row else None
+
+    def delete(self, email: str) -> None:
+        self.client().table("webauthn_challenges").delete().eq("email", email).execute()
+
+
+class SupabaseOutboxRepository(_SupabaseClient, OutboxRepository):
+    def enqueue(self, topic: str, payload: dict, available_at: Optional[str] = None) -> dict:
+        row = {"topic": topic, "payload": payload}
+        if available_at:
+            row["available_at"] = available_at
+        return self.client().table("outbox").insert(row).execute().data[0]
+
+    def depth(self) -> dict:
+        supabase = self.client()
+        pending = supabase.table("outbox").select("id", count="exact").eq("status", "PENDING").limit(1).execute()
+        dead = supabase.table("outbox").select("id", count="exact").eq("status", "DEAD").limit(1).execute()
+        return {"pending": pending.count or 0, "dead": dead.count or 0}
+
+    def claim(self, worker: str, limit: int, visibility_seconds: int) -> List[dict]:
+        response = self.client().rpc("claim_outbox_jobs", {
+            "p_worker": worker,
+            "p_limit": limit,
+            "p_visibility_seconds": visibility_seconds
+        }).execute()
+        return response.data or []
+
+    def update_leased(self, id: int, worker: str, changes: dict) -> None:
+        self.client().table("outbox").update(changes).eq("id", id).eq("locked_by", worker).execute()
+
+
+def supabase_repositories(client: Callable = get_supabase_client) -> Repositories:
+    return Repositories(
+        invoices=SupabaseInvoiceRepository(client),
+        companies=SupabaseCompanyRepository(client),
+        credentials=SupabaseCredentialRepository(client),
+        challenges=SupabaseChallengeRepository(client),
+        outbox=SupabaseOutboxRepository(client),
+    )
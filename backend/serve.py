@@ -0,0 +1,197 @@
+"""Production server: uvicorn workers sharing one listening socket.
+
+``python main.py`` is the development server (one process, auto-reload).
+This runs ``main:app`` the way it should run in production:
+
+  * one worker process per available core (the container's CPU quota or
+    the process's CPU affinity), or ``--workers`` / WEB_CONCURRENCY; a
+    worker that dies is replaced
+  * uvloop and httptools when installed, else asyncio and h11
+  * a listen backlog and keep-alive sized for a load balancer in front
+  * each worker warms up (WARM_UP=1: database connections, keys, lazy
+    imports, signing processes) before it accepts its first connection
+  * on SIGTERM or SIGINT workers stop accepting, end open event streams
+    (EventSource clients reconnect elsewhere), wait up to
+    ``--graceful-timeout`` seconds for in-flight requests, then give
+    background jobs and the e-invoice pass SHUTDOWN_TIMEOUT seconds
+
+Every worker runs its own outbox jobs, e-invoice pipeline and
+EINVOICE_SIGN_WORKERS signing processes; they coordinate through the
+database, which also holds passkey challenges, so a registration or login
+may begin on one worker and finish on another. Workers publish their
+metrics to METRICS_DIR (a temporary directory unless set), so a scrape of
+/metrics reaching any worker covers all of them. Give the orchestrator a
+stop grace period longer than ``--graceful-timeout`` plus SHUTDOWN_TIMEOUT.
+
+Run from anywhere:
+    python serve.py
+    python serve.py --workers 4 --port 8080 --forwarded-allow-ips 10.0.0.0/8
+"""
+import argparse
+import importlib.util
+import math
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import uvicorn
+from uvicorn._subprocess import get_subprocess
+from uvicorn.supervisors import Multiprocess
+
+BACKEND_DIR = Path(__file__).resolve().parent
+# Exit status of a worker whose startup (settings, lifespan) failed; respawning it would only fail again
+STARTUP_FAILURE = 3
+
+
+def available_cores() -> int:
+    """CPUs this process may use: the affinity mask, capped by a cgroup v2 CPU quota"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:  # not Linux
+        cores = os.cpu_count() or 1
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            cores = min(cores, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+class Server(uvicorn.Server):
+    async def shutdown(self, sockets=None) -> None:
+        # Event streams never end on their own and would hold the drain until the timeout
+        from utils.events import hub
+        hub.close_streams()
+        await super().shutdown(sockets=sockets)
+
+    def run(self, sockets=None) -> None:
+        super().run(sockets=sockets)
+        if not self.started:
+            sys.exit(STARTUP_FAILURE)
+
+
+class Supervisor(Multiprocess):
+    """uvicorn's worker supervisor, replacing workers that exit while the server is running"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failed = False
+
+    def run(self) -> None:
+        self.startup()
+        while not self.should_exit.wait(1.0):
+            for index, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                if process.exitcode == STARTUP_FAILURE:
+                    print(f"Worker {process.pid} failed to start; shutting down")
+                    self.failed = True
+                    self.should_exit.set()
+                    break
+                print(f"Worker {process.pid} exited with status {process.exitcode}; starting a replacement")
+                replacement = get_subprocess(config=self.config, target=self.target, sockets=self.sockets)
+                replacement.start()
+                self.processes[index] = replacement
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        # Signal every worker before waiting for any, so they drain in parallel
+        # and the whole stop takes one worker's drain, not one per worker
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        print(f"Stopped parent process [{self.pid}]")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY") or available_cores()),
+                        help="worker processes (default: WEB_CONCURRENCY, else one per available core)")
+    parser.add_argument("--loop", choices=("uvloop", "asyncio"), default="uvloop" if _installed("uvloop") else "asyncio")
+    parser.add_argument("--http", choices=("httptools", "h11"), default="httptools" if _installed("httptools") else "h11")
+    parser.add_argument("--backlog", type=int, default=2048, help="pending connections queued by the kernel")
+    # Longer than the 60 s idle timeout of common load balancers, so the balancer
+    # closes idle connections first and never reuses one the server is closing
+    parser.add_argument("--keep-alive", type=int, default=75, help="seconds an idle keep-alive connection stays open")
+    parser.add_argument("--limit-concurrency", type=int, default=None,
+                        help="connections per worker before new requests get 503 (default: unlimited)")
+    parser.add_argument("--graceful-timeout", type=int, default=20,
+                        help="seconds in-flight requests get to finish on shutdown")
+    parser.add_argument("--forwarded-allow-ips", default=None,
+                        help="proxies trusted for X-Forwarded-For/Proto (default: FORWARDED_ALLOW_IPS or 127.0.0.1)")
+    parser.add_argument("--access-log", action="store_true", help="log every request (off: /metrics and traces cover it)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    # Workers inherit the environment
+    os.environ.setdefault("WARM_UP", "1")
+    # Workers publish their metrics here and /metrics on any of them sums them all
+    created_metrics_dir = None
+    if args.workers > 1:
+        if not os.environ.get("METRICS_DIR"):
+            os.environ["METRICS_DIR"] = created_metrics_dir = tempfile.mkdtemp(prefix="cryptopay-metrics-")
+        os.makedirs(os.environ["METRICS_DIR"], exist_ok=True)
+        # A previous run's counters would add to this one's
+        for stale in Path(os.environ["METRICS_DIR"]).glob("*.json"):
+            stale.unlink()
+    sys.path.insert(0, str(BACKEND_DIR))
+    # Fail once here rather than in every worker
+    from utils.settings import SettingsError, get_settings
+    try:
+        settings = get_settings()
+    except SettingsError as e:
+        sys.exit(str(e))
+    if settings.jwt_ephemeral_key and args.workers > 1:
+        sys.exit("JWT_EPHEMERAL_KEY=1 gives every worker its own signing key; put keys in JWT_KEYS_DIR or run --workers 1")
+    replica = settings.database_replica_path if settings.database_backend == "sqlite" else settings.database_replica_url
+    if replica and args.workers > 1 and not settings.rate_limit_redis_url:
+        print("A read replica without RATE_LIMIT_REDIS_URL: reads only follow writes made on the same worker")
+
+    try:
+        somaxconn = int(Path("/proc/sys/net/core/somaxconn").read_text())
+        if args.backlog > somaxconn:
+            print(f"--backlog {args.backlog} is capped by net.core.somaxconn ({somaxconn})")
+    except (OSError, ValueError):
+        pass
+
+    config = uvicorn.Config(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=args.loop,
+        http=args.http,
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        limit_concurrency=args.limit_concurrency,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+        access_log=args.access_log,
+        log_level=args.log_level,
+        server_header=False,
+    )
+    print(f"Serving on {args.host}:{args.port} with {args.workers} worker(s), {args.loop} + {args.http}")
+    server = Server(config)
+    if args.workers > 1:
+        supervisor = Supervisor(config, target=server.run, sockets=[config.bind_socket()])
+        supervisor.run()
+        if created_metrics_dir:
+            shutil.rmtree(created_metrics_dir, ignore_errors=True)
+        if supervisor.failed:
+            sys.exit(1)
+    else:
+        server.run()
+
+
+if __name__ == "__main__":
+    main()
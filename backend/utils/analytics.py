@@ -0,0 +1,322 @@
+"""Revenue analytics over a merchant's whole invoice history.
+
+Each merchant gets an in-memory columnar snapshot of invoice facts: one
+compact ``array`` per column (status, amount, customer, created/issued/paid
+times), one slot per invoice. The first request loads it with one query over
+both storage tiers; later requests fetch only the invoices updated since the
+snapshot's cursor and patch their slots in place. Aggregations run over
+whole columns, vectorized with numpy when it is installed (numpy reads the
+arrays without copying them), with plain loops otherwise; both give the
+same results. Results are cached until the snapshot changes.
+"""
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional speedup
+    np = None
+
+from utils.metrics import record_cache
+from utils.money import from_units, row_units
+from utils.models import InvoiceStatus
+
+FACT_COLUMNS = "id,status,customer_email,total_usdc,total_usdc_units,created_at,issued_at,paid_at,updated_at"
+STATUSES = tuple(status.value for status in InvoiceStatus)
+PAID = STATUSES.index(InvoiceStatus.PAID.value)
+INTERVALS = ("day", "week", "month")
+# Upper bounds (seconds) of the time-to-pay histogram buckets; one more bucket holds the rest
+TIME_TO_PAY_BUCKETS = (60, 300, 900, 3600, 6 * 3600, 86400, 3 * 86400, 7 * 86400)
+# Changes committed out of updated_at order are caught by re-reading this far back
+CURSOR_OVERLAP = 5
+# Reload from scratch now and then, in case a change slipped past the cursor anyway
+SNAPSHOT_MAX_AGE = 3600
+MAX_SNAPSHOTS = 256
+MAX_CACHED_RESULTS = 64
+MISSING = -1.0
+EPOCH = date(1970, 1, 1)
+
+
+def _epoch(value) -> float:
+    if not value:
+        return MISSING
+    moment = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _bucket_start(interval: str, key: int) -> str:
+    if interval == "month":
+        return date(1970 + key // 12, key % 12 + 1, 1).isoformat()
+    if interval == "week":
+        # Week keys count Mondays; 1970-01-01 was a Thursday
+        return (EPOCH + timedelta(days=key * 7 - 3)).isoformat()
+    return (EPOCH + timedelta(days=key)).isoformat()
+
+
+class Snapshot:
+    """Columnar invoice facts for one merchant"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.positions: Dict[str, int] = {}
+        self.customers: List[Optional[str]] = []
+        self.customer_codes: Dict[Optional[str], int] = {}
+        self.status = array("b")
+        self.amount = array("q")
+        self.customer = array("q")
+        self.created = array("d")
+        self.issued = array("d")
+        self.paid = array("d")
+        self.cursor: Optional[str] = None
+        self.cursor_epoch = MISSING
+        self.loaded_at = time.monotonic()
+        self.results: OrderedDict = OrderedDict()
+
+    @property
+    def columns(self) -> tuple:
+        return self.status, self.amount, self.customer, self.created, self.issued, self.paid
+
+    @property
+    def version(self) -> Tuple[int, Optional[str]]:
+        """(invoice count, max updated_at): what the list endpoints' ETag probe returns"""
+        return len(self.status), self.cursor
+
+    def since(self) -> Optional[str]:
+        if self.cursor is None:
+            return None
+        return datetime.fromtimestamp(self.cursor_epoch - CURSOR_OVERLAP, timezone.utc).isoformat()
+
+    def _customer_code(self, email: Optional[str]) -> int:
+        code = self.customer_codes.get(email)
+        if code is None:
+            code = self.customer_codes[email] = len(self.customers)
+            self.customers.append(email)
+        return code
+
+    def apply(self, rows: List[dict]) -> None:
+        """Add new invoices and patch changed ones; drops cached results if anything changed"""
+        changed = False
+        for row in rows:
+            facts = (
+                STATUSES.index(row["status"]),
+                row_units(row, "total_usdc"),
+                self._customer_code(row.get("customer_email")),
+                _epoch(row.get("created_at")),
+                _epoch(row.get("issued_at")),
+                _epoch(row.get("paid_at")),
+            )
+            position = self.positions.get(row["id"])
+            if position is None:
+                self.positions[row["id"]] = len(self.status)
+                for column, value in zip(self.columns, facts):
+                    column.append(value)
+                changed = True
+            elif tuple(column[position] for column in self.columns) != facts:
+                for column, value in zip(self.columns, facts):
+                    column[position] = value
+                changed = True
+            updated = _epoch(row.get("updated_at"))
+            if updated > self.cursor_epoch:
+                self.cursor, self.cursor_epoch = row["updated_at"], updated
+        if changed:
+            self.results.clear()
+
+    def query(self, interval: str = "day", utc_offset: int = 0, from_date: Optional[date] = None,
+              to_date: Optional[date] = None, top: int = 10) -> dict:
+        """Aggregations for one parameter set, from the result cache when the snapshot hasn't changed"""
+        key = (interval, utc_offset, from_date, to_date, top)
+        with self.lock:
+            result = self.results.get(key)
+            record_cache("analytics", result is not None)
+            if result is None:
+                result = _report(self, interval, utc_offset, from_date, to_date, top)
+                self.results[key] = result
+                while len(self.results) > MAX_CACHED_RESULTS:
+                    self.results.popitem(last=False)
+            return result
+
+
+_snapshots: "OrderedDict[str, Snapshot]" = OrderedDict()
+_snapshots_lock = threading.Lock()
+
+
+def refresh_snapshot(merchant_email: str, invoices) -> Snapshot:
+    """The merchant's snapshot, brought up to date with one query for the invoices changed since the last call"""
+    with _snapshots_lock:
+        snapshot = _snapshots.pop(merchant_email, None) or Snapshot()
+        _snapshots[merchant_email] = snapshot
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+    with snapshot.lock:
+        if time.monotonic() - snapshot.loaded_at > SNAPSHOT_MAX_AGE:
+            snapshot.reset()
+        snapshot.apply(invoices.list_changed(merchant_email, snapshot.since(), FACT_COLUMNS))
+    return snapshot
+
+
+def _bounds(utc_offset: int, from_date: Optional[date], to_date: Optional[date]) -> Tuple[float, float]:
+    """[start, end) in epoch seconds for local dates ``utc_offset`` minutes east of UTC"""
+    shift = timedelta(minutes=utc_offset)
+    start = datetime.combine(from_date, datetime.min.time(), timezone.utc) - shift if from_date else None
+    end = datetime.combine(to_date + timedelta(days=1), datetime.min.time(), timezone.utc) - shift if to_date else None
+    return (start.timestamp() if start else 0.0), (end.timestamp() if end else math.inf)
+
+
+def _percentile(ordered, fraction: float) -> float:
+    """Nearest-rank percentile of a sorted sequence, in whole milliseconds like the mean"""
+    if not len(ordered):
+        return 0.0
+    return round(float(ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]), 3)
+
+
+def _aggregate_numpy(snapshot: Snapshot, interval: str, utc_offset: int, start: float, end: float, top: int) -> dict:
+    status = np.frombuffer(snapshot.status, dtype=np.int8)
+    amount = np.frombuffer(snapshot.amount, dtype=np.int64)
+    customer = np.frombuffer(snapshot.customer, dtype=np.int64)
+    created = np.frombuffer(snapshot.created, dtype=np.float64)
+    issued = np.frombuffer(snapshot.issued, dtype=np.float64)
+    paid_at = np.frombuffer(snapshot.paid, dtype=np.float64)
+
+    statuses = np.bincount(status[(created >= start) & (created < end)], minlength=len(STATUSES))
+
+    paid = (status == PAID) & (paid_at >= start) & (paid_at < end)
+    amounts = amount[paid]
+    days = np.floor_divide(paid_at[paid] + utc_offset * 60, 86400).astype(np.int64)
+    if interval == "month":
+        keys = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    elif interval == "week":
+        keys = np.floor_divide(days + 3, 7)
+    else:
+        keys = days
+    periods, inverse = np.unique(keys, return_inverse=True)
+    period_units = np.zeros(len(periods), dtype=np.int64)
+    np.add.at(period_units, inverse, amounts)
+    period_counts = np.bincount(inverse, minlength=len(periods))
+
+    customers, inverse = np.unique(customer[paid], return_inverse=True)
+    customer_units = np.zeros(len(customers), dtype=np.int64)
+    np.add.at(customer_units, inverse, amounts)
+    customer_counts = np.bincount(inverse, minlength=len(customers))
+    ranked = np.lexsort((-customer_counts, -customer_units))[:top]
+
+    timed = paid & (issued >= 0)
+    durations = np.sort(paid_at[timed] - issued[timed])
+    histogram = np.bincount(np.searchsorted(TIME_TO_PAY_BUCKETS, durations, side="left"),
+                            minlength=len(TIME_TO_PAY_BUCKETS) + 1)
+    return {
+        "statuses": statuses.tolist(),
+        "paid": int(paid.sum()),
+        "units": int(amounts.sum()),
+        "periods": list(zip(periods.tolist(), period_counts.tolist(), period_units.tolist())),
+        "customers": [(int(customers[i]), int(customer_counts[i]), int(customer_units[i])) for i in ranked],
+        "durations": durations,
+        "total_duration": float(durations.sum()),
+        "histogram": histogram.tolist(),
+    }
+
+
+def _aggregate_python(snapshot: Snapshot, interval: str, utc_offset: int, start: float, end: float, top: int) -> dict:
+    statuses = [0] * len(STATUSES)
+    periods: Dict[int, List[int]] = {}
+    customers: Dict[int, List[int]] = {}
+    durations = []
+    paid = units = 0
+    for status, amount, customer, created, issued, paid_at in zip(*snapshot.columns):
+        if start <= created < end:
+            statuses[status] += 1
+        if status != PAID or not start <= paid_at < end:
+            continue
+        paid += 1
+        units += amount
+        day = int((paid_at + utc_offset * 60) // 86400)
+        if interval == "month":
+            moment = EPOCH + timedelta(days=day)
+            key = (moment.year - 1970) * 12 + moment.month - 1
+        elif interval == "week":
+            key = (day + 3) // 7
+        else:
+            key = day
+        period = periods.setdefault(key, [0, 0])
+        period[0] += 1
+        period[1] += amount
+        totals = customers.setdefault(customer, [0, 0])
+        totals[0] += 1
+        totals[1] += amount
+        if issued >= 0:
+            durations.append(paid_at - issued)
+    durations.sort()
+    histogram = [0] * (len(TIME_TO_PAY_BUCKETS) + 1)
+    for duration in durations:
+        histogram[bisect_left(TIME_TO_PAY_BUCKETS, duration)] += 1
+    ranked = sorted(customers.items(), key=lambda item: (-item[1][1], -item[1][0], item[0]))[:top]
+    return {
+        "statuses": statuses,
+        "paid": paid,
+        "units": units,
+        "periods": [(key, count, total) for key, (count, total) in sorted(periods.items())],
+        "customers": [(code, count, total) for code, (count, total) in ranked],
+        "durations": durations,
+        "total_duration": math.fsum(durations),
+        "histogram": histogram,
+    }
+
+
+def _report(snapshot: Snapshot, interval: str, utc_offset: int, from_date: Optional[date],
+            to_date: Optional[date], top: int) -> dict:
+    start, end = _bounds(utc_offset, from_date, to_date)
+    aggregate = _aggregate_numpy if np is not None else _aggregate_python
+    totals = aggregate(snapshot, interval, utc_offset, start, end, top)
+    durations = totals["durations"]
+    average_units = totals["units"] // totals["paid"] if totals["paid"] else 0
+    return {
+        "interval": interval,
+        "from_date": from_date.isoformat() if from_date else None,
+        "to_date": to_date.isoformat() if to_date else None,
+        "status_counts": {status: count for status, count in zip(STATUSES, totals["statuses"])},
+        "paid_invoices": totals["paid"],
+        "revenue_usdc": from_units(totals["units"]),
+        "revenue_usdc_units": totals["units"],
+        "average_ticket_usdc": from_units(average_units),
+        "average_ticket_usdc_units": average_units,
+        "revenue": [
+            {
+                "period": _bucket_start(interval, key),
+                "invoices": count,
+                "revenue_usdc": from_units(units),
+                "revenue_usdc_units": units,
+                "average_ticket_usdc": from_units(units // count),
+            }
+            for key, count, units in totals["periods"]
+        ],
+        "time_to_pay": {
+            "count": len(durations),
+            "mean_seconds": round(totals["total_duration"] / len(durations), 3) if len(durations) else 0.0,
+            "p50_seconds": _percentile(durations, 0.5),
+            "p90_seconds": _percentile(durations, 0.9),
+            "p99_seconds": _percentile(durations, 0.99),
+            "histogram": [
+                {"le_seconds": bound, "count": count}
+                for bound, count in zip((*TIME_TO_PAY_BUCKETS, None), totals["histogram"])
+            ],
+        },
+        "top_customers": [
+            {
+                "customer_email": snapshot.customers[code],
+                "invoices": count,
+                "revenue_usdc": from_units(units),
+                "revenue_usdc_units": units,
+            }
+            for code, count, units in totals["customers"]
+        ],
+    }
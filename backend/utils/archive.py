@@ -0,0 +1,41 @@
+"""Archival of old terminal invoices to the cold tier (invoices_archive).
+
+CANCELED, EXPIRED and PAID invoices whose e-invoice was SENT move out of the
+hot ``invoices`` table once they haven't changed for INVOICE_ARCHIVE_DAYS,
+in batches of ARCHIVE_BATCH_SIZE, one transaction each. A merchant's
+invoice detail, lists, ETags and exports read both tiers, so the API is
+unchanged; the hot table and its indexes only hold the rows the payment,
+expiry and e-invoice paths still work on.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from utils.database import get_repositories
+from utils.metrics import invoices_archived
+
+ARCHIVE_BATCH_SIZE = 500
+
+
+def archive_invoices(days: int, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Archive every eligible invoice unchanged for ``days``; returns how many moved"""
+    before = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    invoices = get_repositories().invoices
+    total = 0
+    while True:
+        moved = invoices.archive(before, batch_size)
+        invoices_archived.inc(amount=moved)
+        total += moved
+        if moved < batch_size:
+            return total
+
+
+async def run_archiver(days: int, interval: float) -> None:
+    """Archive every ``interval`` seconds until cancelled"""
+    while True:
+        try:
+            moved = await asyncio.to_thread(archive_invoices, days)
+            if moved:
+                print(f"Archived {moved} invoices")
+        except Exception as e:
+            print(f"Invoice archival failed: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,197 @@
+"""gzip/brotli response compression.
+
+Like Starlette's GZipMiddleware, but negotiates brotli when the client
+accepts it and the optional ``brotli`` package is installed, skips bodies
+under ``minimum_size`` and never touches event streams, which must reach
+the client unbuffered. Streaming bodies (the invoice export) are compressed
+chunk by chunk with a sync flush so the client keeps receiving data.
+"""
+import zlib
+from typing import Optional, Sequence
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+ETAG_ENCODING_SUFFIXES = ("-br", "-gzip")
+
+
+class GzipCompressor:
+    encoding = "gzip"
+
+    def __init__(self, level: int):
+        # wbits=31 -> gzip container
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    encoding = "br"
+
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def accepted_encodings(header: str) -> dict:
+    """Parse Accept-Encoding into {coding: q}"""
+    encodings = {}
+    for part in header.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[coding.strip()] = q
+    return encodings
+
+
+def choose_encoding(header: str) -> Optional[str]:
+    encodings = accepted_encodings(header)
+    wildcard = encodings.get("*", 0.0)
+    candidates = ("br", "gzip") if brotli is not None else ("gzip",)
+    best, best_q = None, 0.0
+    for coding in candidates:
+        q = encodings.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        excluded_media_types: Sequence[str] = ("text/event-stream",),
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.excluded_media_types = tuple(excluded_media_types)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+            if encoding is not None:
+                responder = CompressionResponder(self.app, self, encoding)
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+    def compressor(self, encoding: str):
+        if encoding == "br":
+            return BrotliCompressor(self.brotli_quality)
+        return GzipCompressor(self.gzip_level)
+
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, middleware: CompressionMiddleware, encoding: str) -> None:
+        self.app = app
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send: Optional[Send] = None
+        self.initial_message: Message = {}
+        self.started = False
+        self.passthrough = False
+        self.compressor = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    def _should_skip(self) -> bool:
+        status = self.initial_message["status"]
+        if status < 200 or status in (204, 304):
+            return True
+        headers = Headers(raw=self.initial_message["headers"])
+        if "content-encoding" in headers:
+            return True
+        content_type = headers.get("content-type", "")
+        return content_type.startswith(self.middleware.excluded_media_types)
+
+    def _start_compressed(self, streaming: bool) -> None:
+        self.compressor = self.middleware.compressor(self.encoding)
+        headers = MutableHeaders(raw=self.initial_message["headers"])
+        headers["Content-Encoding"] = self.compressor.encoding
+        headers.add_vary_header("Accept-Encoding")
+        etag = headers.get("etag")
+        if etag and etag.endswith('"') and not etag.startswith("W/"):
+            # A strong validator must differ per content-coding
+            headers["ETag"] = f'{etag[:-1]}-{self.compressor.encoding}"'
+        if streaming:
+            del headers["Content-Length"]
+
+    async def send_compressed(self, message: Message) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            # Hold the headers until the first body chunk tells us the size
+            self.initial_message = message
+            self.passthrough = self._should_skip()
+            return
+
+        if message_type != "http.response.body":
+            await self.send(message)
+            return
+
+        if self.passthrough:
+            if not self.started:
+                self.started = True
+                await self.send(self.initial_message)
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if not self.started:
+            self.started = True
+            if not more_body and len(body) < self.middleware.minimum_size:
+                MutableHeaders(raw=self.initial_message["headers"]).add_vary_header("Accept-Encoding")
+                await self.send(self.initial_message)
+                await self.send(message)
+                self.passthrough = True
+                return
+            self._start_compressed(streaming=more_body)
+            if not more_body:
+                body = self.compressor.compress(body) + self.compressor.finish()
+                MutableHeaders(raw=self.initial_message["headers"])["Content-Length"] = str(len(body))
+                message["body"] = body
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+            await self.send(self.initial_message)
+
+        if more_body:
+            message["body"] = self.compressor.compress(body) + self.compressor.flush()
+        else:
+            message["body"] = self.compressor.compress(body) + self.compressor.finish()
+        await self.send(message)
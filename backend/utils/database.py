@@ -0,0 +1,169 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Dict, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.metrics import instrument_http_client
+from utils.rate_limit import bearer_merchant, get_redis_store, redis
+from utils.settings import Settings, get_settings
+from utils.singleflight import reads
+from utils.tracing import trace_http_client
+
+READ_PRIMARY_PREFIX = "read_primary:"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Merchant emails and invoice ids written by this process -> monotonic time their reads may use the replica again
+_recent_writes: Dict[str, float] = {}
+# Set for requests from a merchant who wrote recently through any worker; see ReadYourWritesMiddleware
+_read_primary: ContextVar[bool] = ContextVar("read_primary", default=False)
+_store_failed_at = 0.0
+
+
+@lru_cache(maxsize=4)
+def _client_for(url: str, key: str):
+    from supabase import create_client
+
+    client = create_client(url, key)
+    # Time and trace every PostgREST call by table and operation
+    instrument_http_client(client.postgrest.session)
+    trace_http_client(client.postgrest.session)
+    return client
+
+
+def get_supabase_client():
+    """Shared Supabase client for the current settings (rebuilt after a reload changes them)"""
+    settings = get_settings()
+    return _client_for(settings.database_url, settings.database_apikey)
+
+
+def get_replica_client():
+    """Supabase client for the read replica's API (DATABASE_REPLICA_URL)"""
+    settings = get_settings()
+    return _client_for(settings.database_replica_url, settings.database_apikey)
+
+
+@lru_cache(maxsize=2)
+def _repositories_for(backend: str, path: str):
+    if backend == "sqlite":
+        from repositories.sqlite_backend import sqlite_repositories
+        return sqlite_repositories(path)
+    from repositories.supabase_backend import supabase_repositories
+    return supabase_repositories()
+
+
+def get_repositories():
+    """Invoice, company, credential and outbox repositories for the configured DATABASE_BACKEND"""
+    settings = get_settings()
+    return _repositories_for(settings.database_backend, settings.database_path)
+
+
+def _replica(settings: Settings) -> Optional[str]:
+    return settings.database_replica_path if settings.database_backend == "sqlite" else settings.database_replica_url
+
+
+@lru_cache(maxsize=2)
+def _replica_repositories_for(backend: str, path: str, replica: str):
+    if backend == "sqlite":
+        from repositories.sqlite_backend import sqlite_repositories
+        # The writer creates and migrates the file before a read-only connection opens it
+        _repositories_for(backend, path)
+        return sqlite_repositories(replica, readonly=True)
+    from repositories.supabase_backend import supabase_repositories
+    return supabase_repositories(get_replica_client)
+
+
+def note_write(*keys: Optional[str]) -> None:
+    """Send reads for these merchant emails / invoice ids to the primary for DATABASE_REPLICA_STICKY seconds"""
+    # Reads starting from now don't join a call that may have fetched the old rows
+    reads.forget(*(key for key in keys if key))
+    settings = get_settings()
+    if not _replica(settings):
+        return
+    now = time.monotonic()
+    if len(_recent_writes) > 10000:
+        for key, until in list(_recent_writes.items()):
+            if until <= now:
+                _recent_writes.pop(key, None)
+    for key in keys:
+        if key:
+            _recent_writes[key] = now + settings.database_replica_sticky
+
+
+def get_read_repositories(*keys: Optional[str]):
+    """Repositories for pure reads: the replica, unless none is configured or the caller wrote recently
+
+    ``keys`` are the merchant email and/or invoice id the read is about; a
+    write noted for any of them in this process, or a write by the same
+    merchant through any worker, keeps the read on the primary.
+    """
+    settings = get_settings()
+    replica = _replica(settings)
+    if not replica or _read_primary.get():
+        return get_repositories()
+    now = time.monotonic()
+    if any(_recent_writes.get(key, 0) > now for key in keys if key):
+        return get_repositories()
+    return _replica_repositories_for(settings.database_backend, settings.database_path, replica)
+
+
+class ReadYourWritesMiddleware:
+    """Pure ASGI middleware keeping a merchant's reads on the primary right after their writes
+
+    A successful POST/PUT/PATCH/DELETE with a merchant's bearer token marks
+    that merchant for DATABASE_REPLICA_STICKY seconds in the Redis store the
+    rate limiter uses (RATE_LIMIT_REDIS_URL); their requests read from the
+    primary while the mark lasts, whichever worker serves them, so a
+    dashboard refresh after emit or cancel never shows the replica's stale
+    copy. The mark is server-side and expires on its own, so no client can
+    extend it. Without Redis only writes noted in this process count (see
+    ``note_write``). Does nothing while no replica is configured.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        settings = get_settings()
+        sticky = settings.database_replica_sticky
+        if scope["type"] != "http" or not _replica(settings) or sticky <= 0:
+            await self.app(scope, receive, send)
+            return
+        store = get_redis_store()
+        merchant = bearer_merchant(scope) if store is not None else None
+        if merchant is None:
+            await self.app(scope, receive, send)
+            return
+
+        key = READ_PRIMARY_PREFIX + merchant
+        token = None
+        if _recent_writes.get(merchant, 0) <= time.monotonic() and await _shared(store.client.exists(key)):
+            token = _read_primary.set(True)
+        writes = scope["method"] not in SAFE_METHODS
+
+        async def send_wrapper(message: Message) -> None:
+            # Marked before the response leaves, so the client's next request already sees it
+            if writes and message["type"] == "http.response.start" and message["status"] < 400:
+                await _shared(store.client.set(key, 1, px=sticky * 1000))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if token is not None:
+                _read_primary.reset(token)
+
+
+async def _shared(call):
+    """Await a read-primary store call; on a Redis error log (at most once a minute) and return None"""
+    global _store_failed_at
+    try:
+        return await call
+    except (redis.RedisError, OSError, asyncio.TimeoutError) as e:
+        now = time.monotonic()
+        if now - _store_failed_at > 60:
+            print(f"Read-primary store unavailable, only this worker's writes count: {e}")
+        _store_failed_at = now
+        return None
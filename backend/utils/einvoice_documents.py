@@ -0,0 +1,121 @@
+"""Document-generation stage of the e-invoice pipeline.
+
+Turns (invoice, merchant) pairs into signed comprobantes ready for
+recepción: computes the clave de acceso, streams the factura XML and signs
+it (XAdES-BES) when SRI_CERT_PATH is set. RSA signing is CPU-bound, so
+batches are split across a process pool of EINVOICE_SIGN_WORKERS processes;
+each one parses the certificate once and keeps it. With zero workers the
+stage runs in a thread instead.
+"""
+import asyncio
+import base64
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+
+from utils.settings import get_settings
+from utils.sri_xml import build_invoice_xml, invoice_access_key
+from utils.xades import load_signer
+
+# Set per process by init_worker (the pool initializer)
+_cert_path: Optional[str] = None
+_cert_password: Optional[str] = None
+
+
+def init_worker(cert_path: Optional[str], cert_password: Optional[str]) -> None:
+    global _cert_path, _cert_password
+    _cert_path, _cert_password = cert_path, cert_password
+    if cert_path:
+        # Parse the PKCS#12 file before the first batch arrives
+        load_signer(cert_path, cert_password)
+
+
+def generate_document(invoice: dict, merchant: dict, environment: int) -> dict:
+    """Access key and base64 XML (signed if a certificate is configured) for one invoice"""
+    key = invoice_access_key(invoice, merchant, environment)
+    xml = build_invoice_xml(invoice, merchant, key, environment)
+    if _cert_path:
+        xml = load_signer(_cert_path, _cert_password).sign(xml)
+    return {
+        "invoice_id": invoice["invoice_id"],
+        "access_key": key,
+        "xml": base64.b64encode(xml).decode("ascii")
+    }
+
+
+def generate_batch(pairs: List[Tuple[dict, dict]], environment: int) -> List[dict]:
+    """Generate many documents; a document that can't be built carries an ``error`` instead"""
+    documents = []
+    for invoice, merchant in pairs:
+        try:
+            documents.append(generate_document(invoice, merchant, environment))
+        except Exception as e:
+            documents.append({"invoice_id": invoice["invoice_id"], "error": f"{type(e).__name__}: {e}"})
+    return documents
+
+
+class DocumentGenerator:
+    def __init__(self):
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_config = None
+
+    def _executor(self) -> Optional[ProcessPoolExecutor]:
+        settings = get_settings()
+        config = (settings.einvoice_sign_workers, settings.sri_cert_path, settings.sri_cert_password)
+        if config != self._pool_config:
+            # First use, or a settings reload changed the certificate or pool size
+            self.shutdown()
+            self._pool_config = config
+            if settings.einvoice_sign_workers:
+                self._pool = ProcessPoolExecutor(
+                    settings.einvoice_sign_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=init_worker,
+                    initargs=(settings.sri_cert_path, settings.sri_cert_password)
+                )
+            else:
+                init_worker(settings.sri_cert_path, settings.sri_cert_password)
+        return self._pool
+
+    async def generate(self, pairs: List[Tuple[dict, dict]]) -> List[dict]:
+        """Documents for ``pairs``, in order, generated in parallel across the pool"""
+        if not pairs:
+            return []
+        environment = get_settings().sri_environment
+        pool = self._executor()
+        if pool is None:
+            return await asyncio.to_thread(generate_batch, pairs, environment)
+
+        # One chunk per process keeps pickling overhead to a few round trips
+        workers = self._pool_config[0]
+        size = -(-len(pairs) // workers)
+        loop = asyncio.get_running_loop()
+        try:
+            chunks = await asyncio.gather(*(
+                loop.run_in_executor(pool, generate_batch, pairs[start:start + size], environment)
+                for start in range(0, len(pairs), size)
+            ))
+        except BrokenProcessPool:
+            # A worker died (OOM, segfault); start a fresh pool next time
+            self.shutdown()
+            raise
+        return [document for chunk in chunks for document in chunk]
+
+    def warm_up(self) -> None:
+        """Start the signing processes and load the certificate now rather than on the first batch"""
+        pool = self._executor()
+        if pool is not None:
+            # One task per process: the pool only spawns processes as work arrives
+            for future in [pool.submit(os.getpid) for _ in range(self._pool_config[0])]:
+                future.result()
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self._pool_config = None
+
+
+documents = DocumentGenerator()
@@ -0,0 +1,391 @@
+"""Two-phase SRI e-invoice pipeline.
+
+SRI separates receipt from authorization, so e-invoices move
+PENDING -> SUBMITTED -> SENT (authorized) or FAILED:
+
+1. Submission: paid invoices with a PENDING e-invoice are leased in bulk
+   (``claim_einvoices``, FOR UPDATE SKIP LOCKED), turned into signed XML
+   comprobantes on a process pool (``utils.einvoice_documents``) and sent
+   to the provider in batches of ``SRI_BATCH_SIZE`` documents per request.
+2. Authorization: SUBMITTED documents are polled for many access keys per
+   request (``SRI_AUTH_BATCH_SIZE``). A document still in process is leased
+   again and re-checked after ``EINVOICE_AUTH_RECHECK`` seconds.
+
+A FAILED e-invoice is retried automatically: each failure bumps
+``einvoice_attempts`` and schedules ``einvoice_next_attempt_at`` with
+exponential backoff and jitter, and due ones are leased by
+``claim_due_einvoices`` and resubmitted. After ``EINVOICE_MAX_ATTEMPTS``
+failures it is dead-lettered (DEAD) until a merchant retries it by hand.
+While the provider is unavailable nothing counts as a failure; leased
+invoices are held back for ``DEFER_SECONDS`` instead of being retried on
+every tick.
+
+Each phase writes its results back with a single ``update_einvoices`` call
+(see migrations/002_einvoice_pipeline.sql and 004_einvoice_retries.sql).
+Any number of workers can run the pipeline; leases keep them from working
+on the same rows.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from utils.database import get_repositories
+from utils.einvoice_documents import documents as document_generator
+from utils.jobs import backoff_seconds
+from utils.models import EInvoiceStatus
+from utils.settings import get_settings
+from utils.sri_client import SRIClient, SRIError, get_sri_client
+from utils.sri_xml import invoice_number
+from utils.tracing import span
+
+# Seconds a claimed PENDING invoice stays leased while it is being submitted
+SUBMIT_LEASE_SECONDS = 120
+# Wait before the first authorization check of a freshly submitted document
+FIRST_AUTH_CHECK_SECONDS = 3
+# Backoff between automatic retries of a FAILED e-invoice
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 6 * 3600
+# How long invoices stay leased when the provider is unavailable
+DEFER_SECONDS = 30
+
+RECEIVED = "RECIBIDA"
+RETURNED = "DEVUELTA"
+AUTHORIZED = "AUTORIZADO"
+NOT_AUTHORIZED = "NO AUTORIZADO"
+
+
+def _messages(result: dict) -> str:
+    return "; ".join(str(message) for message in result.get("mensajes") or []) or result.get("estado", "")
+
+
+class MockSRIProvider:
+    """In-process provider for SRI_MODE=mock: receives everything, authorizes on first poll"""
+
+    async def submit(self, documents: List[dict]) -> List[dict]:
+        return [
+            {"invoice_id": document["invoice_id"], "access_key": document["access_key"], "estado": RECEIVED}
+            for document in documents
+        ]
+
+    async def authorize(self, access_keys: List[str]) -> List[dict]:
+        now = datetime.now(timezone.utc).isoformat()
+        return [
+            {"access_key": key, "estado": AUTHORIZED, "numero_autorizacion": key, "fecha_autorizacion": now}
+            for key in access_keys
+        ]
+
+
+class LiveSRIProvider:
+    """Provider API at SRI_ENDPOINT: POST /recepcion and POST /autorizacion"""
+
+    def __init__(self, base_url: str, client: Optional[SRIClient] = None):
+        self.base_url = base_url.rstrip("/")
+        self.client = client
+
+    async def submit(self, documents: List[dict]) -> List[dict]:
+        client = self.client or get_sri_client()
+        response = await client.post({"comprobantes": documents}, f"{self.base_url}/recepcion")
+        return response["comprobantes"]
+
+    async def authorize(self, access_keys: List[str]) -> List[dict]:
+        client = self.client or get_sri_client()
+        response = await client.post({"claves_acceso": access_keys}, f"{self.base_url}/autorizacion")
+        return response["autorizaciones"]
+
+
+def get_provider():
+    settings = get_settings()
+    if settings.sri_mode == "live":
+        return LiveSRIProvider(settings.sri_endpoint)
+    return MockSRIProvider()
+
+
+def _chunks(values: list, size: int):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class EInvoicePipeline:
+    def __init__(self):
+        self.stats = {
+            "submitted": 0,
+            "returned": 0,
+            "authorized": 0,
+            "rejected": 0,
+            "deferred": 0,
+            "retried": 0,
+            "dead": 0,
+            "submit_requests": 0,
+            "authorization_requests": 0,
+            "last_tick_at": None,
+            "last_tick_seconds": None,
+        }
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, interval: float) -> "EInvoicePipeline":
+        self._stopping = False
+        self._task = asyncio.create_task(self.run(interval))
+        return self
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Let the pass in progress finish, for up to ``timeout`` seconds, and stop"""
+        self._stopping = True
+        self._wake.set()
+        if self._task:
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except asyncio.TimeoutError:
+                # Cancelled mid-pass: claimed invoices are leased and another worker takes them over
+                pass
+            self._task = None
+
+    def wake(self) -> None:
+        """Run the next tick now instead of waiting for the interval"""
+        self._wake.set()
+
+    # --- database ---
+
+    def _claim(self, status: str, limit: int, lease_seconds: int) -> List[dict]:
+        return get_repositories().invoices.claim_einvoices(status, limit, lease_seconds)
+
+    def _claim_due(self, limit: int) -> List[dict]:
+        return get_repositories().invoices.claim_due_einvoices(limit, SUBMIT_LEASE_SECONDS)
+
+    def apply_changes(self, rows: List[dict]) -> None:
+        if rows:
+            get_repositories().invoices.update_einvoices(rows)
+
+    def _merchants(self, emails) -> Dict[str, dict]:
+        return get_repositories().companies.find_many(emails)
+
+    # --- phase 1: submission ---
+
+    def _failed(self, invoice: dict, error: str, now: datetime) -> dict:
+        """FAILED with the next retry scheduled, or DEAD once attempts run out"""
+        attempts = (invoice.get("einvoice_attempts") or 0) + 1
+        change = {
+            "id": invoice["id"],
+            "einvoice_status": EInvoiceStatus.FAILED.value,
+            "einvoice_error": error,
+            "einvoice_attempts": attempts,
+            "einvoice_next_attempt_at": None,
+            "einvoice_locked_until": None,
+            "updated_at": now.isoformat()
+        }
+        if attempts >= get_settings().einvoice_max_attempts:
+            self.stats["dead"] += 1
+            change["einvoice_status"] = EInvoiceStatus.DEAD.value
+            print(f"E-invoice for {invoice['invoice_id']} dead-lettered after {attempts} attempts: {error}")
+        else:
+            delay = backoff_seconds(attempts, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS)
+            change["einvoice_next_attempt_at"] = (now + timedelta(seconds=delay)).isoformat()
+        return change
+
+    async def submit_invoices(self, invoices: List[dict], merchants: Optional[Dict[str, dict]] = None) -> List[dict]:
+        """Generate, sign and submit invoices in provider-sized batches; returns the per-invoice state changes"""
+        settings = get_settings()
+        provider = get_provider()
+        if merchants is None:
+            merchants = await asyncio.to_thread(self._merchants, {invoice["merchant_email"] for invoice in invoices})
+
+        changes = []
+        now = datetime.now(timezone.utc)
+        pairs = []
+        for invoice in invoices:
+            merchant = merchants.get(invoice["merchant_email"])
+            if merchant is None:
+                changes.append(self._failed(invoice, "Merchant details not found", now))
+            else:
+                pairs.append((invoice, merchant))
+
+        by_invoice_id = {invoice["invoice_id"]: invoice for invoice, _ in pairs}
+        ready = []
+        with span("einvoice.generate", attributes={"einvoice.documents": len(pairs)}):
+            generated = await document_generator.generate(pairs)
+        for document in generated:
+            if "error" in document:
+                changes.append(self._failed(by_invoice_id[document["invoice_id"]], document["error"], now))
+            else:
+                ready.append(document)
+
+        size = settings.sri_batch_size
+        for start in range(0, len(ready), size):
+            batch = ready[start:start + size]
+            try:
+                results = await provider.submit(batch)
+            except SRIError as e:
+                now = datetime.now(timezone.utc)
+                if not e.retryable:
+                    # The provider rejected the whole request
+                    changes.extend(self._failed(by_invoice_id[document["invoice_id"]], str(e), now) for document in batch)
+                    continue
+                # Provider unavailable: hold this batch and the rest back
+                # without counting an attempt, so an outage doesn't burn
+                # retries or get hammered on every tick
+                remaining = ready[start:]
+                held_until = (now + timedelta(seconds=DEFER_SECONDS)).isoformat()
+                changes.extend(
+                    {"id": by_invoice_id[document["invoice_id"]]["id"], "einvoice_locked_until": held_until}
+                    for document in remaining
+                )
+                self.stats["deferred"] += len(remaining)
+                break
+            self.stats["submit_requests"] += 1
+
+            now = datetime.now(timezone.utc)
+            keys = {document["invoice_id"]: document["access_key"] for document in batch}
+            for result in results:
+                invoice = by_invoice_id.get(result.get("invoice_id"))
+                if invoice is None or invoice["invoice_id"] not in keys:
+                    continue
+                if result.get("estado") == RECEIVED:
+                    self.stats["submitted"] += 1
+                    changes.append({
+                        "id": invoice["id"],
+                        "einvoice_status": EInvoiceStatus.SUBMITTED.value,
+                        "einvoice_access_key": keys[invoice["invoice_id"]],
+                        "einvoice_error": None,
+                        "einvoice_submitted_at": now.isoformat(),
+                        "einvoice_next_attempt_at": None,
+                        "einvoice_locked_until": (now + timedelta(seconds=FIRST_AUTH_CHECK_SECONDS)).isoformat(),
+                        "updated_at": now.isoformat()
+                    })
+                else:
+                    self.stats["returned"] += 1
+                    changes.append(self._failed(invoice, _messages(result), now))
+        return changes
+
+    async def submit_pending(self, limit: int) -> int:
+        invoices = await asyncio.to_thread(self._claim, EInvoiceStatus.PENDING.value, limit, SUBMIT_LEASE_SECONDS)
+        if not invoices:
+            return 0
+        changes = await self.submit_invoices(invoices)
+        await asyncio.to_thread(self.apply_changes, changes)
+        return len(invoices)
+
+    async def retry_due(self, limit: int) -> int:
+        """Resubmit FAILED e-invoices whose backoff has elapsed"""
+        invoices = await asyncio.to_thread(self._claim_due, limit)
+        if not invoices:
+            return 0
+        self.stats["retried"] += len(invoices)
+        changes = await self.submit_invoices(invoices)
+        await asyncio.to_thread(self.apply_changes, changes)
+        return len(invoices)
+
+    # --- phase 2: authorization ---
+
+    async def poll_authorizations(self, limit: int) -> int:
+        settings = get_settings()
+        provider = get_provider()
+        invoices = await asyncio.to_thread(
+            self._claim, EInvoiceStatus.SUBMITTED.value, limit, settings.einvoice_auth_recheck
+        )
+        if not invoices:
+            return 0
+
+        by_key = {invoice["einvoice_access_key"]: invoice for invoice in invoices}
+        changes = []
+        for keys in _chunks(list(by_key), settings.sri_auth_batch_size):
+            try:
+                results = await provider.authorize(keys)
+            except SRIError as e:
+                print(f"SRI authorization check failed: {e}")
+                if not e.retryable:
+                    continue
+                # Leases expire on their own; these are checked again later
+                break
+            self.stats["authorization_requests"] += 1
+
+            now = datetime.now(timezone.utc)
+            for result in results:
+                invoice = by_key.get(result.get("access_key"))
+                if invoice is None:
+                    continue
+                if result.get("estado") == AUTHORIZED:
+                    self.stats["authorized"] += 1
+                    changes.append({
+                        "id": invoice["id"],
+                        "einvoice_status": EInvoiceStatus.SENT.value,
+                        "einvoice_authorization": result.get("numero_autorizacion"),
+                        "einvoice_number": invoice_number(invoice["einvoice_access_key"]),
+                        "einvoice_url": f"https://sri.gob.ec/einvoice/{invoice['invoice_id']}",
+                        "einvoice_authorized_at": result.get("fecha_autorizacion") or now.isoformat(),
+                        "einvoice_sent_at": now.isoformat(),
+                        "einvoice_locked_until": None,
+                        "updated_at": now.isoformat()
+                    })
+                elif result.get("estado") == NOT_AUTHORIZED:
+                    self.stats["rejected"] += 1
+                    changes.append(self._failed(invoice, _messages(result), now))
+                # Anything else (EN PROCESO): the lease is the next check time
+        await asyncio.to_thread(self.apply_changes, changes)
+        return len(invoices)
+
+    # --- scheduling ---
+
+    async def tick(self) -> dict:
+        settings = get_settings()
+        started = time.perf_counter()
+        before = dict(self.stats)
+        with span("einvoice.tick") as current:
+            claimed = await self.submit_pending(settings.sri_batch_size * 4)
+            retried = await self.retry_due(settings.sri_batch_size)
+            polled = await self.poll_authorizations(settings.sri_auth_batch_size * 4)
+            current.set_attribute("einvoice.claimed", claimed)
+            current.set_attribute("einvoice.retried", retried)
+            current.set_attribute("einvoice.polled", polled)
+        self.stats["last_tick_at"] = datetime.now(timezone.utc).isoformat()
+        self.stats["last_tick_seconds"] = round(time.perf_counter() - started, 3)
+        return {
+            "claimed": claimed,
+            "retried": retried,
+            "polled": polled,
+            **{key: self.stats[key] - before[key]
+               for key in ("submitted", "returned", "authorized", "rejected", "deferred", "dead")}
+        }
+
+    async def run(self, interval: float) -> None:
+        while not self._stopping:
+            try:
+                result = await self.tick()
+                busy = result["claimed"] or result["retried"] or result["polled"]
+            except Exception as e:
+                print(f"E-invoice pipeline tick failed: {e}")
+                busy = False
+            if busy:
+                # More work may be waiting; go again right away
+                await asyncio.sleep(0)
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def queue_metrics(self) -> dict:
+        """Queue depths and the age of the oldest item in each phase"""
+        now = datetime.now(timezone.utc)
+        queues = get_repositories().invoices.einvoice_queues(now.isoformat())
+
+        def age(oldest):
+            if not oldest:
+                return 0.0
+            oldest = datetime.fromisoformat(oldest.replace("Z", "+00:00"))
+            return round((now - oldest).total_seconds(), 1)
+
+        return {
+            "pending": queues["pending"],
+            "submitted": queues["submitted"],
+            "retry_due": queues["retry_due"],
+            "dead": queues["dead"],
+            "submission_lag_seconds": age(queues["oldest_paid_at"]),
+            "authorization_lag_seconds": age(queues["oldest_submitted_at"]),
+            "worker": dict(self.stats)
+        }
+
+
+pipeline = EInvoicePipeline()
@@ -0,0 +1,192 @@
+"""In-process fan-out of invoice status changes to Server-Sent Events streams.
+
+Topics are ``invoice:<id>`` (both the internal uuid and the public
+INV-... number) and ``merchant:<email>``. Each open stream owns a small
+bounded queue; publishing never blocks, and a subscriber that falls behind
+loses its oldest events (status events are snapshots, so the newest one is
+all a client needs). An idle connection costs one parked coroutine and an
+empty queue, so a worker holds thousands of them.
+
+Handlers publish the changes they make. Changes made by other workers or by
+code that doesn't publish are picked up by ``run_change_feed``: one query
+per worker every few seconds for rows whose ``updated_at`` moved, and only
+while someone is listening.
+
+A worker that is shutting down ends its streams (``close_streams``) so their
+connections drain; EventSource clients reconnect to another worker.
+"""
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Set
+
+from utils.database import get_repositories
+
+QUEUE_SIZE = 32
+# (id -> updated_at) already delivered, so the change feed skips local writes
+SEEN_SIZE = 10000
+CHANGE_FEED_BATCH = 500
+# Changes committed out of updated_at order are caught by re-reading this far back
+CHANGE_FEED_OVERLAP = 5
+# Returned by Subscription.get once the hub is closing
+CLOSED = object()
+
+
+def _parse_timestamp(value) -> Optional[datetime]:
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class Subscription:
+    def __init__(self, hub: "EventHub", topic: str):
+        self.hub = hub
+        self.topic = topic
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def put(self, event: dict) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        """Next event, or None after ``timeout`` seconds without one"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self) -> None:
+        self.hub.unsubscribe(self)
+
+
+class EventHub:
+    def __init__(self):
+        self._topics: Dict[str, Set[Subscription]] = {}
+        self._seen: "OrderedDict[str, datetime]" = OrderedDict()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing = False
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._topics.values())
+
+    def subscribe(self, topic: str) -> Subscription:
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(self, topic)
+        self._topics.setdefault(topic, set()).add(subscription)
+        if self._closing:
+            subscription.put(CLOSED)
+        return subscription
+
+    def close_streams(self) -> None:
+        """End every open stream, and any opened from now on, after the events already queued"""
+        self._closing = True
+        for subscribers in list(self._topics.values()):
+            for subscription in list(subscribers):
+                subscription.put(CLOSED)
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._topics.get(subscription.topic)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._topics[subscription.topic]
+
+    def _off_loop(self) -> bool:
+        """True when called from a thread other than the one running the streams"""
+        if self._loop is None:
+            return False
+        try:
+            return asyncio.get_running_loop() is not self._loop
+        except RuntimeError:
+            return True
+
+    def publish(self, topic: str, event: dict) -> None:
+        """Queue ``event`` for every subscriber of ``topic``; safe to call from worker threads"""
+        if self._off_loop():
+            self._loop.call_soon_threadsafe(self._deliver, topic, event)
+        else:
+            self._deliver(topic, event)
+
+    def _deliver(self, topic: str, event: dict) -> int:
+        subscribers = self._topics.get(topic, ())
+        for subscription in list(subscribers):
+            subscription.put(event)
+        return len(subscribers)
+
+    def _mark_seen(self, invoice: dict) -> bool:
+        """Record the row version; False if it was already delivered"""
+        updated_at = _parse_timestamp(invoice.get("updated_at"))
+        previous = self._seen.get(invoice["id"])
+        if previous is not None and updated_at is not None and previous >= updated_at:
+            return False
+        self._seen[invoice["id"]] = updated_at
+        self._seen.move_to_end(invoice["id"])
+        while len(self._seen) > SEEN_SIZE:
+            self._seen.popitem(last=False)
+        return True
+
+    def publish_invoice(self, invoice: dict) -> None:
+        """Publish an invoice status change to its invoice and merchant topics"""
+        if not self._topics:
+            return
+        if self._off_loop():
+            self._loop.call_soon_threadsafe(self.publish_invoice, invoice)
+            return
+        if not self._mark_seen(invoice):
+            return
+        event = invoice_event(invoice)
+        self.publish(f"invoice:{invoice['id']}", event)
+        if invoice.get("invoice_id"):
+            self.publish(f"invoice:{invoice['invoice_id']}", event)
+        if invoice.get("merchant_email"):
+            self.publish(f"merchant:{invoice['merchant_email']}", {**event, "merchant_email": invoice["merchant_email"]})
+
+    async def run_change_feed(self, interval: float) -> None:
+        """Poll for invoice changes made elsewhere while there are subscribers
+
+        Each poll re-reads the CHANGE_FEED_OVERLAP seconds before the cursor, so
+        a change committed after one with a later updated_at isn't skipped;
+        rows already delivered are dropped by ``_mark_seen``.
+        """
+        cursor = datetime.now(timezone.utc)
+        while True:
+            await asyncio.sleep(interval)
+            if not self._topics:
+                cursor = datetime.now(timezone.utc)
+                continue
+            try:
+                rows = await asyncio.to_thread(_changed_invoices, cursor - timedelta(seconds=CHANGE_FEED_OVERLAP))
+                if len(rows) == CHANGE_FEED_BATCH and _parse_timestamp(rows[-1]["updated_at"]) <= cursor:
+                    # The overlap alone fills a batch; read on from the cursor so the feed keeps moving
+                    rows = await asyncio.to_thread(_changed_invoices, cursor)
+            except Exception as e:
+                print(f"Invoice change feed failed: {e}")
+                continue
+            for row in rows:
+                self.publish_invoice(row)
+            if rows:
+                cursor = max(cursor, _parse_timestamp(rows[-1]["updated_at"]) or cursor)
+
+
+def _changed_invoices(since: datetime) -> list:
+    return get_repositories().invoices.changed_since(since.isoformat(), CHANGE_FEED_BATCH)
+
+
+def invoice_event(invoice: dict) -> dict:
+    """Public status event payload (no merchant data)"""
+    return {
+        "type": "invoice.status",
+        "id": invoice["id"],
+        "invoice_id": invoice.get("invoice_id"),
+        "status": invoice["status"],
+        "tx_hash": invoice.get("tx_hash"),
+        "updated_at": invoice.get("updated_at"),
+    }
+
+
+hub = EventHub()
@@ -0,0 +1,55 @@
+"""Strong ETags and conditional GET for polled read endpoints.
+
+The validator is derived from a cheap probe of the result set (its row count
+and max(updated_at)) plus the request parameters, so a matching
+If-None-Match is answered with 304 before the full rows are fetched and
+serialized.
+"""
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+from utils.compression import ETAG_ENCODING_SUFFIXES
+from utils.metrics import record_cache
+
+# Responses are per merchant: browsers may keep them but must revalidate
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def _opaque(tag: str) -> str:
+    # If-None-Match uses weak comparison, and the compression middleware
+    # suffixes strong tags with the content-coding
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    for suffix in ETAG_ENCODING_SUFFIXES:
+        if tag.endswith(f'{suffix}"'):
+            return tag[:-len(suffix) - 1] + '"'
+    return tag
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(_opaque(tag.strip()) == etag for tag in header.split(","))
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """304 response if the client already has ``etag``, otherwise None"""
+    hit = etag_matches(request, etag)
+    record_cache("http_etag", hit)
+    if hit:
+        return Response(status_code=304, headers=cache_headers(etag))
+    return None
+
+
+def cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
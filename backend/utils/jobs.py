@@ -0,0 +1,186 @@
+"""Durable background jobs drained from the ``outbox`` table.
+
+Jobs are written in the same transaction as the state change that causes
+them (see ``mark_invoice_paid`` in migrations/001_outbox.sql), so a PAID
+invoice always has its follow-up work queued. Each API worker runs a
+``JobWorker`` that leases due rows with ``claim_outbox_jobs`` (FOR UPDATE
+SKIP LOCKED) and runs their handlers concurrently.
+
+Delivery is at least once: a lease that expires before the job is marked
+done (crash, hang) makes the row claimable again, so handlers must be
+idempotent. Failures are retried with exponential backoff; after
+``max_attempts`` the row is dead-lettered (status DEAD) with its last error.
+"""
+import asyncio
+import os
+import random
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from utils.database import get_repositories
+from utils.metrics import job_duration
+from utils.tracing import current_traceparent, span
+
+Handler = Callable[[dict], Awaitable[None]]
+
+HANDLERS: Dict[str, Handler] = {}
+
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 3600
+
+
+class RetryLater(Exception):
+    """Raised by a handler to reschedule its job without counting an attempt"""
+
+    def __init__(self, delay_seconds: float):
+        super().__init__(f"retry in {delay_seconds:.0f}s")
+        self.delay_seconds = delay_seconds
+
+
+def job(topic: str):
+    """Register an async handler for ``topic``; it receives the job payload"""
+    def register(handler: Handler) -> Handler:
+        HANDLERS[topic] = handler
+        return handler
+    return register
+
+
+def _traced(payload: dict) -> dict:
+    # The job continues the trace of the request that queued it
+    traceparent = current_traceparent()
+    return {**payload, "traceparent": traceparent} if traceparent else payload
+
+
+def outbox_job(topic: str, payload: dict) -> dict:
+    """Job entry for the ``p_jobs`` argument of transactional RPCs"""
+    return {"topic": topic, "payload": _traced(payload)}
+
+
+def enqueue(topic: str, payload: dict, delay_seconds: int = 0) -> dict:
+    """Insert a job on its own, outside any other write"""
+    available_at = None
+    if delay_seconds:
+        available_at = (datetime.now(timezone.utc) + timedelta(seconds=delay_seconds)).isoformat()
+    return get_repositories().outbox.enqueue(topic, _traced(payload), available_at)
+
+
+def queue_depth() -> dict:
+    """Outbox rows waiting to run and dead-lettered rows"""
+    return get_repositories().outbox.depth()
+
+
+def backoff_seconds(attempts: int, base: float = BACKOFF_BASE_SECONDS, maximum: float = BACKOFF_MAX_SECONDS) -> float:
+    """Exponential backoff with full jitter"""
+    ceiling = min(maximum, base * 2 ** max(attempts - 1, 0))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+class JobWorker:
+    def __init__(self, concurrency: int = 4, visibility_timeout: int = 60, poll_interval: float = 1.0):
+        self.concurrency = concurrency
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.processed = 0
+        self.failed = 0
+        self._running: Set[asyncio.Task] = set()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> "JobWorker":
+        self._task = asyncio.create_task(self.run())
+        return self
+
+    async def run(self) -> None:
+        idle = self.poll_interval
+        while not self._stopping:
+            free = self.concurrency - len(self._running)
+            if free <= 0:
+                await asyncio.wait(self._running, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            try:
+                jobs = await asyncio.to_thread(self._claim, free)
+            except Exception as e:
+                print(f"Job claim failed: {e}")
+                jobs = []
+            if not jobs:
+                # Back off while the queue is empty, up to 10x the poll interval
+                await asyncio.sleep(idle)
+                idle = min(idle * 2, self.poll_interval * 10)
+                continue
+            idle = self.poll_interval
+            for row in jobs:
+                task = asyncio.create_task(self._execute(row))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Stop claiming and give in-flight jobs ``timeout`` seconds to finish"""
+        self._stopping = True
+        if self._task:
+            self._task.cancel()
+        if self._running:
+            done, pending = await asyncio.wait(set(self._running), timeout=timeout)
+            for task in pending:
+                # Lease expires and another worker picks the job up
+                task.cancel()
+
+    def _claim(self, limit: int) -> list:
+        return get_repositories().outbox.claim(self.worker_id, limit, self.visibility_timeout)
+
+    async def _execute(self, row: dict) -> None:
+        with span(f"job {row['topic']}", "consumer", row["payload"].get("traceparent"),
+                  {"job.id": row["id"], "job.attempt": row["attempts"]}) as current:
+            await self._run_handler(row, current)
+
+    async def _run_handler(self, row: dict, current) -> None:
+        handler = HANDLERS.get(row["topic"])
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job topic {row['topic']!r}")
+            # Finish well inside the lease so the job isn't handed out twice
+            await asyncio.wait_for(handler(row["payload"]), timeout=self.visibility_timeout * 0.8)
+        except RetryLater as e:
+            job_duration.observe(time.perf_counter() - started, row["topic"], "retry_later")
+            await asyncio.to_thread(self._postpone, row, e.delay_seconds)
+        except Exception as e:
+            self.failed += 1
+            current.record_exception(e)
+            job_duration.observe(time.perf_counter() - started, row["topic"], "failed")
+            await asyncio.to_thread(self._fail, row, f"{type(e).__name__}: {e}", handler is None)
+        else:
+            self.processed += 1
+            job_duration.observe(time.perf_counter() - started, row["topic"], "done")
+            await asyncio.to_thread(self._complete, row)
+
+    def _complete(self, row: dict) -> None:
+        get_repositories().outbox.update_leased(row["id"], self.worker_id, {
+            "status": "DONE",
+            "locked_until": None,
+            "last_error": None,
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        })
+
+    def _postpone(self, row: dict, delay_seconds: float) -> None:
+        now = datetime.now(timezone.utc)
+        get_repositories().outbox.update_leased(row["id"], self.worker_id, {
+            "attempts": row["attempts"] - 1,
+            "locked_until": None,
+            "available_at": (now + timedelta(seconds=max(delay_seconds, 1))).isoformat(),
+            "updated_at": now.isoformat()
+        })
+
+    def _fail(self, row: dict, error: str, permanent: bool = False) -> None:
+        now = datetime.now(timezone.utc)
+        update_data = {"locked_until": None, "last_error": error[:2000], "updated_at": now.isoformat()}
+        if permanent or row["attempts"] >= row.get("max_attempts", 8):
+            update_data["status"] = "DEAD"
+            print(f"Job {row['id']} ({row['topic']}) dead-lettered after {row['attempts']} attempts: {error}")
+        else:
+            delay = backoff_seconds(row["attempts"])
+            update_data["available_at"] = (now + timedelta(seconds=delay)).isoformat()
+            print(f"Job {row['id']} ({row['topic']}) failed, retrying in {delay:.0f}s: {error}")
+        get_repositories().outbox.update_leased(row["id"], self.worker_id, update_data)
@@ -0,0 +1,25 @@
+import smtplib
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from utils.settings import get_settings
+from utils.tracing import span
+
+
+def send_html_email(to_email: str, subject: str, html_content: str) -> None:
+    """Send an HTML email through the configured SMTP server; raises on failure"""
+    smtp = get_settings().smtp
+
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = f"{smtp.from_name} <{smtp.from_email}>"
+    msg['To'] = to_email
+    msg.attach(MIMEText(html_content, 'html', 'utf-8'))
+
+    print(f"Connecting to SMTP server: {smtp.server}:{smtp.port}")
+    with span("smtp.send", "client", attributes={"server.address": smtp.server, "server.port": smtp.port}), \
+            smtplib.SMTP(smtp.server, smtp.port, timeout=30) as server:
+        server.starttls()
+        server.login(smtp.user, smtp.password)
+        server.send_message(msg)
+    print(f"Email sent to {to_email}")
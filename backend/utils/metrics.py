@@ -0,0 +1,416 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+A small registry of counters, gauges and histograms, kept light enough to
+leave on under full load: an observation takes a lock, does one bisect
+over the bucket bounds and adds to a list. Nothing is computed until
+``/metrics`` is scraped. Values that already live elsewhere (queue depths,
+pipeline counters, lru_cache statistics) are read by collectors at scrape
+time instead of being mirrored on every change.
+
+Each worker process has its own registry. With ``METRICS_DIR`` set (serve.py
+sets it when it runs several workers), every worker writes its values there
+every ``SNAPSHOT_INTERVAL_SECONDS`` and ``/metrics`` on any worker answers
+with the sum over all of them; the other workers' part is at most that old.
+
+What is recorded:
+  * HTTP requests by route template, method and status (``MetricsMiddleware``)
+  * Supabase/PostgREST calls by table and operation (``instrument_http_client``)
+  * SRI provider calls, background jobs, cache hits and misses, rate-limited requests,
+    coalesced reads
+  * named CPU-heavy steps wrapped in ``timed()``
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# How often a worker publishes its values to METRICS_DIR
+SNAPSHOT_INTERVAL_SECONDS = 5
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# A metric family as rendered: (name, kind, help, [(sample name with labels, value)])
+Family = Tuple[str, str, str, List[Tuple[str, float]]]
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def samples(self) -> List[Tuple[str, float]]:
+        raise NotImplementedError
+
+    def family(self) -> Family:
+        return self.name, self.kind, self.help, self.samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[Tuple[str, float]]:
+        with self._lock:
+            values = list(self._values.items())
+        return [(f"{self.name}{_labels(self.label_names, key)}", value) for key, value in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self) -> List[Tuple[str, float]]:
+        with self._lock:
+            snapshot = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        samples = []
+        for key, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                samples.append((f"{self.name}_bucket{_labels(self.label_names, key, le)}", cumulative))
+            samples.append((f"{self.name}_sum{_labels(self.label_names, key)}", total))
+            samples.append((f"{self.name}_count{_labels(self.label_names, key)}", cumulative))
+        return samples
+
+
+Sample = Tuple[str, str, str, Sequence[str], Iterable[Tuple[Sequence[str], float]]]
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        # Scrape-time callbacks returning (name, kind, help, label names, [(label values, value)])
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._shared_collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collector(self, callback: Callable[[], Iterable[Sample]]):
+        """Register a function called on every scrape; usable as a decorator"""
+        self._collectors.append(callback)
+        return callback
+
+    def shared_collector(self, callback: Callable[[], Iterable[Sample]]):
+        """Like ``collector``, for values every worker sees alike (read from the database); never summed across workers"""
+        self._shared_collectors.append(callback)
+        return callback
+
+    def _collect(self, collectors: List[Callable[[], Iterable[Sample]]]) -> List[Family]:
+        families = []
+        for callback in collectors:
+            try:
+                samples = list(callback())
+            except Exception as e:
+                print(f"Metrics collector {callback.__name__} failed: {e}")
+                continue
+            for name, kind, help, label_names, values in samples:
+                families.append((name, kind, help, [(f"{name}{_labels(label_names, key)}", value) for key, value in values]))
+        return families
+
+    def collect(self) -> List[Family]:
+        """This process's metrics and per-process collectors, the part a worker shares with the others"""
+        return [metric.family() for metric in self._metrics] + self._collect(self._collectors)
+
+    def write_snapshot(self, directory: str) -> None:
+        """Publish this process's values to ``directory`` for the worker that answers the next scrape"""
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as snapshot:
+            json.dump(self.collect(), snapshot)
+        os.replace(path + ".tmp", path)
+
+    def _merge(self, directory: str) -> List[Family]:
+        """This process's live values plus every other worker's latest snapshot, summed per sample
+
+        Counters and histograms of workers that have exited still count, so
+        totals never go backwards when a worker is replaced; their gauges don't.
+        """
+        merged: Dict[str, list] = {}
+        for name, kind, help, samples in self.collect():
+            merged[name] = [kind, help, dict(samples)]
+        own = f"{os.getpid()}.json"
+        for entry in sorted(os.listdir(directory)):
+            if not entry.endswith(".json") or entry == own:
+                continue
+            try:
+                with open(os.path.join(directory, entry), encoding="utf-8") as snapshot:
+                    families = json.load(snapshot)
+            except (OSError, ValueError) as e:
+                print(f"Skipping metrics snapshot {entry}: {e}")
+                continue
+            alive = _alive(int(entry[:-5]))
+            for name, kind, help, samples in families:
+                if kind == "gauge" and not alive:
+                    continue
+                values = merged.setdefault(name, [kind, help, {}])[2]
+                for series, value in samples:
+                    values[series] = values.get(series, 0) + value
+        return [(name, kind, help, list(values.items())) for name, (kind, help, values) in merged.items()]
+
+    def render(self, directory: Optional[str] = None) -> str:
+        """Prometheus text for this process, or for every worker when given the snapshot ``directory``"""
+        families = self._merge(directory) if directory else self.collect()
+        lines = []
+        for name, kind, help, samples in families + self._collect(self._shared_collectors):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{series} {_number(value)}" for series, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+async def publish_snapshots(directory: str) -> None:
+    """Write this worker's snapshot every SNAPSHOT_INTERVAL_SECONDS until cancelled, then once more"""
+    try:
+        while True:
+            try:
+                await asyncio.to_thread(registry.write_snapshot, directory)
+            except OSError as e:
+                print(f"Failed to write metrics snapshot: {e}")
+            await asyncio.sleep(SNAPSHOT_INTERVAL_SECONDS)
+    finally:
+        try:
+            registry.write_snapshot(directory)
+        except OSError as e:
+            print(f"Failed to write metrics snapshot: {e}")
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route template, method and status", ("method", "route", "status")
+)
+http_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "Time to the last body chunk (to the first for event streams)",
+    ("method", "route", "status")
+)
+http_in_progress = registry.gauge("http_requests_in_progress", "HTTP requests being handled", ("method",))
+
+db_requests = registry.counter(
+    "db_requests_total", "Supabase/PostgREST calls by table and operation", ("table", "operation", "status")
+)
+db_duration = registry.histogram(
+    "db_request_duration_seconds", "Supabase/PostgREST call time to response headers", ("table", "operation")
+)
+
+sri_requests = registry.counter("sri_requests_total", "HTTP requests to the SRI provider", ("endpoint", "outcome"))
+sri_duration = registry.histogram("sri_request_duration_seconds", "SRI provider request time", ("endpoint",))
+
+job_duration = registry.histogram(
+    "job_duration_seconds", "Outbox job handler time", ("topic", "outcome"),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+
+invoices_archived = registry.counter("invoices_archived_total", "Terminal invoices moved to invoices_archive")
+
+rate_limited = registry.counter("rate_limited_requests_total", "Requests rejected with 429, by rate limit rule", ("rule",))
+
+singleflight_calls = registry.counter(
+    "singleflight_calls_total", "Coalesced reads by call: executed, or shared with one already in flight", ("call", "result")
+)
+
+cache_requests = registry.counter("cache_requests_total", "Cache lookups by cache and result", ("cache", "result"))
+
+operation_duration = registry.histogram(
+    "operation_duration_seconds", "Time spent in named CPU-heavy steps (QR rendering, FIDO2 verification)",
+    ("operation",)
+)
+
+
+@contextmanager
+def timed(operation: str):
+    """Record the duration of the enclosed block under ``operation``"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        operation_duration.observe(time.perf_counter() - started, operation)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    cache_requests.inc(cache, "hit" if hit else "miss")
+
+
+def lru_cache_collector(caches: Dict[str, Callable]) -> Callable[[], Iterable[Sample]]:
+    """Collector exposing hits/misses of functools.lru_cache functions (name -> their cache_info)"""
+    def collect():
+        values = []
+        for name, cache_info in caches.items():
+            info = cache_info()
+            values.append(((name, "hit"), info.hits))
+            values.append(((name, "miss"), info.misses))
+        yield ("lru_cache_requests_total", "counter", "functools.lru_cache lookups", ("cache", "result"), values)
+    return collect
+
+
+# --- HTTP ---
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording per-route request counts and latency
+
+    Routes are labelled by their template (``/api/invoices/{invoice_id}``),
+    taken from the matched route after the request is handled, so label
+    cardinality stays bounded; requests that match nothing are "unmatched".
+    """
+
+    def __init__(self, app: ASGIApp, excluded_paths: Sequence[str] = ("/metrics",)) -> None:
+        self.app = app
+        self.excluded_paths = set(excluded_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        started = time.perf_counter()
+        state = {"status": 500, "observed": False}
+
+        def observe() -> None:
+            if not state["observed"]:
+                state["observed"] = True
+                route = scope.get("route")
+                labels = (method, getattr(route, "path", "unmatched"), str(state["status"]))
+                http_duration.observe(time.perf_counter() - started, *labels)
+                http_requests.inc(*labels)
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                # An event stream's lifetime isn't latency; time its first byte
+                if Headers(raw=message["headers"]).get("content-type", "").startswith("text/event-stream"):
+                    await send(message)
+                    observe()
+                    return
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                await send(message)
+                observe()
+                return
+            await send(message)
+
+        http_in_progress.inc(method)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_progress.dec(method)
+            observe()
+
+
+# --- database ---
+
+def postgrest_operation(request) -> Tuple[str, str]:
+    """(table, operation) for a PostgREST request"""
+    path = request.url.path
+    _, _, resource = path.partition("/rest/v1/")
+    if resource.startswith("rpc/"):
+        return resource[4:], "rpc"
+    table = resource or path
+    method = request.method
+    if method == "POST":
+        prefer = request.headers.get("prefer", "")
+        return table, "upsert" if "resolution=" in prefer else "insert"
+    return table, {"GET": "select", "HEAD": "count", "PATCH": "update", "DELETE": "delete"}.get(method, method.lower())
+
+
+def instrument_http_client(client) -> None:
+    """Time every request of an httpx.Client (the Supabase PostgREST session) by table and operation"""
+    def on_request(request) -> None:
+        request.extensions["metrics_started"] = time.perf_counter()
+
+    def on_response(response) -> None:
+        request = response.request
+        started = request.extensions.get("metrics_started")
+        if started is None:
+            return
+        table, operation = postgrest_operation(request)
+        db_duration.observe(time.perf_counter() - started, table, operation)
+        db_requests.inc(table, operation, "ok" if response.status_code < 400 else str(response.status_code))
+
+    hooks = client.event_hooks
+    hooks["request"] = list(hooks.get("request", [])) + [on_request]
+    hooks["response"] = list(hooks.get("response", [])) + [on_response]
+    client.event_hooks = hooks
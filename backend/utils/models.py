@@ -59,8 +59,10 @@ class InvoiceStatus(str, Enum):
 
 class EInvoiceStatus(str, Enum):
     PENDING = "PENDING"
+    SUBMITTED = "SUBMITTED"
     SENT = "SENT"
     FAILED = "FAILED"
+    DEAD = "DEAD"
 
 
 # --- INVOICE MODELS ---
@@ -86,6 +88,7 @@ class InvoiceResponse(BaseModel):
     status: InvoiceStatus
     created_at: datetime
     updated_at: datetime
+    total_usdc_units: Optional[int] = Field(None, description="Total en unidades base de USDC (6 decimales)")
     invoice_id: Optional[str] = None
     qr_url: Optional[str] = None
     checkout_url: Optional[str] = None
@@ -99,6 +102,27 @@ class EmitInvoiceResponse(BaseModel):
     qr_url: str
     checkout_url: str
 
+class BulkCreateInvoiceRequest(BaseModel):
+    invoices: List[Dict] = Field(..., min_items=1, max_items=10000, description="Facturas con el formato de CreateInvoiceRequest")
+    emit: bool = Field(False, description="Emitir (ISSUED) en la misma escritura")
+
+class BulkEmitInvoiceRequest(BaseModel):
+    ids: List[str] = Field(..., min_items=1, max_items=10000, description="IDs internos de facturas en DRAFT")
+
+class BulkInvoiceResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    status: str
+    error: Optional[str] = None
+    invoice_id: Optional[str] = None
+    qr_url: Optional[str] = None
+    checkout_url: Optional[str] = None
+
+class BulkInvoiceResponse(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BulkInvoiceResult]
+
 class PaymentRequest(BaseModel):
     tx_hash: str = Field(..., description="Hash de la transacción")
 
@@ -107,6 +131,7 @@ class WebhookPaymentRequest(BaseModel):
     tx_hash: str
     amount: float
     token: str
+    amount_units: Optional[int] = Field(None, description="Monto exacto en unidades base de USDC; tiene prioridad sobre amount")
 
 class PublicInvoiceResponse(BaseModel):
     merchant: str
@@ -119,14 +144,16 @@ class PublicInvoiceResponse(BaseModel):
     status: InvoiceStatus
     qr_url: Optional[str] = None
     checkout_url: Optional[str] = None
+    total_usdc_units: Optional[int] = None
 
 class EInvoiceRequest(BaseModel):
     invoice_id: str
 
 class EInvoiceResponse(BaseModel):
-    einvoice_number: str
-    einvoice_url: str
+    einvoice_number: Optional[str] = None
+    einvoice_url: Optional[str] = None
     status: EInvoiceStatus
+    access_key: Optional[str] = Field(None, description="Clave de acceso asignada al comprobante")
 
 class DashboardMetrics(BaseModel):
     issued: int
@@ -134,3 +161,43 @@ class DashboardMetrics(BaseModel):
     canceled: int
     expired: int
     total_usdc: float
+    total_usdc_units: int = 0
+
+class RevenuePeriod(BaseModel):
+    period: str = Field(..., description="First day of the day, week (Monday) or month")
+    invoices: int
+    revenue_usdc: float
+    revenue_usdc_units: int
+    average_ticket_usdc: float
+
+class TimeToPayBucket(BaseModel):
+    le_seconds: Optional[int] = Field(None, description="Upper bound; null for the open-ended last bucket")
+    count: int
+
+class TimeToPay(BaseModel):
+    count: int
+    mean_seconds: float
+    p50_seconds: float
+    p90_seconds: float
+    p99_seconds: float
+    histogram: List[TimeToPayBucket]
+
+class CustomerRevenue(BaseModel):
+    customer_email: Optional[str] = None
+    invoices: int
+    revenue_usdc: float
+    revenue_usdc_units: int
+
+class DashboardAnalytics(BaseModel):
+    interval: str
+    from_date: Optional[str] = None
+    to_date: Optional[str] = None
+    status_counts: Dict[str, int]
+    paid_invoices: int
+    revenue_usdc: float
+    revenue_usdc_units: int
+    average_ticket_usdc: float
+    average_ticket_usdc_units: int
+    revenue: List[RevenuePeriod]
+    time_to_pay: TimeToPay
+    top_customers: List[CustomerRevenue]
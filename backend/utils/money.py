@@ -0,0 +1,60 @@
+"""Exact money arithmetic in USDC base units.
+
+USDC has 6 decimals, so every amount is kept as an integer number of
+micro-dollars (1 USD = 1 USDC = 1_000_000 units). Totals are computed with
+integer math and only converted to float at the API boundary, which makes
+payment matching an exact integer comparison.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from operator import mul
+from typing import Iterable, NamedTuple, Union
+
+USDC_DECIMALS = 6
+UNITS_PER_USDC = 10 ** USDC_DECIMALS
+
+Amount = Union[int, float, str, Decimal]
+
+
+class Totals(NamedTuple):
+    subtotal: int
+    tax_amount: int
+    total: int
+    total_usdc: int
+
+
+def to_units(amount: Amount) -> int:
+    """Convert a decimal USD/USDC amount to base units, rounding half up"""
+    if isinstance(amount, float):
+        # repr() gives the shortest string that round-trips, e.g. 0.1 -> "0.1"
+        amount = repr(amount)
+    units = (Decimal(amount) * UNITS_PER_USDC).quantize(Decimal(1), rounding=ROUND_HALF_UP)
+    return int(units)
+
+
+def from_units(units: int) -> float:
+    """Base units back to a float for JSON responses"""
+    return units / UNITS_PER_USDC
+
+
+def row_units(row: dict, field: str) -> int:
+    """Read ``<field>_units`` from a row, falling back to the legacy float column"""
+    units = row.get(f"{field}_units")
+    if units is not None:
+        return int(units)
+    return to_units(row.get(field) or 0)
+
+
+def calculate_totals(items: Iterable, tax_rate: Amount) -> Totals:
+    """Subtotal, tax and total in base units for items with ``qty`` and ``unit_price``"""
+    items = list(items)
+    quantities = [item.qty for item in items]
+    prices = [to_units(item.unit_price) for item in items]
+    # sum(map(mul, ...)) runs the multiply-accumulate loop in C, which keeps
+    # invoices with thousands of line items cheap
+    subtotal = sum(map(mul, quantities, prices))
+    if isinstance(tax_rate, float):
+        tax_rate = repr(tax_rate)
+    tax_amount = int((subtotal * Decimal(tax_rate)).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    total = subtotal + tax_amount
+    # Assuming 1 USD = 1 USDC for simplicity (you can add exchange rate logic)
+    return Totals(subtotal, tax_amount, total, total)
@@ -0,0 +1,311 @@
+"""Token-bucket rate limiting for the public and merchant routes.
+
+Each rule in ``RULES`` gives the requests it matches (method and route
+template) a bucket of ``burst`` tokens refilled at ``per_minute``; a request
+takes one token from every bucket it matches and is rejected with 429 when
+any of them is empty. A rule's bucket is per client IP, per merchant (the
+email in a valid bearer token, else the IP) or shared by the whole route,
+which caps what the SMTP account and the database see whatever the number
+of clients.
+
+Buckets live in this process (``MemoryBucketStore``) unless
+``RATE_LIMIT_REDIS_URL`` is set and the optional ``redis`` package is
+installed; then every worker shares them through one Lua script call per
+request (``RedisBucketStore``). Redis being unreachable fails over to the
+local buckets rather than rejecting traffic.
+
+The client IP is the ASGI client address; behind a proxy run uvicorn with
+``--proxy-headers --forwarded-allow-ips`` so it is the real client's.
+"""
+import asyncio
+import math
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import jwt
+from starlette.datastructures import Headers
+from starlette.routing import compile_path
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.metrics import rate_limited
+from utils.serialization import dumps
+from utils.settings import get_settings
+from utils.tokens import decode_token
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+KEY_IP = "ip"
+KEY_MERCHANT = "merchant"
+KEY_ROUTE = "route"
+
+# (allowed, tokens left, seconds until the next token)
+Decision = Tuple[bool, float, float]
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    name: str
+    methods: Tuple[str, ...]
+    # Route template; a trailing {rest:path} matches everything under it
+    path: str
+    key: str
+    per_minute: float
+    burst: int
+
+
+RULES: Sequence[RateLimit] = (
+    # Every magic link is an email: a few per client, and a ceiling for the SMTP account
+    RateLimit("magic_link", ("POST",), "/api/send-magic-link", KEY_IP, 5, 3),
+    RateLimit("magic_link_total", ("POST",), "/api/send-magic-link", KEY_ROUTE, 120, 30),
+    RateLimit("register", ("GET", "POST"), "/api/register/{rest:path}", KEY_IP, 20, 10),
+    RateLimit("login", ("POST",), "/api/login/{rest:path}", KEY_IP, 30, 10),
+    RateLimit("password_login", ("POST",), "/api/auth/login", KEY_IP, 10, 5),
+    # Checkout pages poll while the wallet confirms
+    RateLimit("checkout", ("GET",), "/api/pay/{invoice_id}", KEY_IP, 120, 60),
+    RateLimit("checkout_events", ("GET",), "/api/pay/{invoice_id}/events", KEY_IP, 30, 10),
+    RateLimit("checkout_confirm", ("POST",), "/api/pay/{invoice_id}/confirm", KEY_IP, 20, 10),
+    RateLimit("qr", ("POST",), "/api/qr-generator", KEY_IP, 60, 20),
+    RateLimit("merchant_invoices", ("GET", "POST"), "/api/invoices{rest:path}", KEY_MERCHANT, 600, 120),
+    RateLimit("merchant_dashboard", ("GET",), "/api/dashboard/{rest:path}", KEY_MERCHANT, 300, 60),
+    RateLimit("merchant_einvoice", ("GET", "POST"), "/api/einvoice/{rest:path}", KEY_MERCHANT, 300, 60),
+    RateLimit("bulk", ("POST",), "/api/invoices/bulk{rest:path}", KEY_MERCHANT, 20, 10),
+    RateLimit("export", ("GET",), "/api/invoices/export", KEY_MERCHANT, 10, 5),
+)
+
+
+class MemoryBucketStore:
+    """Buckets in this process, split across locked shards
+
+    A shard holds at most ``max_keys / shards`` buckets; adding one to a
+    full shard first drops the buckets that have refilled (an idle client's
+    full bucket is the same as no bucket), then the oldest.
+    """
+
+    def __init__(self, shards: int = 16, max_keys: int = 100_000):
+        self._shards: List[Tuple[threading.Lock, Dict[str, list]]] = [
+            (threading.Lock(), {}) for _ in range(shards)
+        ]
+        self._shard_size = max(1, max_keys // shards)
+
+    def take(self, key: str, rate: float, burst: float, now: Optional[float] = None) -> Decision:
+        """Take a token from ``key``'s bucket (``rate`` tokens/second, ``burst`` capacity)"""
+        now = time.monotonic() if now is None else now
+        lock, buckets = self._shards[hash(key) % len(self._shards)]
+        with lock:
+            # [tokens, updated, rate, burst]
+            bucket = buckets.get(key)
+            if bucket is None:
+                if len(buckets) >= self._shard_size:
+                    self._evict(buckets, now)
+                bucket = buckets[key] = [burst, now, rate, burst]
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            # The rate and burst are kept for eviction; they change with RATE_LIMIT_SCALE
+            bucket[1:] = now, rate, burst
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return True, tokens - 1, 0.0 if tokens >= 2 else (2 - tokens) / rate
+            bucket[0] = tokens
+            return False, tokens, (1 - tokens) / rate
+
+    def _evict(self, buckets: Dict[str, list], now: float) -> None:
+        for key in [key for key, (tokens, updated, rate, burst) in buckets.items()
+                    if tokens + (now - updated) * rate >= burst]:
+            del buckets[key]
+        while len(buckets) >= self._shard_size:
+            del buckets[next(iter(buckets))]
+
+    def __len__(self) -> int:
+        return sum(len(buckets) for _, buckets in self._shards)
+
+
+# KEYS: bucket keys; ARGV: rate, burst per key. Refills with the server's
+# clock so workers on hosts with skewed clocks agree, and expires a bucket
+# once it would be full again.
+TAKE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local results = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', key, 't', 'u')
+    local tokens = tonumber(state[1]) or burst
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', key, 't', tostring(tokens), 'u', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil((burst - tokens) / rate * 1000) + 1000)
+    results[i] = {allowed, tostring(tokens)}
+end
+return results
+"""
+
+
+class RedisBucketStore:
+    """Buckets shared by every worker in Redis; one round trip per request"""
+
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        self.url = url
+        self.prefix = prefix
+        self.client = redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        self._script = self.client.register_script(TAKE_SCRIPT)
+
+    async def take_many(self, requests: Sequence[Tuple[str, float, float]]) -> List[Decision]:
+        keys = [self.prefix + key for key, _, _ in requests]
+        args = [value for _, rate, burst in requests for value in (rate, burst)]
+        decisions = []
+        for (_, rate, _), (allowed, tokens) in zip(requests, await self._script(keys=keys, args=args)):
+            tokens = float(tokens)
+            if allowed:
+                decisions.append((True, tokens, 0.0 if tokens >= 1 else (1 - tokens) / rate))
+            else:
+                decisions.append((False, tokens, (1 - tokens) / rate))
+        return decisions
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+memory_store = MemoryBucketStore()
+_redis_store: Optional[RedisBucketStore] = None
+_redis_failed_at = 0.0
+
+
+def get_redis_store() -> Optional[RedisBucketStore]:
+    """Shared store for RATE_LIMIT_REDIS_URL; None when unset or redis isn't installed"""
+    global _redis_store
+    url = get_settings().rate_limit_redis_url
+    if not url or redis is None:
+        return None
+    if _redis_store is None or _redis_store.url != url:
+        _redis_store = RedisBucketStore(url)
+    return _redis_store
+
+
+async def close_rate_limit_store() -> None:
+    global _redis_store
+    if _redis_store is not None:
+        await _redis_store.aclose()
+        _redis_store = None
+
+
+async def take(requests: Sequence[Tuple[str, float, float]]) -> List[Decision]:
+    """One decision per (bucket key, tokens/second, burst), from Redis when configured"""
+    global _redis_failed_at
+    store = get_redis_store()
+    if store is not None:
+        try:
+            return await store.take_many(requests)
+        except (redis.RedisError, OSError, asyncio.TimeoutError) as e:
+            now = time.monotonic()
+            if now - _redis_failed_at > 60:
+                print(f"Rate limit store unavailable, using local buckets: {e}")
+            _redis_failed_at = now
+    return [memory_store.take(key, rate, burst) for key, rate, burst in requests]
+
+
+@lru_cache(maxsize=4096)
+def _merchant(token: str) -> Optional[str]:
+    # Only names a key; the endpoints still verify the token (and its expiry) themselves
+    try:
+        return decode_token(token).get("email")
+    except (jwt.InvalidTokenError, ValueError):
+        return None
+
+
+def bearer_merchant(scope: Scope) -> Optional[str]:
+    """Merchant email in the request's bearer token, for keying per-merchant state before routing"""
+    authorization = Headers(scope=scope).get("authorization", "")
+    if authorization[:7].lower() == "bearer ":
+        return _merchant(authorization[7:].strip())
+    return None
+
+
+class RateLimitMiddleware:
+    """Pure ASGI middleware applying ``rules`` before routing
+
+    Limited responses carry ``RateLimit-Limit`` and ``RateLimit-Remaining``
+    for the tightest matching bucket; rejections are 429 with
+    ``Retry-After`` and ``RateLimit-Reset`` in seconds. Routes no rule
+    matches pay one dict lookup. ``RATE_LIMIT_SCALE`` multiplies every rate
+    and burst; 0 turns limiting off.
+    """
+
+    def __init__(self, app: ASGIApp, rules: Sequence[RateLimit] = RULES) -> None:
+        self.app = app
+        self.rules: Dict[str, list] = {}
+        for rule in rules:
+            regex, _, _ = compile_path(rule.path)
+            prefix = rule.path.split("{", 1)[0]
+            for method in rule.methods:
+                self.rules.setdefault(method, []).append((prefix, regex, rule))
+
+    def match(self, method: str, path: str) -> List[RateLimit]:
+        return [rule for prefix, regex, rule in self.rules.get(method, ())
+                if path.startswith(prefix) and regex.match(path)]
+
+    def bucket_key(self, rule: RateLimit, scope: Scope) -> str:
+        if rule.key == KEY_ROUTE:
+            return rule.name
+        if rule.key == KEY_MERCHANT:
+            merchant = bearer_merchant(scope)
+            if merchant:
+                return f"{rule.name}:m:{merchant}"
+        client = scope.get("client")
+        return f"{rule.name}:ip:{client[0] if client else 'unknown'}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        scale = get_settings().rate_limit_scale
+        rules = self.match(scope["method"], scope["path"]) if scope["type"] == "http" and scale else None
+        if not rules:
+            await self.app(scope, receive, send)
+            return
+
+        limits = [(rule.per_minute * scale / 60, max(1.0, rule.burst * scale)) for rule in rules]
+        decisions = await take([(self.bucket_key(rule, scope), rate, burst)
+                                for rule, (rate, burst) in zip(rules, limits)])
+        denied = [(rule, limit, decision) for rule, limit, decision in zip(rules, limits, decisions) if not decision[0]]
+        if denied:
+            for rule, _, _ in denied:
+                rate_limited.inc(rule.name)
+            await self.reject(denied, send)
+            return
+
+        # Report the bucket closest to empty
+        (_, burst), (_, tokens, _) = min(zip(limits, decisions), key=lambda pair: pair[1][1])
+        headers = [(b"ratelimit-limit", str(int(burst)).encode()), (b"ratelimit-remaining", str(int(tokens)).encode())]
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", ())) + headers
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def reject(self, denied: list, send: Send) -> None:
+        _, (_, burst), (_, _, wait) = max(denied, key=lambda entry: entry[2][2])
+        retry_after = str(max(1, math.ceil(wait)))
+        body = dumps({"detail": "Too many requests"})
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", retry_after.encode()),
+                (b"ratelimit-limit", str(int(burst)).encode()),
+                (b"ratelimit-remaining", b"0"),
+                (b"ratelimit-reset", retry_after.encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
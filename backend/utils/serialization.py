@@ -0,0 +1,36 @@
+"""Fast JSON responses for hot read endpoints.
+
+Rows coming back from the database are already JSON-shaped, so the invoice
+endpoints map them straight to response dicts and render them with orjson
+instead of building Pydantic models that FastAPI would validate again.
+orjson is optional; without it the stdlib encoder is used.
+"""
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when available"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def utc_timestamp(value):
+    """Normalise a Postgres UTC timestamp to the "Z" form Pydantic emits"""
+    if isinstance(value, str) and value.endswith("+00:00"):
+        return value[:-6] + "Z"
+    return value
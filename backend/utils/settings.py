@@ -0,0 +1,337 @@
+"""Application settings, parsed and validated once.
+
+Environment variables (and the .env file) plus config.json are read into an
+immutable ``Settings`` object at startup; request handlers and helpers call
+``get_settings()`` instead of ``os.getenv``. Sending SIGHUP to a worker
+re-reads everything and swaps the object atomically; an invalid reload is
+rejected and the previous settings stay active.
+"""
+import json
+import os
+import signal
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Mapping, Optional
+
+from dotenv import dotenv_values
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+JWT_ALGORITHMS = ("HS256", "ES256", "EdDSA")
+SRI_MODES = ("mock", "live")
+# 1 = pruebas (test), 2 = producción
+SRI_ENVIRONMENTS = (1, 2)
+TRACE_EXPORTERS = ("none", "file", "otlp")
+DATABASE_BACKENDS = ("supabase", "sqlite")
+
+
+class SettingsError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class SmtpSettings:
+    server: str
+    port: int
+    user: str
+    password: Optional[str]
+    from_email: str
+    from_name: str
+
+
+@dataclass(frozen=True)
+class Settings:
+    database_url: str
+    database_apikey: str
+    jwt_secret: Optional[str]
+    jwt_algorithm: str
+    jwt_expiration_time: int
+    jwt_keys_dir: Optional[str]
+    jwt_active_kid: Optional[str]
+    merchant_wallet_address: str
+    frontend_url: str
+    sri_endpoint: str
+    sri_api_key: str
+    magic_link_base: str
+    smtp: SmtpSettings
+    events_poll_interval: int = 2
+    job_workers: int = 4
+    job_visibility_timeout: int = 60
+    sri_mode: str = "mock"
+    sri_timeout: int = 10
+    sri_max_retries: int = 3
+    sri_batch_size: int = 50
+    sri_auth_batch_size: int = 100
+    einvoice_poll_interval: int = 10
+    einvoice_auth_recheck: int = 30
+    sri_environment: int = 1
+    sri_cert_path: Optional[str] = None
+    sri_cert_password: Optional[str] = None
+    einvoice_sign_workers: int = 2
+    einvoice_max_attempts: int = 8
+    metrics_token: Optional[str] = None
+    metrics_dir: Optional[str] = None
+    trace_exporter: str = "none"
+    trace_file: str = "traces.jsonl"
+    trace_otlp_endpoint: str = "http://localhost:4318/v1/traces"
+    trace_sample_rate: float = 1.0
+    database_backend: str = "supabase"
+    database_path: str = "cryptopay.db"
+    database_replica_url: Optional[str] = None
+    database_replica_path: Optional[str] = None
+    database_replica_sticky: int = 5
+    invoice_archive_days: int = 90
+    invoice_archive_interval: int = 3600
+    rate_limit_scale: float = 1.0
+    rate_limit_redis_url: Optional[str] = None
+    warm_up: bool = False
+    shutdown_timeout: int = 20
+    jwt_ephemeral_key: bool = False
+
+
+@lru_cache(maxsize=1)
+def get_config() -> dict:
+    """Load config.json once, relative to the backend directory rather than the CWD"""
+    with open(BASE_DIR / "config.json", "r", encoding="utf-8") as config:
+        return json.load(config)
+
+
+def _read_environment() -> dict:
+    # Real environment variables win over .env, like load_dotenv() did
+    values = {key: value for key, value in dotenv_values(BASE_DIR / ".env").items() if value is not None}
+    values.update(os.environ)
+    return values
+
+
+def _int(env: Mapping[str, str], name: str, default: int, errors: list) -> int:
+    raw = env.get(name)
+    if raw in (None, ""):
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        errors.append(f"{name} must be an integer, got {raw!r}")
+        return default
+
+
+def _float(env: Mapping[str, str], name: str, default: float, errors: list) -> float:
+    raw = env.get(name)
+    if raw in (None, ""):
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        errors.append(f"{name} must be a number, got {raw!r}")
+        return default
+
+
+def load_settings(env: Optional[Mapping[str, str]] = None, config: Optional[dict] = None) -> Settings:
+    """Build and validate settings; raises SettingsError listing every problem"""
+    env = _read_environment() if env is None else env
+    config = get_config() if config is None else config
+    errors = []
+
+    database_backend = env.get("DATABASE_BACKEND") or "supabase"
+    if database_backend not in DATABASE_BACKENDS:
+        errors.append(f"DATABASE_BACKEND must be one of {', '.join(DATABASE_BACKENDS)}, got {database_backend!r}")
+    if database_backend == "supabase":
+        for name in ("DATABASE_URL", "DATABASE_APIKEY"):
+            if not env.get(name):
+                errors.append(f"{name} is required when DATABASE_BACKEND is supabase")
+    database_replica_sticky = _int(env, "DATABASE_REPLICA_STICKY", 5, errors)
+    if database_replica_sticky < 0:
+        errors.append("DATABASE_REPLICA_STICKY must not be negative")
+
+    jwt_algorithm = env.get("JWT_ALGORITHM") or "HS256"
+    if jwt_algorithm not in JWT_ALGORITHMS:
+        errors.append(f"JWT_ALGORITHM must be one of {', '.join(JWT_ALGORITHMS)}, got {jwt_algorithm!r}")
+    if jwt_algorithm == "HS256" and not env.get("JWT_SECRET"):
+        errors.append("JWT_SECRET is required when JWT_ALGORITHM is HS256")
+    jwt_keys_dir = env.get("JWT_KEYS_DIR") or None
+    if jwt_keys_dir and not os.path.isdir(jwt_keys_dir):
+        errors.append(f"JWT_KEYS_DIR {jwt_keys_dir!r} is not a directory")
+    jwt_ephemeral_key = env.get("JWT_EPHEMERAL_KEY") or "0"
+    if jwt_ephemeral_key not in ("0", "1"):
+        errors.append(f"JWT_EPHEMERAL_KEY must be 0 or 1, got {jwt_ephemeral_key!r}")
+    # A generated key is per process: tokens from one worker would fail on the others
+    if jwt_algorithm in JWT_ALGORITHMS and jwt_algorithm != "HS256" and jwt_ephemeral_key != "1":
+        if not jwt_keys_dir:
+            errors.append(f"JWT_KEYS_DIR is required when JWT_ALGORITHM is {jwt_algorithm} "
+                          "(or JWT_EPHEMERAL_KEY=1 in development)")
+        elif os.path.isdir(jwt_keys_dir) and not [
+            name for name in os.listdir(jwt_keys_dir) if name.endswith(".pem") and not name.endswith(".pub.pem")
+        ]:
+            errors.append(f"JWT_KEYS_DIR {jwt_keys_dir!r} has no private key (<kid>.pem)")
+    jwt_expiration_time = _int(env, "JWT_EXPIRATION_TIME", 3600, errors)
+    if jwt_expiration_time <= 0:
+        errors.append("JWT_EXPIRATION_TIME must be positive")
+    events_poll_interval = _int(env, "EVENTS_POLL_INTERVAL", 2, errors)
+    if events_poll_interval < 0:
+        errors.append("EVENTS_POLL_INTERVAL must be zero (disabled) or positive")
+    job_workers = _int(env, "JOB_WORKERS", 4, errors)
+    if job_workers < 0:
+        errors.append("JOB_WORKERS must be zero (disabled) or positive")
+    job_visibility_timeout = _int(env, "JOB_VISIBILITY_TIMEOUT", 60, errors)
+    if job_visibility_timeout <= 0:
+        errors.append("JOB_VISIBILITY_TIMEOUT must be positive")
+    sri_mode = env.get("SRI_MODE") or "mock"
+    if sri_mode not in SRI_MODES:
+        errors.append(f"SRI_MODE must be one of {', '.join(SRI_MODES)}, got {sri_mode!r}")
+    sri_timeout = _int(env, "SRI_TIMEOUT", 10, errors)
+    if sri_timeout <= 0:
+        errors.append("SRI_TIMEOUT must be positive")
+    sri_max_retries = _int(env, "SRI_MAX_RETRIES", 3, errors)
+    if sri_max_retries < 0:
+        errors.append("SRI_MAX_RETRIES must not be negative")
+    sri_batch_size = _int(env, "SRI_BATCH_SIZE", 50, errors)
+    sri_auth_batch_size = _int(env, "SRI_AUTH_BATCH_SIZE", 100, errors)
+    einvoice_auth_recheck = _int(env, "EINVOICE_AUTH_RECHECK", 30, errors)
+    for name, value in (("SRI_BATCH_SIZE", sri_batch_size), ("SRI_AUTH_BATCH_SIZE", sri_auth_batch_size),
+                        ("EINVOICE_AUTH_RECHECK", einvoice_auth_recheck)):
+        if value <= 0:
+            errors.append(f"{name} must be positive")
+    einvoice_poll_interval = _int(env, "EINVOICE_POLL_INTERVAL", 10, errors)
+    if einvoice_poll_interval < 0:
+        errors.append("EINVOICE_POLL_INTERVAL must be zero (disabled) or positive")
+    sri_environment = _int(env, "SRI_ENVIRONMENT", 1, errors)
+    if sri_environment not in SRI_ENVIRONMENTS:
+        errors.append(f"SRI_ENVIRONMENT must be 1 (test) or 2 (production), got {sri_environment}")
+    sri_cert_path = env.get("SRI_CERT_PATH") or None
+    if sri_cert_path and not os.path.isfile(sri_cert_path):
+        errors.append(f"SRI_CERT_PATH {sri_cert_path!r} is not a file")
+    if sri_mode == "live" and not sri_cert_path:
+        errors.append("SRI_CERT_PATH is required when SRI_MODE is live")
+    einvoice_sign_workers = _int(env, "EINVOICE_SIGN_WORKERS", 2, errors)
+    if einvoice_sign_workers < 0:
+        errors.append("EINVOICE_SIGN_WORKERS must be zero (sign in-process) or positive")
+    einvoice_max_attempts = _int(env, "EINVOICE_MAX_ATTEMPTS", 8, errors)
+    if einvoice_max_attempts <= 0:
+        errors.append("EINVOICE_MAX_ATTEMPTS must be positive")
+    invoice_archive_days = _int(env, "INVOICE_ARCHIVE_DAYS", 90, errors)
+    invoice_archive_interval = _int(env, "INVOICE_ARCHIVE_INTERVAL", 3600, errors)
+    for name, value in (("INVOICE_ARCHIVE_DAYS", invoice_archive_days),
+                        ("INVOICE_ARCHIVE_INTERVAL", invoice_archive_interval)):
+        if value < 0:
+            errors.append(f"{name} must be zero (disabled) or positive")
+    rate_limit_scale = _float(env, "RATE_LIMIT_SCALE", 1.0, errors)
+    if rate_limit_scale < 0:
+        errors.append("RATE_LIMIT_SCALE must be zero (disabled) or positive")
+    warm_up = env.get("WARM_UP") or "0"
+    if warm_up not in ("0", "1"):
+        errors.append(f"WARM_UP must be 0 or 1, got {warm_up!r}")
+    shutdown_timeout = _int(env, "SHUTDOWN_TIMEOUT", 20, errors)
+    if shutdown_timeout < 0:
+        errors.append("SHUTDOWN_TIMEOUT must not be negative")
+    metrics_dir = env.get("METRICS_DIR") or None
+    if metrics_dir and not os.path.isdir(metrics_dir):
+        errors.append(f"METRICS_DIR {metrics_dir!r} is not a directory")
+    trace_exporter = env.get("TRACE_EXPORTER") or "none"
+    if trace_exporter not in TRACE_EXPORTERS:
+        errors.append(f"TRACE_EXPORTER must be one of {', '.join(TRACE_EXPORTERS)}, got {trace_exporter!r}")
+    trace_sample_rate = _float(env, "TRACE_SAMPLE_RATE", 1.0, errors)
+    if not 0 <= trace_sample_rate <= 1:
+        errors.append("TRACE_SAMPLE_RATE must be between 0 and 1")
+
+    smtp_config = config.get("smtp", {})
+    smtp = SmtpSettings(
+        server=smtp_config.get("smtp_server", ""),
+        port=int(smtp_config.get("smtp_port", 587)),
+        user=smtp_config.get("smtp_user", ""),
+        password=env.get("SMTP_PASSWORD"),
+        from_email=smtp_config.get("from_email", ""),
+        from_name=smtp_config.get("from_name", "CryptoPay"),
+    )
+
+    if errors:
+        raise SettingsError("Invalid configuration: " + "; ".join(errors))
+
+    return Settings(
+        database_url=env.get("DATABASE_URL") or "",
+        database_apikey=env.get("DATABASE_APIKEY") or "",
+        jwt_secret=env.get("JWT_SECRET"),
+        jwt_algorithm=jwt_algorithm,
+        jwt_expiration_time=jwt_expiration_time,
+        jwt_keys_dir=jwt_keys_dir,
+        jwt_active_kid=env.get("JWT_ACTIVE_KID") or None,
+        merchant_wallet_address=env.get("MERCHANT_WALLET_ADDRESS") or "0x0000000000000000000000000000000000000000",
+        frontend_url=(env.get("FRONTEND_URL") or "http://localhost:3000").rstrip("/"),
+        sri_endpoint=(env.get("SRI_ENDPOINT") or "https://api.sri.gob.ec/comprobantes").rstrip("/"),
+        sri_api_key=env.get("SRI_API_KEY") or "your-sri-api-key",
+        magic_link_base=config.get("server", ""),
+        smtp=smtp,
+        events_poll_interval=events_poll_interval,
+        job_workers=job_workers,
+        job_visibility_timeout=job_visibility_timeout,
+        sri_mode=sri_mode,
+        sri_timeout=sri_timeout,
+        sri_max_retries=sri_max_retries,
+        sri_batch_size=sri_batch_size,
+        sri_auth_batch_size=sri_auth_batch_size,
+        einvoice_poll_interval=einvoice_poll_interval,
+        einvoice_auth_recheck=einvoice_auth_recheck,
+        sri_environment=sri_environment,
+        sri_cert_path=sri_cert_path,
+        sri_cert_password=env.get("SRI_CERT_PASSWORD") or None,
+        einvoice_sign_workers=einvoice_sign_workers,
+        einvoice_max_attempts=einvoice_max_attempts,
+        metrics_token=env.get("METRICS_TOKEN") or None,
+        metrics_dir=env.get("METRICS_DIR") or None,
+        trace_exporter=trace_exporter,
+        trace_file=env.get("TRACE_FILE") or "traces.jsonl",
+        trace_otlp_endpoint=env.get("TRACE_OTLP_ENDPOINT") or "http://localhost:4318/v1/traces",
+        trace_sample_rate=trace_sample_rate,
+        database_backend=database_backend,
+        database_path=env.get("DATABASE_PATH") or "cryptopay.db",
+        database_replica_url=env.get("DATABASE_REPLICA_URL") or None,
+        database_replica_path=env.get("DATABASE_REPLICA_PATH") or None,
+        database_replica_sticky=database_replica_sticky,
+        invoice_archive_days=invoice_archive_days,
+        invoice_archive_interval=invoice_archive_interval,
+        rate_limit_scale=rate_limit_scale,
+        rate_limit_redis_url=env.get("RATE_LIMIT_REDIS_URL") or None,
+        warm_up=warm_up == "1",
+        shutdown_timeout=shutdown_timeout,
+        jwt_ephemeral_key=jwt_ephemeral_key == "1",
+    )
+
+
+_settings: Optional[Settings] = None
+
+
+def get_settings() -> Settings:
+    """Current settings; loaded on first use. Usable as a FastAPI dependency."""
+    global _settings
+    if _settings is None:
+        _settings = load_settings()
+    return _settings
+
+
+def reload_settings() -> bool:
+    """Re-read .env, the environment and config.json; keep the old settings if invalid"""
+    global _settings
+    get_config.cache_clear()
+    try:
+        settings = load_settings()
+    except (SettingsError, OSError, ValueError) as e:
+        print(f"Settings reload rejected: {e}")
+        return False
+    _settings = settings
+
+    from utils.tokens import reload_keys
+    reload_keys()
+    from utils.tracing import configure_tracing
+    configure_tracing(settings)
+    print("Settings reloaded")
+    return True
+
+
+def install_reload_handler(loop) -> None:
+    """Reload settings on SIGHUP (no-op on platforms without it)"""
+    if not hasattr(signal, "SIGHUP"):
+        return
+    try:
+        loop.add_signal_handler(signal.SIGHUP, reload_settings)
+    except (RuntimeError, ValueError):
+        # Event loop not running in the main thread (e.g. TestClient)
+        print("SIGHUP settings reload unavailable outside the main thread")
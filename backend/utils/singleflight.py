@@ -0,0 +1,63 @@
+"""Request coalescing ("single flight") for identical concurrent reads.
+
+A shared checkout link makes dozens of clients ask for the same invoice at
+once. ``reads.run(name, key, fn, *args)`` runs the blocking repository call
+``fn`` in a worker thread unless a call with the same name and key is
+already in flight in this event loop; then it waits for that call and gets
+the same result (or exception). Nothing is cached: once the call returns,
+the next request queries again.
+
+Keys are the filter values plus the repository object the read goes to, so
+a request pinned to the primary never shares a replica's answer. Writes
+noted with ``utils.database.note_write`` drop in-flight calls whose key
+contains the written ids or email, so a read that starts after a write in
+this process never gets a result fetched before it. Callers must treat
+shared results as read-only.
+
+``singleflight_calls_total`` counts calls by name, ``executed`` or
+``shared``; the ``shared`` ones are the database calls saved.
+"""
+import asyncio
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from utils.metrics import singleflight_calls
+
+
+class SingleFlight:
+    def __init__(self):
+        # (name, key) -> task running the call
+        self._calls: Dict[Tuple[str, tuple], asyncio.Task] = {}
+
+    async def run(self, name: str, key: tuple, fn: Callable, *args) -> Any:
+        """``fn(*args)`` in a thread, shared with concurrent callers using the same name and key"""
+        call = (name, key)
+        task = self._calls.get(call)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            singleflight_calls.inc(name, "shared")
+        else:
+            singleflight_calls.inc(name, "executed")
+            task = asyncio.ensure_future(asyncio.to_thread(fn, *args))
+            self._calls[call] = task
+            task.add_done_callback(lambda done: self._finished(call, done))
+        # A caller that disconnects doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _finished(self, call: Tuple[str, tuple], task: asyncio.Task) -> None:
+        if self._calls.get(call) is task:
+            self._calls.pop(call, None)
+        if not task.cancelled():
+            # Retrieved here too, so a call whose callers all left logs nothing
+            task.exception()
+
+    def forget(self, *values: Hashable) -> None:
+        """Let later callers start a new call instead of joining any whose key has one of ``values``"""
+        # note_write may run in a worker thread: copy the keys first
+        for call in list(self._calls):
+            if any(value in call[1] for value in values):
+                self._calls.pop(call, None)
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+reads = SingleFlight()
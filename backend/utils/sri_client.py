@@ -0,0 +1,169 @@
+"""Async client for the SRI e-invoicing provider.
+
+One pooled ``httpx.AsyncClient`` per process with explicit connect/read
+timeouts. Transport errors and 429/5xx responses are retried with
+exponential backoff and jitter; other 4xx responses fail at once. A circuit
+breaker opens after consecutive failures so callers fail fast
+(``CircuitOpenError``) and leave invoices PENDING instead of FAILED while
+the provider is down; after ``reset_timeout`` one trial request is let
+through to probe it.
+"""
+import asyncio
+import random
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from utils.metrics import sri_duration, sri_requests
+from utils.settings import get_settings
+from utils.tracing import span
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class SRIError(Exception):
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class CircuitOpenError(SRIError):
+    def __init__(self, retry_after: float):
+        super().__init__(f"SRI provider unavailable, retry in {retry_after:.0f}s", retryable=True)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a request may go out now"""
+        if self.state == self.CLOSED:
+            return
+        elapsed = time.monotonic() - self.opened_at
+        if self.state == self.OPEN and elapsed >= self.reset_timeout:
+            # Let a single trial request through
+            self.state = self.HALF_OPEN
+            return
+        raise CircuitOpenError(max(self.reset_timeout - elapsed, 0.0))
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                print(f"SRI circuit breaker open after {self.failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class SRIClient:
+    def __init__(
+        self,
+        endpoint: str,
+        api_key: str,
+        timeout: float = 10.0,
+        connect_timeout: float = 3.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        breaker: Optional[CircuitBreaker] = None,
+        max_connections: int = 20,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.breaker = breaker or CircuitBreaker()
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            headers={"Authorization": f"Bearer {api_key}"},
+            transport=transport,
+        )
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    async def post(self, payload: dict, url: Optional[str] = None) -> dict:
+        """POST JSON to the provider with retries; returns the decoded response"""
+        url = url or self.endpoint
+        endpoint = urlsplit(url).path.rsplit("/", 1)[-1] or "/"
+        attempt = 0
+        with span(f"sri {endpoint}", "client", attributes={"url.full": url}) as current:
+            while True:
+                try:
+                    self.breaker.before_call()
+                except CircuitOpenError:
+                    sri_requests.inc(endpoint, "circuit_open")
+                    raise
+                started = time.perf_counter()
+                try:
+                    response = await self._client.post(url, json=payload)
+                except httpx.TransportError as e:
+                    sri_requests.inc(endpoint, type(e).__name__)
+                    error = SRIError(f"SRI request failed: {type(e).__name__}: {e}", retryable=True)
+                else:
+                    sri_duration.observe(time.perf_counter() - started, endpoint)
+                    sri_requests.inc(endpoint, str(response.status_code))
+                    current.set_attribute("http.response.status_code", response.status_code)
+                    if response.status_code < 400:
+                        self.breaker.record_success()
+                        return response.json()
+                    retryable = response.status_code in RETRYABLE_STATUS
+                    error = SRIError(f"SRI returned {response.status_code}: {response.text[:200]}", retryable=retryable)
+                    if not retryable:
+                        # The provider is up; the request itself was rejected
+                        self.breaker.record_success()
+                        raise error
+
+                self.breaker.record_failure()
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise error
+                current.add_event("retry", {"attempt": attempt, "error": str(error)[:200]})
+                delay = self.backoff_base * 2 ** (attempt - 1)
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+
+
+_client: Optional[SRIClient] = None
+
+
+def get_sri_client() -> SRIClient:
+    """Process-wide client; rebuilt when a settings reload changes the endpoint or key"""
+    global _client
+    settings = get_settings()
+    if _client is None or (_client.endpoint, _client.api_key) != (settings.sri_endpoint, settings.sri_api_key):
+        _client = SRIClient(
+            settings.sri_endpoint,
+            settings.sri_api_key,
+            timeout=settings.sri_timeout,
+            max_retries=settings.sri_max_retries,
+        )
+    return _client
+
+
+def breaker_state() -> str:
+    """State of the process-wide client's circuit breaker (closed before first use)"""
+    return _client.breaker.state if _client is not None else CircuitBreaker.CLOSED
+
+
+async def close_sri_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
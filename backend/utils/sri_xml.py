@@ -0,0 +1,243 @@
+"""SRI comprobante (factura v1.1.0) generation and the clave de acceso.
+
+The XML is written element by element with a streaming ``XMLGenerator``
+instead of building a DOM. Output has no indentation, attributes in sorted
+order and explicit end tags, so the bytes of the root element are already
+their C14N form and the signer can digest them without re-parsing.
+"""
+import hashlib
+import io
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from xml.sax.saxutils import XMLGenerator
+
+from utils.money import UNITS_PER_USDC, row_units, to_units
+
+# Ecuador (mainland) has no daylight saving time
+ECUADOR_TZ = timezone(timedelta(hours=-5), "America/Guayaquil")
+
+DOC_TYPE_INVOICE = "01"
+EMISSION_NORMAL = "1"
+ESTABLISHMENT = "001"
+EMISSION_POINT = "001"
+FACTURA_VERSION = "1.1.0"
+
+# IVA rate -> codigoPorcentaje (SRI table 17)
+IVA_CODE = "2"
+IVA_RATE_CODES = {
+    "0": "0",
+    "0.05": "5",
+    "0.12": "2",
+    "0.13": "10",
+    "0.14": "3",
+    "0.15": "4",
+}
+# "Otros con utilización del sistema financiero" (SRI table 24)
+PAYMENT_METHOD_OTHER = "20"
+# Consumidor final
+BUYER_ID_TYPE = "07"
+BUYER_ID = "9999999999999"
+BUYER_NAME = "CONSUMIDOR FINAL"
+
+CENT = Decimal("0.01")
+
+
+def mod11_check_digit(digits: str) -> int:
+    """Check digit for a clave de acceso: weights 2..7 from the right, modulo 11"""
+    total = 0
+    weight = 2
+    for digit in reversed(digits):
+        total += int(digit) * weight
+        weight = 2 if weight == 7 else weight + 1
+    check = 11 - total % 11
+    if check == 11:
+        return 0
+    if check == 10:
+        return 1
+    return check
+
+
+def access_key(
+    issued_on: datetime,
+    ruc: str,
+    environment: int,
+    sequential: int,
+    numeric_code: int,
+    establishment: str = ESTABLISHMENT,
+    emission_point: str = EMISSION_POINT,
+    doc_type: str = DOC_TYPE_INVOICE,
+) -> str:
+    """49-digit clave de acceso: 48 digits of document data plus the mod-11 check digit"""
+    key = (
+        f"{issued_on:%d%m%Y}{doc_type}{ruc}{environment}{establishment}{emission_point}"
+        f"{sequential:09d}{numeric_code:08d}{EMISSION_NORMAL}"
+    )
+    if len(key) != 48 or not key.isdigit():
+        raise ValueError(f"Invalid access key data: {key!r}")
+    return key + str(mod11_check_digit(key))
+
+
+def invoice_number(key: str) -> str:
+    """Establishment, emission point and sequential encoded in an access key"""
+    return f"{key[24:27]}-{key[27:30]}-{key[30:39]}"
+
+
+def merchant_ruc(merchant: dict) -> str:
+    ruc = (merchant.get("tax_number") or "").strip()
+    if len(ruc) != 13 or not ruc.isdigit():
+        raise ValueError("Merchant tax_number must be a 13-digit RUC")
+    return ruc
+
+
+def invoice_sequential(invoice: dict) -> int:
+    """Sequential from the invoices.einvoice_sequential identity column
+
+    Rows from before migration 003 fall back to a stable number derived from
+    the invoice id.
+    """
+    sequential = invoice.get("einvoice_sequential")
+    if sequential is not None:
+        return int(sequential) % 10 ** 9
+    return int(hashlib.sha256(invoice["id"].encode()).hexdigest(), 16) % 10 ** 9
+
+
+def issue_datetime(invoice: dict) -> datetime:
+    issued = invoice.get("paid_at") or invoice.get("issued_at") or invoice["created_at"]
+    return datetime.fromisoformat(issued.replace("Z", "+00:00")).astimezone(ECUADOR_TZ)
+
+
+def invoice_access_key(invoice: dict, merchant: dict, environment: int) -> str:
+    # The numeric code only has to be stable per invoice so a resubmission
+    # reuses the same key
+    numeric_code = int(hashlib.sha256(invoice["id"].encode()).hexdigest()[:12], 16) % 10 ** 8
+    return access_key(
+        issue_datetime(invoice), merchant_ruc(merchant), environment,
+        invoice_sequential(invoice), numeric_code
+    )
+
+
+def _money(units: int) -> str:
+    return str((Decimal(units) / UNITS_PER_USDC).quantize(CENT, rounding=ROUND_HALF_UP))
+
+
+def _rate_code(rate: Decimal) -> str:
+    code = IVA_RATE_CODES.get(str(rate.normalize()) if rate else "0")
+    if code is None:
+        raise ValueError(f"Unsupported IVA rate {rate}")
+    return code
+
+
+def _clean(value) -> str:
+    # C14N writes a bare CR as &#xD;; we never emit one instead
+    return str(value).replace("\r", "")
+
+
+class _Writer:
+    """Thin wrapper over XMLGenerator for a compact nested-element style"""
+
+    def __init__(self, out):
+        self.xml = XMLGenerator(out, encoding="utf-8", short_empty_elements=False)
+
+    def open(self, tag: str, attrs: dict = None):
+        self.xml.startElement(tag, attrs or {})
+
+    def close(self, tag: str):
+        self.xml.endElement(tag)
+
+    def leaf(self, tag: str, value, attrs: dict = None):
+        self.xml.startElement(tag, attrs or {})
+        self.xml.characters(_clean(value))
+        self.xml.endElement(tag)
+
+
+def write_invoice(out, invoice: dict, merchant: dict, key: str, environment: int) -> None:
+    """Stream the factura for ``invoice`` to the binary file ``out`` (no XML declaration)"""
+    rate = Decimal(repr(float(invoice.get("tax_rate") or 0)))
+    rate_code = _rate_code(rate)
+    subtotal = row_units(invoice, "subtotal")
+    tax_amount = row_units(invoice, "tax_amount")
+    total = row_units(invoice, "total")
+    address = merchant.get("address") or merchant.get("city") or "S/N"
+
+    w = _Writer(out)
+    w.open("factura", {"id": "comprobante", "version": FACTURA_VERSION})
+
+    w.open("infoTributaria")
+    w.leaf("ambiente", environment)
+    w.leaf("tipoEmision", EMISSION_NORMAL)
+    w.leaf("razonSocial", merchant.get("name") or merchant["email"])
+    w.leaf("ruc", key[10:23])
+    w.leaf("claveAcceso", key)
+    w.leaf("codDoc", DOC_TYPE_INVOICE)
+    w.leaf("estab", key[24:27])
+    w.leaf("ptoEmi", key[27:30])
+    w.leaf("secuencial", key[30:39])
+    w.leaf("dirMatriz", address)
+    w.close("infoTributaria")
+
+    w.open("infoFactura")
+    w.leaf("fechaEmision", f"{key[0:2]}/{key[2:4]}/{key[4:8]}")
+    w.leaf("dirEstablecimiento", address)
+    w.leaf("obligadoContabilidad", "NO")
+    w.leaf("tipoIdentificacionComprador", BUYER_ID_TYPE)
+    w.leaf("razonSocialComprador", BUYER_NAME)
+    w.leaf("identificacionComprador", BUYER_ID)
+    w.leaf("totalSinImpuestos", _money(subtotal))
+    w.leaf("totalDescuento", "0.00")
+    w.open("totalConImpuestos")
+    w.open("totalImpuesto")
+    w.leaf("codigo", IVA_CODE)
+    w.leaf("codigoPorcentaje", rate_code)
+    w.leaf("baseImponible", _money(subtotal))
+    w.leaf("valor", _money(tax_amount))
+    w.close("totalImpuesto")
+    w.close("totalConImpuestos")
+    w.leaf("propina", "0.00")
+    w.leaf("importeTotal", _money(total))
+    w.leaf("moneda", "DOLAR")
+    w.open("pagos")
+    w.open("pago")
+    w.leaf("formaPago", PAYMENT_METHOD_OTHER)
+    w.leaf("total", _money(total))
+    w.close("pago")
+    w.close("pagos")
+    w.close("infoFactura")
+
+    w.open("detalles")
+    tarifa = str(int(rate * 100))
+    for index, item in enumerate(invoice["items"], start=1):
+        line_total = item["qty"] * to_units(item["unit_price"])
+        line_tax = int((line_total * rate).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+        w.open("detalle")
+        w.leaf("codigoPrincipal", f"{index:03d}")
+        w.leaf("descripcion", item["name"])
+        w.leaf("cantidad", f"{item['qty']}.00")
+        w.leaf("precioUnitario", _money(to_units(item["unit_price"])))
+        w.leaf("descuento", "0.00")
+        w.leaf("precioTotalSinImpuesto", _money(line_total))
+        w.open("impuestos")
+        w.open("impuesto")
+        w.leaf("codigo", IVA_CODE)
+        w.leaf("codigoPorcentaje", rate_code)
+        w.leaf("tarifa", tarifa)
+        w.leaf("baseImponible", _money(line_total))
+        w.leaf("valor", _money(line_tax))
+        w.close("impuesto")
+        w.close("impuestos")
+        w.close("detalle")
+    w.close("detalles")
+
+    w.open("infoAdicional")
+    w.leaf("campoAdicional", invoice["customer_email"], {"nombre": "email"})
+    w.leaf("campoAdicional", invoice["invoice_id"], {"nombre": "factura"})
+    if invoice.get("tx_hash"):
+        w.leaf("campoAdicional", invoice["tx_hash"], {"nombre": "txHash"})
+    w.close("infoAdicional")
+
+    w.close("factura")
+
+
+def build_invoice_xml(invoice: dict, merchant: dict, key: str, environment: int) -> bytes:
+    out = io.BytesIO()
+    write_invoice(out, invoice, merchant, key, environment)
+    return out.getvalue()
@@ -0,0 +1,143 @@
+"""JWT signing and verification shared by every router.
+
+HS256 with the shared JWT_SECRET stays the default. Setting JWT_ALGORITHM to
+ES256 or EdDSA switches to asymmetric signing with a keyring loaded from
+JWT_KEYS_DIR; its public half is published at /.well-known/jwks.json so other
+services can verify merchant tokens offline.
+
+Key rotation: every ``<kid>.pem`` private key in JWT_KEYS_DIR is loaded and the
+one named by JWT_ACTIVE_KID (or the last one in sort order) signs new tokens.
+Retired keys can be kept as verify-only ``<kid>.pub.pem`` files until the
+tokens they signed have expired.
+"""
+import os
+import glob
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import jwt
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+
+from utils.settings import get_settings
+
+SYMMETRIC_ALGORITHM = "HS256"
+ASYMMETRIC_ALGORITHMS = ("ES256", "EdDSA")
+
+
+class SigningKey:
+    def __init__(self, kid: str, algorithm: str, public_key, private_key=None):
+        self.kid = kid
+        self.algorithm = algorithm
+        self.public_key = public_key
+        self.private_key = private_key
+
+    def to_jwk(self) -> dict:
+        if self.algorithm == "ES256":
+            jwk = ECAlgorithm.to_jwk(self.public_key, as_dict=True)
+        else:
+            jwk = OKPAlgorithm.to_jwk(self.public_key, as_dict=True)
+        jwk.update({"kid": self.kid, "alg": self.algorithm, "use": "sig"})
+        return jwk
+
+
+class Keyring:
+    def __init__(self, algorithm: str, keys: List[SigningKey], active_kid: str):
+        self.algorithm = algorithm
+        self.keys: Dict[str, SigningKey] = {key.kid: key for key in keys}
+        self.active = self.keys[active_kid]
+
+
+def _check_key_type(path: str, algorithm: str, key) -> None:
+    if algorithm == "ES256":
+        valid = isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)) and key.curve.name == "secp256r1"
+    else:
+        valid = isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey))
+    if not valid:
+        raise ValueError(f"Key {path} does not match JWT_ALGORITHM={algorithm}")
+
+
+def _generate_key(algorithm: str):
+    if algorithm == "ES256":
+        return ec.generate_private_key(ec.SECP256R1())
+    return ed25519.Ed25519PrivateKey.generate()
+
+
+@lru_cache(maxsize=1)
+def get_keyring() -> Optional[Keyring]:
+    """Load the asymmetric keyring once; None in HS256 mode"""
+    settings = get_settings()
+    algorithm = settings.jwt_algorithm
+    if algorithm == SYMMETRIC_ALGORITHM:
+        return None
+
+    keys: List[SigningKey] = []
+    keys_dir = settings.jwt_keys_dir
+    if keys_dir:
+        for path in sorted(glob.glob(os.path.join(keys_dir, "*.pem"))):
+            with open(path, "rb") as key_file:
+                pem = key_file.read()
+            name = os.path.basename(path)
+            if name.endswith(".pub.pem"):
+                public_key = serialization.load_pem_public_key(pem)
+                _check_key_type(path, algorithm, public_key)
+                keys.append(SigningKey(name[:-len(".pub.pem")], algorithm, public_key))
+            else:
+                private_key = serialization.load_pem_private_key(pem, password=None)
+                _check_key_type(path, algorithm, private_key)
+                keys.append(SigningKey(name[:-len(".pem")], algorithm, private_key.public_key(), private_key))
+
+    signing_keys = [key for key in keys if key.private_key is not None]
+    if not signing_keys:
+        if not settings.jwt_ephemeral_key:
+            raise ValueError(f"No {algorithm} private key in JWT_KEYS_DIR")
+        # Development only (JWT_EPHEMERAL_KEY=1): tokens become invalid on every restart
+        print(f"Warning: no {algorithm} private key found in JWT_KEYS_DIR, generating an ephemeral key")
+        private_key = _generate_key(algorithm)
+        ephemeral = SigningKey("ephemeral", algorithm, private_key.public_key(), private_key)
+        keys.append(ephemeral)
+        signing_keys = [ephemeral]
+
+    active_kid = settings.jwt_active_kid or signing_keys[-1].kid
+    if active_kid not in {key.kid for key in signing_keys}:
+        raise ValueError(f"JWT_ACTIVE_KID {active_kid} has no private key in JWT_KEYS_DIR")
+
+    return Keyring(algorithm, keys, active_kid)
+
+
+def encode_token(payload: dict) -> str:
+    """Sign a JWT with the active key"""
+    keyring = get_keyring()
+    if keyring is None:
+        return jwt.encode(payload, get_settings().jwt_secret, algorithm=SYMMETRIC_ALGORITHM)
+    active = keyring.active
+    return jwt.encode(payload, active.private_key, algorithm=active.algorithm, headers={"kid": active.kid})
+
+
+def decode_token(token: str) -> dict:
+    """Verify a JWT and return its claims; raises jwt.InvalidTokenError"""
+    keyring = get_keyring()
+    if keyring is None:
+        return jwt.decode(token, get_settings().jwt_secret, algorithms=[SYMMETRIC_ALGORITHM])
+
+    kid = jwt.get_unverified_header(token).get("kid")
+    key = keyring.keys.get(kid)
+    if key is None:
+        raise jwt.InvalidTokenError(f"Unknown signing key: {kid}")
+    return jwt.decode(token, key.public_key, algorithms=[key.algorithm])
+
+
+@lru_cache(maxsize=1)
+def get_jwks() -> dict:
+    """Public keys as a JWK Set (empty in HS256 mode)"""
+    keyring = get_keyring()
+    if keyring is None:
+        return {"keys": []}
+    return {"keys": [key.to_jwk() for key in keyring.keys.values()]}
+
+
+def reload_keys() -> None:
+    """Drop cached keys so a rotated JWT_KEYS_DIR is picked up"""
+    get_keyring.cache_clear()
+    get_jwks.cache_clear()
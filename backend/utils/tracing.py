@@ -0,0 +1,434 @@
+"""Request tracing with spans in the OpenTelemetry (OTLP) format.
+
+A span is opened for every HTTP request (``TracingMiddleware``) and, inside
+it, for each Supabase/PostgREST query, SRI provider call, SMTP send, QR
+render, FIDO2 verification and e-invoice document batch. The current span
+lives in a context variable, so it follows ``await`` and
+``asyncio.to_thread`` without being passed around. Outbox jobs carry the
+W3C ``traceparent`` of the request that queued them in their payload and
+continue that trace when they run.
+
+Finished spans are buffered and exported from a background thread, either
+as OTLP/HTTP JSON to a local OpenTelemetry collector (``TRACE_EXPORTER=otlp``)
+or appended to a JSON-lines file (``TRACE_EXPORTER=file``) in the same
+format, which ``otelcol``'s ``otlpjsonfile`` receiver or a script can read
+back for offline profiling. With no exporter configured ``span()`` does
+nothing beyond one attribute check.
+"""
+import json
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Tuple, Union
+
+import httpx
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.metrics import postgrest_operation
+
+SERVICE_NAME = "cryptopay-api"
+EXPORT_INTERVAL_SECONDS = 2
+EXPORT_BATCH_SIZE = 512
+# Spans kept while the exporter is slow or down; the oldest are dropped
+MAX_QUEUED_SPANS = 10000
+
+# OTLP SpanKind
+KINDS = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+STATUS_ERROR = 2
+
+# PostgREST query parameters that aren't filters
+NON_FILTER_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """(trace id, parent span id, sampled) from a W3C traceparent header, or None if invalid"""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[0] == "ff":
+        return None
+    try:
+        trace_id, parent_id, flags = int(parts[1], 16), int(parts[2], 16), int(parts[3][:2], 16)
+    except ValueError:
+        return None
+    if not trace_id or not parent_id:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+class Span:
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "sampled",
+                 "attributes", "events", "status", "start_ns", "end_ns")
+
+    def __init__(self, name: str, kind: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 attributes: Optional[dict] = None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = dict(attributes) if attributes else {}
+        self.events: List[tuple] = []
+        self.status: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key: str, value) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def add_event(self, name: str, attributes: Optional[dict] = None) -> None:
+        if self.sampled:
+            self.events.append((time.time_ns(), name, attributes or {}))
+
+    def record_exception(self, error: BaseException) -> None:
+        self.status = f"{type(error).__name__}: {error}"[:500]
+        self.add_event("exception", {"exception.type": type(error).__name__, "exception.message": str(error)[:500]})
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            if self.sampled:
+                tracer.export(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": KINDS.get(self.kind, 1),
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [_attribute(key, value) for key, value in self.attributes.items()],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.events:
+            span["events"] = [
+                {"timeUnixNano": str(at), "name": name,
+                 "attributes": [_attribute(key, value) for key, value in attributes.items()]}
+                for at, name, attributes in self.events
+            ]
+        if self.status:
+            span["status"] = {"code": STATUS_ERROR, "message": self.status}
+        return span
+
+
+class _NoopSpan:
+    """Stands in for a span while tracing is off, so call sites needn't check"""
+    traceparent = None
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+    def add_event(self, name: str, attributes: Optional[dict] = None) -> None:
+        pass
+
+    def record_exception(self, error: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+# --- exporters ---
+
+def otlp_payload(spans: List[Span]) -> dict:
+    """An OTLP ExportTraceServiceRequest (JSON encoding) for ``spans``"""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+        "scopeSpans": [{"scope": {"name": "cryptopay"}, "spans": [span.to_otlp() for span in spans]}],
+    }]}
+
+
+class FileExporter:
+    """Appends one OTLP JSON document per batch to a file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(otlp_payload(spans), separators=(",", ":")) + "\n")
+
+    def close(self) -> None:
+        pass
+
+
+class OTLPExporter:
+    """Posts batches to an OpenTelemetry collector's OTLP/HTTP JSON endpoint"""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self._client = httpx.Client(timeout=timeout)
+
+    def export(self, spans: List[Span]) -> None:
+        response = self._client.post(self.endpoint, json=otlp_payload(spans))
+        response.raise_for_status()
+
+    def close(self) -> None:
+        self._client.close()
+
+
+class Tracer:
+    def __init__(self):
+        self.exporter = None
+        self.sample_rate = 1.0
+        self.exported = 0
+        self.dropped = 0
+        self._queue: deque = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def configure(self, exporter, sample_rate: float = 1.0) -> None:
+        """Start exporting to ``exporter`` (None turns tracing off)"""
+        previous = self.exporter
+        if previous is not None:
+            self.flush()
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        if previous is not None and previous is not exporter:
+            previous.close()
+        if exporter is not None and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+
+    def start_span(self, name: str, kind: str = "internal", parent: Union[Span, str, None] = None,
+                   attributes: Optional[dict] = None):
+        """A started span (NOOP_SPAN when tracing is off); the caller ends it"""
+        if self.exporter is None:
+            return NOOP_SPAN
+        if parent is None:
+            parent = _current.get()
+        if isinstance(parent, Span):
+            return Span(name, kind, parent.trace_id, parent.span_id, parent.sampled, attributes)
+        remote = parse_traceparent(parent) if isinstance(parent, str) else None
+        if remote:
+            trace_id, parent_id, sampled = remote
+        else:
+            # A new trace; the sampling decision is made once, at the root
+            trace_id, parent_id = "%032x" % random.getrandbits(128), None
+            sampled = random.random() < self.sample_rate
+        return Span(name, kind, trace_id, parent_id, sampled, attributes)
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            if len(self._queue) >= MAX_QUEUED_SPANS:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append(span)
+            full = len(self._queue) >= EXPORT_BATCH_SIZE
+        if full:
+            self._wake.set()
+
+    def flush(self) -> None:
+        """Export every queued span now"""
+        while True:
+            with self._lock:
+                batch = [self._queue.popleft() for _ in range(min(len(self._queue), EXPORT_BATCH_SIZE))]
+            exporter = self.exporter
+            if not batch or exporter is None:
+                return
+            try:
+                exporter.export(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                print(f"Trace export failed, dropped {len(batch)} spans: {e}")
+                return
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(EXPORT_INTERVAL_SECONDS)
+            self._wake.clear()
+            self.flush()
+
+    def shutdown(self) -> None:
+        self.flush()
+
+
+tracer = Tracer()
+
+
+def configure_tracing(settings) -> None:
+    """Apply the TRACE_* settings to the process-wide tracer"""
+    if settings.trace_exporter == "file":
+        exporter = FileExporter(settings.trace_file)
+    elif settings.trace_exporter == "otlp":
+        exporter = OTLPExporter(settings.trace_otlp_endpoint)
+    else:
+        exporter = None
+    tracer.configure(exporter, settings.trace_sample_rate)
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", parent: Union[Span, str, None] = None, attributes: Optional[dict] = None):
+    """Run the block in a child span of the current one; exceptions mark it failed"""
+    if tracer.exporter is None:
+        yield NOOP_SPAN
+        return
+    current = tracer.start_span(name, kind, parent, attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+
+def current_traceparent() -> Optional[str]:
+    """traceparent header value for the current span, for handing work to another process"""
+    current = _current.get()
+    return current.traceparent if current is not None else None
+
+
+# --- HTTP ---
+
+class TracingMiddleware:
+    """Pure ASGI middleware opening a server span per request
+
+    Continues the caller's trace when the request has a ``traceparent``
+    header. The span is named after the matched route template once the
+    request is handled, and ends with the last body chunk (with the first
+    for event streams, whose lifetime isn't request latency).
+    """
+
+    def __init__(self, app: ASGIApp, excluded_paths=("/metrics",)) -> None:
+        self.app = app
+        self.excluded_paths = set(excluded_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or tracer.exporter is None or scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        server_span = tracer.start_span(f"{method} {scope['path']}", "server",
+                                        Headers(scope=scope).get("traceparent") or None, {
+                                            "http.request.method": method,
+                                            "url.path": scope["path"],
+                                        })
+
+        def finish() -> None:
+            route = scope.get("route")
+            if route is not None:
+                server_span.name = f"{method} {route.path}"
+                server_span.set_attribute("http.route", route.path)
+            server_span.end()
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                server_span.set_attribute("http.response.status_code", status)
+                if status >= 500:
+                    server_span.status = f"HTTP {status}"
+                if Headers(raw=message["headers"]).get("content-type", "").startswith("text/event-stream"):
+                    await send(message)
+                    finish()
+                    return
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                await send(message)
+                finish()
+                return
+            await send(message)
+
+        token = _current.set(server_span)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            server_span.record_exception(e)
+            raise
+        finally:
+            _current.reset(token)
+            finish()
+
+
+# --- database ---
+
+def _filter_shape(request) -> str:
+    """Filtered columns and operators without their values, e.g. ``merchant_email=eq&status=in``"""
+    shape = []
+    for key, value in request.url.params.multi_items():
+        if key not in NON_FILTER_PARAMS:
+            shape.append(f"{key}={value.split('.', 1)[0]}")
+    return "&".join(shape)
+
+
+def _row_count(response) -> Optional[int]:
+    # PostgREST reports the returned range as "0-24/*" (or "*/0" when empty)
+    content_range = response.headers.get("content-range")
+    if not content_range:
+        return None
+    returned = content_range.split("/", 1)[0]
+    if returned == "*":
+        return 0
+    first, _, last = returned.partition("-")
+    try:
+        return int(last) - int(first) + 1
+    except ValueError:
+        return None
+
+
+def trace_http_client(client) -> None:
+    """Open a client span for every request of an httpx.Client (the Supabase PostgREST session)"""
+    def on_request(request) -> None:
+        if tracer.exporter is None or _current.get() is None:
+            # Queries outside any request, job or pipeline pass aren't traced
+            return
+        table, operation = postgrest_operation(request)
+        request.extensions["trace_span"] = tracer.start_span(f"{operation} {table}", "client", attributes={
+            "db.system": "postgresql",
+            "db.collection.name": table,
+            "db.operation.name": operation,
+            "db.query.filter": _filter_shape(request),
+            "db.query.limit": request.url.params.get("limit"),
+        })
+
+    def on_response(response) -> None:
+        client_span = response.request.extensions.get("trace_span")
+        if client_span is None:
+            return
+        client_span.set_attribute("http.response.status_code", response.status_code)
+        client_span.set_attribute("db.response.returned_rows", _row_count(response))
+        if response.status_code >= 400:
+            client_span.status = f"HTTP {response.status_code}"
+        client_span.end()
+
+    hooks = client.event_hooks
+    hooks["request"] = list(hooks.get("request", [])) + [on_request]
+    hooks["response"] = list(hooks.get("response", [])) + [on_response]
+    client.event_hooks = hooks
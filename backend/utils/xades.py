@@ -0,0 +1,172 @@
+"""XAdES-BES enveloped signatures for SRI comprobantes.
+
+SRI accepts RSA-SHA1 signatures with inclusive C14N over the comprobante
+(``#comprobante``), the signed properties and the signing certificate.
+Everything we sign is generated here or by ``utils.sri_xml`` in canonical
+form, so digests are computed over strings we build directly rather than by
+parsing and canonicalizing the document again.
+
+Parsing the PKCS#12 file (and deriving the certificate digest, issuer and
+public key values) is the slow part, so ``load_signer`` caches one
+``XadesSigner`` per file version; each process-pool worker loads it once.
+"""
+import base64
+import hashlib
+import os
+import secrets
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional
+from xml.sax.saxutils import escape
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+
+DS_NS = "http://www.w3.org/2000/09/xmldsig#"
+ETSI_NS = "http://uri.etsi.org/01903/v1.3.2#"
+# Inclusive C14N renders every in-scope namespace on the apex of a signed
+# subtree; both are declared on ds:Signature
+NS_DECLS = f' xmlns:ds="{DS_NS}" xmlns:etsi="{ETSI_NS}"'
+# Where NS_DECLS goes in a fragment: filled for its digest, empty when embedded
+NS_SLOT = "{ns}"
+
+C14N = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+RSA_SHA1 = "http://www.w3.org/2000/09/xmldsig#rsa-sha1"
+SHA1 = "http://www.w3.org/2000/09/xmldsig#sha1"
+ENVELOPED = "http://www.w3.org/2000/09/xmldsig#enveloped-signature"
+SIGNED_PROPERTIES_TYPE = "http://uri.etsi.org/01903#SignedProperties"
+
+ROOT_END = b"</factura>"
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _sha1_b64(data: bytes) -> str:
+    return _b64(hashlib.sha1(data).digest())
+
+
+def _int_b64(value: int) -> str:
+    return _b64(value.to_bytes((value.bit_length() + 7) // 8, "big"))
+
+
+class XadesSigner:
+    def __init__(self, private_key: rsa.RSAPrivateKey, certificate):
+        if not isinstance(private_key, rsa.RSAPrivateKey):
+            raise ValueError("SRI signatures need an RSA key")
+        self.private_key = private_key
+        der = certificate.public_bytes(serialization.Encoding.DER)
+        numbers = private_key.public_key().public_numbers()
+        # Per-certificate values, computed once
+        self.certificate_b64 = _b64(der)
+        self.certificate_digest = _sha1_b64(der)
+        self.issuer_name = escape(certificate.issuer.rfc4514_string())
+        self.serial_number = str(certificate.serial_number)
+        self.modulus = _int_b64(numbers.n)
+        self.exponent = _int_b64(numbers.e)
+
+    def sign(self, document: bytes, signing_time: Optional[datetime] = None) -> bytes:
+        """Append an enveloped XAdES-BES signature to a canonical comprobante"""
+        if not document.endswith(ROOT_END):
+            raise ValueError("Document must be a canonical <factura> element")
+        ids = secrets.randbelow(900000) + 100000
+        signature_id = f"Signature{ids}"
+        signed_properties_id = f"{signature_id}-SignedProperties{ids}"
+        certificate_id = f"Certificate{ids}"
+        reference_id = f"Reference-ID-{ids}"
+        signing_time = (signing_time or datetime.now(timezone.utc)).replace(microsecond=0).isoformat()
+
+        # The enveloped-signature transform removes the signature again, so
+        # the comprobante digest is over the unsigned document
+        document_digest = _sha1_b64(document)
+
+        signed_properties = (
+            f'<etsi:SignedProperties{NS_SLOT} Id="{signed_properties_id}">'
+            f'<etsi:SignedSignatureProperties>'
+            f'<etsi:SigningTime>{signing_time}</etsi:SigningTime>'
+            f'<etsi:SigningCertificate><etsi:Cert><etsi:CertDigest>'
+            f'<ds:DigestMethod Algorithm="{SHA1}"></ds:DigestMethod>'
+            f'<ds:DigestValue>{self.certificate_digest}</ds:DigestValue>'
+            f'</etsi:CertDigest><etsi:IssuerSerial>'
+            f'<ds:X509IssuerName>{self.issuer_name}</ds:X509IssuerName>'
+            f'<ds:X509SerialNumber>{self.serial_number}</ds:X509SerialNumber>'
+            f'</etsi:IssuerSerial></etsi:Cert></etsi:SigningCertificate>'
+            f'</etsi:SignedSignatureProperties>'
+            f'<etsi:SignedDataObjectProperties>'
+            f'<etsi:DataObjectFormat ObjectReference="#{reference_id}">'
+            f'<etsi:Description>contenido comprobante</etsi:Description>'
+            f'<etsi:MimeType>text/xml</etsi:MimeType>'
+            f'</etsi:DataObjectFormat>'
+            f'</etsi:SignedDataObjectProperties>'
+            f'</etsi:SignedProperties>'
+        )
+        key_info = (
+            f'<ds:KeyInfo{NS_SLOT} Id="{certificate_id}">'
+            f'<ds:X509Data><ds:X509Certificate>{self.certificate_b64}</ds:X509Certificate></ds:X509Data>'
+            f'<ds:KeyValue><ds:RSAKeyValue>'
+            f'<ds:Modulus>{self.modulus}</ds:Modulus><ds:Exponent>{self.exponent}</ds:Exponent>'
+            f'</ds:RSAKeyValue></ds:KeyValue>'
+            f'</ds:KeyInfo>'
+        )
+        signed_info = (
+            f'<ds:SignedInfo{NS_SLOT} Id="Signature-SignedInfo{ids}">'
+            f'<ds:CanonicalizationMethod Algorithm="{C14N}"></ds:CanonicalizationMethod>'
+            f'<ds:SignatureMethod Algorithm="{RSA_SHA1}"></ds:SignatureMethod>'
+            f'<ds:Reference Id="SignedPropertiesID{ids}" Type="{SIGNED_PROPERTIES_TYPE}" URI="#{signed_properties_id}">'
+            f'<ds:DigestMethod Algorithm="{SHA1}"></ds:DigestMethod>'
+            f'<ds:DigestValue>{_sha1_b64(signed_properties.replace(NS_SLOT, NS_DECLS).encode())}</ds:DigestValue>'
+            f'</ds:Reference>'
+            f'<ds:Reference URI="#{certificate_id}">'
+            f'<ds:DigestMethod Algorithm="{SHA1}"></ds:DigestMethod>'
+            f'<ds:DigestValue>{_sha1_b64(key_info.replace(NS_SLOT, NS_DECLS).encode())}</ds:DigestValue>'
+            f'</ds:Reference>'
+            f'<ds:Reference Id="{reference_id}" URI="#comprobante">'
+            f'<ds:Transforms><ds:Transform Algorithm="{ENVELOPED}"></ds:Transform></ds:Transforms>'
+            f'<ds:DigestMethod Algorithm="{SHA1}"></ds:DigestMethod>'
+            f'<ds:DigestValue>{document_digest}</ds:DigestValue>'
+            f'</ds:Reference>'
+            f'</ds:SignedInfo>'
+        )
+        signature_value = self.private_key.sign(
+            signed_info.replace(NS_SLOT, NS_DECLS).encode(), padding.PKCS1v15(), hashes.SHA1()
+        )
+
+        signature = (
+            f'<ds:Signature{NS_DECLS} Id="{signature_id}">'
+            f'{signed_info.replace(NS_SLOT, "")}'
+            f'<ds:SignatureValue Id="SignatureValue{ids}">{_b64(signature_value)}</ds:SignatureValue>'
+            f'{key_info.replace(NS_SLOT, "")}'
+            f'<ds:Object Id="{signature_id}-Object{ids}">'
+            f'<etsi:QualifyingProperties Target="#{signature_id}">'
+            f'{signed_properties.replace(NS_SLOT, "")}'
+            f'</etsi:QualifyingProperties>'
+            f'</ds:Object>'
+            f'</ds:Signature>'
+        )
+        return (
+            b'<?xml version="1.0" encoding="UTF-8"?>'
+            + document[:-len(ROOT_END)] + signature.encode() + ROOT_END
+        )
+
+
+@lru_cache(maxsize=4)
+def _load_signer(path: str, password: Optional[str], mtime: float) -> XadesSigner:
+    with open(path, "rb") as f:
+        private_key, certificate, _ = pkcs12.load_key_and_certificates(
+            f.read(), password.encode() if password else None
+        )
+    if private_key is None or certificate is None:
+        raise ValueError(f"{path} does not contain a private key and certificate")
+    print(f"Loaded SRI signing certificate {certificate.subject.rfc4514_string()}")
+    return XadesSigner(private_key, certificate)
+
+
+def load_signer(path: str, password: Optional[str] = None) -> XadesSigner:
+    """Parsed signer for a PKCS#12 file; cached until the file changes"""
+    return _load_signer(path, password, os.path.getmtime(path))
+
+
+def signer_cache_info():
+    return _load_signer.cache_info()